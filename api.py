@@ -3,35 +3,149 @@ import logging
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
-from utils.provider_utils import initialize_providers 
+import asyncio
+import importlib
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable
+from utils.provider_utils import initialize_providers
+from utils.provider_registry import ProviderRegistry
 from routes.chat import create_chat_routes
 from routes.models import create_model_routes
-from routes.tts import router as tts_router
-from routes.transcriptions import create_transcription_routes
-from routes.images import router as images_router
-from routes.me import router as me_router
-from routes.moderations import router as moderations_router
+from routes.batches import create_batch_routes
+from routes.health import create_health_routes
+from routes.metrics import create_metrics_routes
+from routes.admin import create_admin_routes
+from utils.metrics import MetricsMiddleware
+from utils.tracing import TracingMiddleware
+from utils.profiling import slow_request_profiler
+from utils.reset_scheduler import start_reset_scheduler, stop_reset_scheduler
+from utils.logger import provider_logger
+from config import QUOTA_MODE, API_HOST, API_PORT, API_WORKERS, SHARED_STATE_BACKEND, PROVIDER_RELOAD_INTERVAL, SHUTDOWN_DRAIN_TIMEOUT
+from services.storage import get_user_store
+from services.shared_state import get_shared_state
 
 PROVIDER_DIRECTORY = "providers"
 
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Routers that ship separately; each is imported at startup only if present.
+OPTIONAL_ROUTES = [
+    ("routes.tts", "router"),
+    ("routes.transcriptions", "create_transcription_routes"),
+    ("routes.images", "router"),
+    ("routes.me", "router"),
+    ("routes.moderations", "router"),
+]
 
 logging.basicConfig(level=logging.INFO)
 
-client = httpx.AsyncClient(timeout=150)
 
-providers = initialize_providers(client, PROVIDER_DIRECTORY)
+def include_optional_routes(app: FastAPI, providers: dict) -> list:
+    included = []
+    for module_name, attribute in OPTIONAL_ROUTES:
+        try:
+            module = importlib.import_module(module_name)
+        except ModuleNotFoundError as e:
+            if e.name != module_name:
+                raise
+            continue
+        target = getattr(module, attribute)
+        if attribute == "router":
+            app.include_router(target)
+        else:
+            target(app, providers)
+        included.append(module_name)
+    return included
+
+
+def load_provider_directory(client: httpx.AsyncClient) -> dict:
+    return initialize_providers(client, PROVIDER_DIRECTORY)
+
+
+def create_app(load_providers: Callable[[httpx.AsyncClient], dict] = load_provider_directory) -> FastAPI:
+    """Build the API. Each worker process calls this once (``uvicorn --factory``).
+
+    ``load_providers`` runs in a thread during startup, and again on every
+    provider reload, and returns the provider instances by id; benchmarks pass
+    one that returns mock providers.
+    """
+    client = httpx.AsyncClient(timeout=150)
+    # Filled in by the lifespan and swapped on reload; routes hold this dict, so they see the current providers.
+    providers = {}
+    watch_directory = PROVIDER_DIRECTORY if load_providers is load_provider_directory else None
+    registry = ProviderRegistry(providers, lambda: load_providers(client), watch_directory)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.ready = False
+        app.state.startup = startup = {}
+        started = time.perf_counter()
+
+        await asyncio.to_thread(get_user_store().ensure_indexes)
+        startup["user_store"] = "ok"
+
+        startup["provider_sessions"] = await registry.install(await asyncio.to_thread(registry.load))
+        startup["providers"] = sorted(providers)
+        startup["optional_routes"] = include_optional_routes(app, providers)
+
+        # Workers forked by one master share its pid; only the first of them resumes
+        # batches so unfinished items are not run (and billed) once per worker.
+        if API_WORKERS == 1 or await asyncio.to_thread(get_shared_state().claim, f"batch_resume:{os.getppid()}", 86400):
+            batch_runner.resume()
+            startup["batch_resume"] = True
+        if QUOTA_MODE == "reset":
+            start_reset_scheduler()
+        if PROVIDER_RELOAD_INTERVAL > 0:
+            registry.start_watching()
+
+        startup["seconds"] = round(time.perf_counter() - started, 3)
+        app.state.ready = True
+        try:
+            yield
+        finally:
+            app.state.ready = False
+            stop_reset_scheduler()
+            slow_request_profiler.disable()
+            if not await registry.shutdown(SHUTDOWN_DRAIN_TIMEOUT):
+                provider_logger.warning("Stopped providers with requests still in flight after %ss", SHUTDOWN_DRAIN_TIMEOUT)
+            await client.aclose()
+
+    app = FastAPI(lifespan=lifespan)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(TracingMiddleware)
+
+    create_health_routes(app, providers)
+    create_metrics_routes(app)
+    create_admin_routes(app, registry)
+    create_chat_routes(app, registry, client)
+    create_model_routes(app, providers)
+    batch_runner = create_batch_routes(app, registry)
+    return app
+
+
+def __getattr__(name):
+    # Keeps "uvicorn api:app" working without building an app on every import.
+    global app
+    if name == "app":
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def run(host: str = API_HOST, port: int = API_PORT, workers: int = API_WORKERS) -> None:
+    if workers > 1 and SHARED_STATE_BACKEND == "local":
+        raise SystemExit("API_WORKERS > 1 needs a process-wide SHARED_STATE_BACKEND such as 'sqlite'")
+    # On SIGINT/SIGTERM uvicorn stops accepting connections and lets open streams finish before the lifespan shutdown.
+    uvicorn.run("api:create_app", factory=True, host=host, port=port, workers=workers, timeout_graceful_shutdown=SHUTDOWN_DRAIN_TIMEOUT)
 
-create_chat_routes(app, providers, client)
-create_model_routes(app, providers)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    run()
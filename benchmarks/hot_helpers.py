@@ -0,0 +1,136 @@
+"""Per-call cost of the helpers that run on every request or chunk.
+
+    python -m benchmarks.hot_helpers
+    python -m benchmarks.hot_helpers --save benchmarks/hot_helpers_baseline.json
+    python -m benchmarks.hot_helpers --baseline benchmarks/hot_helpers_baseline.json
+
+Times each helper with ``timeit`` (best of --repeat) and reports ns per call.
+``legacy_*`` entries are the previous implementations, kept here for comparison:
+ids built with ``random.choices`` behind an ``await``, chunk dicts built from
+scratch, and the model name prettifier evaluated on every /v1/models request.
+With --baseline it exits non-zero when a current helper is slower than its
+baseline by more than --max-regression (default 25%).
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import sys
+import time
+import timeit
+
+from routes.models import pretty_model_name
+from utils.common import ChunkTemplate, new_chatcmpl_id, new_system_fingerprint
+from utils.token_utils import calculate_tokens, get_output_length
+
+MODEL_NAMES = ["gpt-4o", "gpt-4o-mini", "claude-3-5-sonnet", "llama-3.1-405b-instruct", "c1.2"]
+DELTA = {"role": "assistant", "content": "token token token token "}
+RESPONSE = {"choices": [{"index": 0, "message": {"role": "assistant", "content": "token " * 200}, "finish_reason": "stop"}]}
+
+
+async def legacy_generate_chatcmpl_id():
+    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=29))
+    return f"chatcmpl-{random_str}"
+
+
+async def legacy_generate_system_fingerprint():
+    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=9))
+    return f"fp_{random_str}"
+
+
+def legacy_chunk(delta, chatcmpl_id, model, system_fingerprint):
+    return {
+        "id": chatcmpl_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": None, "content_filter_results": None}],
+        "system_fingerprint": system_fingerprint,
+    }
+
+
+def legacy_pretty_model_name(model_name):
+    return ''.join(c.lower() if i > 0 and c.isupper() and model_name[i-1].isdigit() else c for i, c in enumerate(model_name.replace("-", " ").title().replace("Gpt", "GPT")))
+
+
+def await_in_loop(factory):
+    # The legacy id helpers were awaited from a running coroutine; time them the same way.
+    loop = asyncio.new_event_loop()
+
+    async def batch(number):
+        for _ in range(number):
+            await factory()
+
+    return lambda number: loop.run_until_complete(batch(number))
+
+
+def cases():
+    template = ChunkTemplate("chatcmpl-x", "gpt-4o", "fp_x", choice_fields={"content_filter_results": None})
+    return {
+        "chatcmpl_id": lambda: new_chatcmpl_id(),
+        "system_fingerprint": lambda: new_system_fingerprint(),
+        "chunk": lambda: template.chunk(DELTA),
+        "pretty_model_name": lambda: [pretty_model_name(name) for name in MODEL_NAMES],
+        "get_output_length": lambda: get_output_length(RESPONSE),
+        "calculate_tokens": lambda: calculate_tokens(1200, 800, 0.00000009),
+    }
+
+
+def legacy_cases():
+    return {
+        "legacy_chatcmpl_id": await_in_loop(legacy_generate_chatcmpl_id),
+        "legacy_system_fingerprint": await_in_loop(legacy_generate_system_fingerprint),
+        "legacy_chunk": lambda: legacy_chunk(DELTA, "chatcmpl-x", "gpt-4o", "fp_x"),
+        "legacy_pretty_model_name": lambda: [legacy_pretty_model_name(name) for name in MODEL_NAMES],
+    }
+
+
+def measure(function, number: int, repeat: int, batched: bool = False) -> float:
+    if batched:
+        best = min(timeit.repeat(lambda: function(number), number=1, repeat=repeat))
+    else:
+        best = min(timeit.repeat(function, number=number, repeat=repeat))
+    return round(best / number * 1e9, 1)
+
+
+def check(report: dict, baseline: dict, max_regression: float) -> list:
+    failures = []
+    for name, ns in report["ns_per_call"].items():
+        reference = baseline["ns_per_call"].get(name)
+        if reference and ns > reference * (1 + max_regression):
+            failures.append(f"{name} {ns}ns exceeds {reference * (1 + max_regression):.1f}ns (baseline {reference}ns)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-call cost of the helpers that run on every request or chunk.")
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline")
+    parser.add_argument("--save")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    args = parser.parse_args()
+
+    current = {name: measure(function, args.number, args.repeat) for name, function in cases().items()}
+    legacy = {}
+    for name, function in legacy_cases().items():
+        legacy[name] = measure(function, args.number, args.repeat, batched=name in ("legacy_chatcmpl_id", "legacy_system_fingerprint"))
+    report = {"ns_per_call": current, "legacy_ns_per_call": legacy}
+    print(json.dumps(report, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"ns_per_call": current}, f, indent=2)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check(report, json.load(f), args.max_regression)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Cold-start import profile of the API process.
+
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --save benchmarks/import_baseline.json
+    python -m benchmarks.import_profile --baseline benchmarks/import_baseline.json
+
+Imports ``api`` in fresh interpreters under ``-X importtime`` and reports the
+median total import time plus the slowest modules by cumulative time. With
+--baseline it exits non-zero when the median regresses by more than
+--max-regression (default 20%) or a module listed in --forbid is imported.
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+FORBIDDEN = ["duckduckgo_search", "PyCharacterAI", "discord"]
+
+
+def profile_once(module: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    cumulative = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        cumulative[name] = int(cumulative_us)
+        if len(indent) == 1:
+            total += int(cumulative_us)
+    return {"total_ms": total / 1000, "modules": cumulative}
+
+
+def profile(module: str, runs: int, top: int) -> dict:
+    samples = [profile_once(module) for _ in range(runs)]
+    last = samples[-1]["modules"]
+    slowest = sorted(last.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": round(statistics.median(sample["total_ms"] for sample in samples), 1),
+        "max_ms": round(max(sample["total_ms"] for sample in samples), 1),
+        "imported": sorted(last),
+        "slowest": [{"module": name, "cumulative_ms": round(us / 1000, 1)} for name, us in slowest],
+    }
+
+
+def check(report: dict, baseline: dict, max_regression: float, forbidden: list) -> list:
+    failures = []
+    limit = baseline["median_ms"] * (1 + max_regression)
+    if report["median_ms"] > limit:
+        failures.append(f"median import {report['median_ms']}ms exceeds {limit:.1f}ms (baseline {baseline['median_ms']}ms)")
+    for name in forbidden:
+        if any(imported == name or imported.startswith(name + ".") for imported in report["imported"]):
+            failures.append(f"{name} is imported at startup")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import profile of the API process.")
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--baseline")
+    parser.add_argument("--save")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--forbid", nargs="*", default=FORBIDDEN)
+    args = parser.parse_args()
+
+    report = profile(args.module, args.runs, args.top)
+    summary = {key: value for key, value in report.items() if key != "imported"}
+    print(json.dumps(summary, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"module": report["module"], "median_ms": report["median_ms"]}, f, indent=2)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check(report, json.load(f), args.max_regression, args.forbid)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
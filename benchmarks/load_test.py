@@ -0,0 +1,230 @@
+"""End-to-end load test of /v1/chat/completions against a mock provider.
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --concurrency 8 64 --duration 15 --ttft 0.3 --tokens-per-second 80
+    python -m benchmarks.load_test --save benchmarks/load_baseline.json
+    python -m benchmarks.load_test --baseline benchmarks/load_baseline.json
+
+Starts the API under uvicorn with ``MockProvider`` as its only provider, an
+in-memory user store seeded with one owner-plan user, and the Discord webhook
+pointed at a local stub. Each scenario (streaming and non-streaming, at every
+--concurrency) drives the endpoint for --duration seconds and reports req/s,
+p50/p99 latency, p50/p99 time to first token (streaming), server CPU time per
+request and server RSS growth per in-flight stream. With --baseline it exits
+non-zero when req/s drops or a latency rises by more than --max-regression.
+Server CPU and memory are read from /proc, so they are only reported on Linux.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+
+from benchmarks.mocks import MOCK_MODEL, MemoryUserStore, MockProvider, StubWebhook
+
+SETTINGS_VARIABLE = "OZONE_LOAD_TEST_SETTINGS"
+API_KEY = "sk-ozone-load-test"
+# (metric, True when higher is better), compared against the baseline.
+COMPARED = [("rps", True), ("p50_ms", False), ("p99_ms", False), ("ttft_p50_ms", False), ("ttft_p99_ms", False)]
+
+
+def bench_app():
+    import api
+    import utils.discord_logger
+    from services.storage import use_user_store
+    from services.user_service import UserService
+
+    settings = json.loads(os.environ[SETTINGS_VARIABLE])
+    store = MemoryUserStore()
+    use_user_store(store)
+    UserService(store=store).create_user(API_KEY, {"plan": "owner", "discord_id": "0"})
+    utils.discord_logger.DISCORD_WEBHOOK_URL = settings["webhook_url"]
+    return api.create_app(load_providers=lambda client: {"mock": MockProvider(client, **settings["provider"])})
+
+
+def percentile(values: list, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * fraction), len(values) - 1)] * 1000, 2)
+
+
+def process_usage(pid: int) -> Optional[dict]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return {"cpu": (int(fields[11]) + int(fields[12])) / ticks, "rss_kb": rss_kb}
+
+
+def wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/readyz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} did not become ready within {timeout}s")
+
+
+async def drive(url: str, stream: bool, concurrency: int, duration: float, pid: int) -> dict:
+    latencies, ttfts = [], []
+    errors = 0
+    peak_rss_kb = 0
+    body = {"model": MOCK_MODEL, "messages": [{"role": "user", "content": "Say something."}], "stream": stream}
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    deadline = time.perf_counter() + duration
+
+    async def one(client):
+        nonlocal errors
+        started = time.perf_counter()
+        if not stream:
+            response = await client.post(url, json=body, headers=headers)
+            if response.status_code != 200 or "error" in response.json():
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            return
+        first_token = None
+        failed = False
+        async with client.stream("POST", url, json=body, headers=headers) as response:
+            if response.status_code != 200:
+                errors += 1
+                return
+            async for line in response.aiter_lines():
+                if first_token is None and '"content"' in line:
+                    first_token = time.perf_counter() - started
+                if line.startswith("data: {\"error\""):
+                    failed = True
+        if failed:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - started)
+        if first_token is not None:
+            ttfts.append(first_token)
+
+    async def worker(client):
+        while time.perf_counter() < deadline:
+            await one(client)
+
+    async def sample_rss():
+        nonlocal peak_rss_kb
+        while time.perf_counter() < deadline:
+            usage = process_usage(pid)
+            if usage:
+                peak_rss_kb = max(peak_rss_kb, usage["rss_kb"])
+            await asyncio.sleep(0.1)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    before = process_usage(pid)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        await asyncio.gather(sample_rss(), *(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    after = process_usage(pid)
+
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(latencies, 0.5),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+    if stream:
+        result["ttft_p50_ms"] = percentile(ttfts, 0.5)
+        result["ttft_p99_ms"] = percentile(ttfts, 0.99)
+    if before and after and latencies:
+        result["cpu_ms_per_request"] = round((after["cpu"] - before["cpu"]) / len(latencies) * 1000, 3)
+        result["rss_kb_per_stream"] = round(max(peak_rss_kb - before["rss_kb"], 0) / concurrency, 1)
+    return result
+
+
+def check(report: dict, baseline: dict, max_regression: float) -> list:
+    failures = []
+    for name, result in report["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            current, reference = result.get(metric), previous.get(metric)
+            if current is None or not reference:
+                continue
+            change = (reference - current) / reference if higher_is_better else (current - reference) / reference
+            if change > max_regression:
+                failures.append(f"{name} {metric} {current} vs baseline {reference} ({change:+.0%})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of /v1/chat/completions against a mock provider.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--modes", nargs="+", choices=["stream", "non_stream"], default=["stream", "non_stream"])
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--baseline")
+    parser.add_argument("--save")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    args = parser.parse_args()
+
+    provider = {
+        "ttft": args.ttft,
+        "tokens_per_second": args.tokens_per_second,
+        "error_rate": args.error_rate,
+        "chunk_size": args.chunk_size,
+        "output_tokens": args.output_tokens,
+        "seed": 0,
+    }
+    report = {"provider": provider, "duration": args.duration, "scenarios": {}}
+    url = f"http://127.0.0.1:{args.port}"
+
+    with StubWebhook() as webhook:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmarks.load_test:bench_app", "--factory",
+             "--port", str(args.port), "--log-level", "warning"],
+            env={**os.environ, SETTINGS_VARIABLE: json.dumps({"provider": provider, "webhook_url": webhook.url})},
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(url)
+            for mode in args.modes:
+                for concurrency in args.concurrency:
+                    report["scenarios"][f"{mode}_c{concurrency}"] = asyncio.run(
+                        drive(f"{url}/v1/chat/completions", mode == "stream", concurrency, args.duration, server.pid)
+                    )
+        finally:
+            server.terminate()
+            server.wait()
+        report["webhooks_received"] = webhook.received
+
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check(report, json.load(f), args.max_regression)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Logging cost on the request path, per request.
+
+    python -m benchmarks.logging_overhead
+    python -m benchmarks.logging_overhead --requests 20000 --sample-rate 0.1
+
+Emits the lines a successful chat completion logs (start, model, auth) for
+--requests simulated requests and reports the time spent on the calling thread,
+which is the event loop in the API. ``sync_fstring`` is the previous setup:
+handlers attached directly to the logger and messages built with f-strings.
+Files are written to a scratch directory.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+
+
+def sync_logger(directory: str) -> logging.Logger:
+    logger = logging.getLogger("bench_sync")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for handler in (logging.StreamHandler(open(os.devnull, "w")), RotatingFileHandler(os.path.join(directory, "sync.log"), maxBytes=10 * 1024 * 1024, backupCount=5)):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+def run_fstring(logger: logging.Logger, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_id = str(uuid.uuid4())
+        logger.info(f"Request {request_id}: Starting chat completion request for model gpt-4o")
+        logger.info(f"Request {request_id}: Processing model gpt-4o")
+        logger.info(f"Request {request_id}: Authenticated user {request_id[:8]}")
+    return time.perf_counter() - started
+
+
+def run_deferred(logger: logging.Logger, requests: int, request_id_var) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_id = str(uuid.uuid4())
+        request_id_var.set(request_id)
+        logger.info("Request %s: Starting chat completion request for model %s", request_id, "gpt-4o")
+        logger.info("Request %s: Processing model %s", request_id, "gpt-4o")
+        logger.info("Request %s: Authenticated user %s", request_id, request_id[:8])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logging cost on the request path, per request.")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sys.path.insert(0, os.getcwd())
+        os.chdir(directory)
+        # Keep the console handler from flooding the terminal.
+        sys.stdout = open(os.devnull, "w")
+        from utils.logger import setup_logger, request_id_var, stop_logging
+
+        timings = {
+            "sync_fstring": run_fstring(sync_logger(directory), args.requests),
+            "queue_text": run_deferred(setup_logger("bench_text", "text.log", log_format="text"), args.requests, request_id_var),
+            "queue_json": run_deferred(setup_logger("bench_json", "json.log", log_format="json"), args.requests, request_id_var),
+            f"queue_json_sampled_{args.sample_rate}": run_deferred(
+                setup_logger("bench_sampled", "sampled.log", log_format="json", sample_rate=args.sample_rate), args.requests, request_id_var
+            ),
+        }
+        drain_started = time.perf_counter()
+        stop_logging()
+        drain = time.perf_counter() - drain_started
+        sys.stdout = sys.__stdout__
+
+    report = {name: {"us_per_request": round(seconds / args.requests * 1e6, 2)} for name, seconds in timings.items()}
+    report["listener_drain_s"] = round(drain, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Stand-ins for the upstream provider, the user store and the Discord webhook.
+
+Used by the load test (``benchmarks.load_test``) so the API can be driven end to
+end without Character.AI, MongoDB or Discord.
+"""
+import asyncio
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from services.storage import UserStore
+from utils.providers.base import BaseProvider, ChatDelta, RequestBody
+from utils.quota import refilled_balance
+
+MOCK_MODEL = "mock-model"
+
+
+class MockProvider(BaseProvider):
+    """Synthetic provider with a configurable time to first token and token rate.
+
+    Tokens are ``chunk_size``-token groups of the word "token"; ``error_rate`` of
+    requests fail after the first-token delay.
+    """
+
+    def __init__(self, async_client=None, ttft: float = 0.2, tokens_per_second: float = 50, error_rate: float = 0.0,
+                 chunk_size: int = 4, output_tokens: int = 200, seed: Optional[int] = None):
+        super().__init__(async_client, name="mock")
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.output_tokens = output_tokens
+        self.random = random.Random(seed)
+        self.costs = {MOCK_MODEL: 0.00000009}
+        self.models = list(self.costs)
+
+    async def stream_chat(self, body: RequestBody):
+        await asyncio.sleep(self.ttft)
+        if self.random.random() < self.error_rate:
+            raise RuntimeError("Mock provider error")
+
+        chunk_delay = self.chunk_size / self.tokens_per_second
+        content = "token " * self.chunk_size
+        for sent in range(0, self.output_tokens, self.chunk_size):
+            if sent:
+                await asyncio.sleep(chunk_delay)
+            yield ChatDelta(content, role="assistant")
+
+
+class MemoryUserStore(UserStore):
+    """Dict-backed user store, for a single process."""
+
+    def __init__(self):
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _project(document: Optional[Dict[str, Any]], fields: Optional[Iterable[str]]) -> Optional[Dict[str, Any]]:
+        if document is None:
+            return None
+        if fields is None:
+            return dict(document)
+        projected = {"_id": document["_id"]}
+        projected.update((field, document.get(field)) for field in fields)
+        return projected
+
+    def _by_discord_id(self, discord_id: str) -> Optional[Dict[str, Any]]:
+        return next((document for document in self.documents.values() if document.get("discord_id") == discord_id), None)
+
+    def get_by_api_key(self, api_key: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        return self._project(self.documents.get(api_key), fields)
+
+    def get_by_discord_id(self, discord_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        return self._project(self._by_discord_id(discord_id), fields)
+
+    def insert(self, document: Dict[str, Any]) -> None:
+        with self.lock:
+            self.documents[document["_id"]] = dict(document)
+
+    def bulk_insert(self, documents: Iterable[Dict[str, Any]]) -> int:
+        inserted = 0
+        with self.lock:
+            for document in documents:
+                if document["_id"] not in self.documents:
+                    self.documents[document["_id"]] = dict(document)
+                    inserted += 1
+        return inserted
+
+    def increment_tokens(self, api_key: str, amount: float) -> bool:
+        with self.lock:
+            document = self.documents.get(api_key)
+            if document is None:
+                return False
+            document["current_tokens"] = (document.get("current_tokens") or 0) + amount
+            return True
+
+    def refill_and_increment(self, api_key: str, amount: float, now: float, period: float) -> bool:
+        with self.lock:
+            document = self.documents.get(api_key)
+            if document is None:
+                return False
+            balance = refilled_balance(
+                document.get("current_tokens") or 0,
+                document.get("daily_token_limit"),
+                document.get("last_refill") or document.get("last_reset"),
+                now,
+                period,
+            )
+            document["current_tokens"] = balance + amount
+            document["last_refill"] = now
+            return True
+
+    def set_fields(self, api_key: str, fields: Dict[str, Any]) -> bool:
+        with self.lock:
+            document = self.documents.get(api_key)
+            if document is None:
+                return False
+            document.update(fields)
+            return True
+
+    def set_fields_by_discord_id(self, discord_id: str, fields: Dict[str, Any]) -> bool:
+        with self.lock:
+            document = self._by_discord_id(discord_id)
+            if document is None:
+                return False
+            document.update(fields)
+            return True
+
+    def rekey(self, api_key: str, new_api_key: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+        with self.lock:
+            document = self.documents.pop(api_key, None)
+            if document is None:
+                return new_api_key in self.documents
+            self.documents[new_api_key] = {**document, **(fields or {}), "_id": new_api_key}
+            return True
+
+    def iter_users(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        for document in list(self.documents.values()):
+            yield dict(document)
+
+    def count(self) -> int:
+        return len(self.documents)
+
+
+class StubWebhook:
+    """Accepts Discord webhook posts on 127.0.0.1 and counts them."""
+
+    def __init__(self, port: int = 0):
+        stub = self
+        self.received = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.received += 1
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/webhook"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
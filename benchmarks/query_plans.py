@@ -0,0 +1,33 @@
+"""Fail when any MongoDB user query falls back to a collection scan.
+
+    python -m benchmarks.query_plans --mongodb-uri mongodb://localhost:27017
+
+Creates the store's indexes, explains every query shape UserService issues and
+exits non-zero if a winning plan contains COLLSCAN.
+"""
+import argparse
+import json
+import sys
+import time
+
+from config import MONGODB_URI
+from services.storage import MongoUserStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when any MongoDB user query does a collection scan.")
+    parser.add_argument("--mongodb-uri", default=MONGODB_URI)
+    parser.add_argument("--database", default="ozone_db")
+    args = parser.parse_args()
+
+    store = MongoUserStore(args.mongodb_uri, database=args.database)
+    store.ensure_indexes()
+    scans = store.collection_scans(time.time())
+    if scans:
+        print(json.dumps(scans, indent=2))
+        sys.exit(1)
+    print(f"No collection scans across {len(store.query_filters(time.time()))} query shapes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Decode cost of large /v1/chat/completions bodies.
+
+    python -m benchmarks.request_decoding
+    python -m benchmarks.request_decoding --tokens 100000 --messages 2000 --image-every 50
+
+Builds a conversation of about --tokens tokens (4 characters per token) split
+over --messages messages, with an image part on every --image-every-th message,
+and times two ways of getting from body bytes to a request plus its input length:
+
+``legacy``   json.loads, ChatCompletionRequest validation of the whole body, then
+             separate walks over the messages for the input length and the
+             ``:web`` query (text-only content; image messages are left out
+             because the old sum() fails on them).
+``decoder``  utils.request_decoding.decode_chat_request: one orjson parse and one
+             walk that checks the messages and measures them.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from utils.base import ChatCompletionRequest
+from utils.request_decoding import decode_chat_request
+
+
+def conversation(tokens: int, messages: int, image_every: int, text_only: bool = False) -> bytes:
+    per_message = max(tokens * 4 // messages, 1)
+    history = []
+    for index in range(messages):
+        role = "user" if index % 2 == 0 else "assistant"
+        text = ("lorem ipsum " * (per_message // 12 + 1))[:per_message]
+        if not text_only and image_every and index % image_every == 0 and role == "user":
+            content = [{"type": "text", "text": text}, {"type": "image_url", "image_url": {"url": "https://example.com/image.png"}}]
+        else:
+            content = text
+        history.append({"role": role, "content": content})
+    return json.dumps({"model": "gpt-4o", "messages": history, "stream": True}).encode()
+
+
+def legacy(body: bytes) -> int:
+    request = ChatCompletionRequest(**json.loads(body))
+    input_length = sum(len(msg['content']) for msg in request.messages)
+    " ".join(msg['content'] for msg in request.messages)
+    return input_length
+
+
+def decoder(body: bytes) -> int:
+    request, stats = decode_chat_request(body)
+    return stats.input_length
+
+
+def timed(function, body: bytes, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function(body)
+        samples.append(time.perf_counter() - started)
+    return {"median_ms": round(statistics.median(samples) * 1000, 3), "min_ms": round(min(samples) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode cost of large /v1/chat/completions bodies.")
+    parser.add_argument("--tokens", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--image-every", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    text_body = conversation(args.tokens, args.messages, args.image_every, text_only=True)
+    mixed_body = conversation(args.tokens, args.messages, args.image_every)
+    report = {
+        "body_bytes": len(mixed_body),
+        "legacy_text_only": timed(legacy, text_body, args.runs),
+        "decoder_text_only": timed(decoder, text_body, args.runs),
+        "decoder_with_images": timed(decoder, mixed_body, args.runs),
+    }
+    report["speedup"] = round(report["legacy_text_only"]["median_ms"] / report["decoder_text_only"]["median_ms"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
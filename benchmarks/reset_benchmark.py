@@ -0,0 +1,106 @@
+"""Set-based token resets at scale.
+
+    python -m benchmarks.reset_benchmark --users 100000 1000000
+    python -m benchmarks.reset_benchmark --users 100000 --row-by-row
+    python -m benchmarks.reset_benchmark --mongodb-uri mongodb://localhost:27017
+
+Each run populates a scratch store with users whose last reset is a day old and
+times one reset_to_plan_limits + reset_expired_daily_limits pass. --row-by-row
+also times the old SELECT-then-UPDATE-per-user loop for comparison.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from services.storage import MongoUserStore, SqliteUserStore
+from services.user_service import plans
+
+
+def plan_limits():
+    return {name: plan["tokens_per_day"] for name, plan in plans.items()}
+
+
+def stale_users(count: int):
+    stale = time.time() - 2 * 86400
+    plan_names = list(plans)
+    for i in range(count):
+        yield {
+            "_id": f"sk-ozone-bench-{i:012d}",
+            "current_tokens": 0.0,
+            "tokens": 0.0,
+            "last_reset": stale,
+            "plan": random.choice(plan_names),
+            "plan_expiration": None,
+            "daily_token_limit": 0.25,
+            "daily_token_expiration": stale,
+            "discord_id": str(10 ** 17 + i),
+        }
+
+
+def set_based_reset(store) -> dict:
+    now = time.time()
+    started = time.perf_counter()
+    reset = store.reset_to_plan_limits(plan_limits(), plans["default"]["tokens_per_day"], now - 86400, now)
+    daily = store.reset_expired_daily_limits(now)
+    return {"seconds": round(time.perf_counter() - started, 3), "reset": reset, "daily_reset": daily}
+
+
+def row_by_row_reset(store) -> dict:
+    now = time.time()
+    started = time.perf_counter()
+    for user in list(store.iter_users()):
+        if user["last_reset"] is None or now >= user["last_reset"] + 86400:
+            store.set_fields(user["_id"], {
+                "current_tokens": plans.get(user["plan"], plans["default"])["tokens_per_day"],
+                "last_reset": now,
+            })
+    return {"seconds": round(time.perf_counter() - started, 3)}
+
+
+def populate_stale(store, users: int) -> None:
+    batch = []
+    for document in stale_users(users):
+        batch.append(document)
+        if len(batch) == 10000:
+            store.bulk_insert(batch)
+            batch = []
+    store.bulk_insert(batch)
+
+
+def run(store, users: int, row_by_row: bool) -> dict:
+    populate_stale(store, users)
+    result = {"set_based": set_based_reset(store)}
+    if row_by_row:
+        # Mark everyone stale again so the loop does the same amount of work.
+        stale = time.time() - 2 * 86400
+        store.reset_to_plan_limits(plan_limits(), 0, time.time(), stale)
+        result["row_by_row"] = row_by_row_reset(store)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Set-based token resets at scale.")
+    parser.add_argument("--users", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--row-by-row", action="store_true")
+    parser.add_argument("--mongodb-uri")
+    args = parser.parse_args()
+
+    report = {}
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as directory:
+            report[f"sqlite_{users}"] = run(SqliteUserStore(os.path.join(directory, "bench.db")), users, args.row_by_row)
+        if args.mongodb_uri:
+            store = MongoUserStore(args.mongodb_uri, database="ozone_reset_benchmark")
+            try:
+                report[f"mongodb_{users}"] = run(store, users, args.row_by_row)
+            finally:
+                store.client.drop_database("ozone_reset_benchmark")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Per-lookup latency of the user store backends.
+
+    python -m benchmarks.storage_benchmark --users 100000
+    python -m benchmarks.storage_benchmark --mongodb-uri mongodb://localhost:27017
+
+SQLite runs against a throwaway database file; MongoDB is only measured when a
+URI is given and uses a scratch database that is dropped afterwards. The
+``unknown_keys`` section times UserService lookups of keys that do not exist:
+``first`` reaches the store, ``repeat`` is answered by the negative key cache.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from services.storage import MongoUserStore, SqliteUserStore
+from services.user_service import UserService
+from utils.api_keys import negative_keys
+
+
+def make_users(count: int):
+    now = time.time()
+    for i in range(count):
+        yield {
+            "_id": f"sk-ozone-bench-{i:012d}",
+            "current_tokens": 1.0,
+            "tokens": 1.0,
+            "last_reset": now,
+            "plan": "default",
+            "plan_expiration": None,
+            "daily_token_limit": 0.25,
+            "daily_token_expiration": None,
+            "discord_id": str(10 ** 17 + i),
+        }
+
+
+def summarize(timings: list, lookups: int) -> dict:
+    timings.sort()
+    return {
+        "lookups": lookups,
+        "mean_us": round(statistics.mean(timings) * 1e6, 1),
+        "p50_us": round(timings[len(timings) // 2] * 1e6, 1),
+        "p99_us": round(timings[int(len(timings) * 0.99)] * 1e6, 1),
+    }
+
+
+def measure(store, users: int, lookups: int) -> dict:
+    keys = [f"sk-ozone-bench-{random.randrange(users):012d}" for _ in range(lookups)]
+    timings = []
+    for key in keys:
+        started = time.perf_counter()
+        store.get_by_api_key(key)
+        timings.append(time.perf_counter() - started)
+    return summarize(timings, lookups)
+
+
+def measure_unknown_keys(store, lookups: int) -> dict:
+    user_service = UserService(store)
+    keys = [f"sk-ozone-unknown-{i:012d}" for i in range(lookups)]
+    negative_keys.clear()
+    report = {}
+    for label in ("first", "repeat"):
+        timings = []
+        for key in keys:
+            started = time.perf_counter()
+            user_service.get_user_by_api_key(key)
+            timings.append(time.perf_counter() - started)
+        report[label] = summarize(timings, lookups)
+    return report
+
+
+def populate(store, users: int) -> float:
+    started = time.perf_counter()
+    batch = []
+    for document in make_users(users):
+        batch.append(document)
+        if len(batch) == 10000:
+            store.bulk_insert(batch)
+            batch = []
+    store.bulk_insert(batch)
+    return round(time.perf_counter() - started, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-lookup latency of the user store backends.")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--mongodb-uri")
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        store = SqliteUserStore(os.path.join(directory, "bench.db"))
+        report["sqlite"] = {"populate_s": populate(store, args.users), **measure(store, args.users, args.lookups)}
+        report["sqlite"]["unknown_keys"] = measure_unknown_keys(store, args.lookups)
+
+    if args.mongodb_uri:
+        store = MongoUserStore(args.mongodb_uri, database="ozone_storage_benchmark")
+        try:
+            report["mongodb"] = {"populate_s": populate(store, args.users), **measure(store, args.users, args.lookups)}
+            report["mongodb"]["unknown_keys"] = measure_unknown_keys(store, args.lookups)
+        finally:
+            store.client.drop_database("ozone_storage_benchmark")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Requests per second of the API from 1 to N worker processes.
+
+    python -m benchmarks.worker_scaling --workers 1 2 4
+    python -m benchmarks.worker_scaling --path /v1/models --duration 15 --clients 4
+
+Each round starts ``uvicorn --factory --workers N`` against a scratch SQLite user
+store, waits for /readyz, then drives --path from --clients load processes for
+--duration seconds. Run from the repository root on an otherwise idle host; the
+load processes share the machine, so leave cores for them.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+STORE_PATH_VARIABLE = "OZONE_BENCH_USER_STORE"
+
+
+def bench_app():
+    from services.storage import SqliteUserStore, use_user_store
+    import api
+
+    use_user_store(SqliteUserStore(os.environ[STORE_PATH_VARIABLE]))
+    return api.create_app()
+
+
+def wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/readyz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} did not become ready within {timeout}s")
+
+
+async def drive(url: str, concurrency: int, duration: float) -> list:
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(client):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get(url)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return latencies
+
+
+def load_process(args) -> list:
+    url, concurrency, duration = args
+    return asyncio.run(drive(url, concurrency, duration))
+
+
+def run_round(workers: int, args, store_path: str) -> dict:
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.worker_scaling:bench_app", "--factory",
+         "--workers", str(workers), "--port", str(args.port), "--log-level", "warning"],
+        env={**os.environ, STORE_PATH_VARIABLE: store_path},
+    )
+    try:
+        wait_ready(url)
+        with multiprocessing.Pool(args.clients) as pool:
+            batches = pool.map(load_process, [(url + args.path, args.concurrency, args.duration)] * args.clients)
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for batch in batches for latency in batch)
+    if not latencies:
+        raise SystemExit(f"No successful requests to {args.path} with {workers} workers")
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / args.duration, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests per second of the API from 1 to N worker processes.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--path", default="/v1/models")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    report = {"cpu_count": os.cpu_count(), "path": args.path, "rounds": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        store_path = os.path.join(directory, "bench.db")
+        for workers in args.workers:
+            report["rounds"][workers] = run_round(workers, args, store_path)
+
+    baseline = report["rounds"][args.workers[0]]["rps"]
+    for workers, result in report["rounds"].items():
+        result["speedup"] = round(result["rps"] / baseline, 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,4 +2,57 @@ API_VERSION = "API_VERSION_HERE"
 DISCORD_TOKEN = "DISCORD_BOT_TOKEN_HERE"
 USE_PROXY = True
 PROXY = "HTTP_PROXY_HERE: http://username:password@ip:host"
-MONGODB_URI = "MONGODB_CONNECTION_URI_HERE"
\ No newline at end of file
+MONGODB_URI = "MONGODB_CONNECTION_URI_HERE"
+DISCONNECT_POLL_INTERVAL = 0.25
+STREAM_BUFFER_HIGH_WATERMARK = 256 * 1024
+STREAM_BUFFER_LOW_WATERMARK = 64 * 1024
+STREAM_BUFFER_GLOBAL_LIMIT = 64 * 1024 * 1024
+STREAM_BUFFER_POLICY = "pause"
+PROVIDER_MAX_CONCURRENCY = 8
+MAX_CHOICES = 8
+BATCH_DB_PATH = "batches.db"
+BATCH_CONCURRENCY = 16
+BATCH_CHUNK_SIZE = 100
+BATCH_MAX_ITEMS = 50000
+BATCH_MAX_BODY_BYTES = 104857600
+ADMISSION_CAPACITY = 64
+ADMISSION_RESERVED = {"premium": 0.3}
+ADMISSION_AGING_SECONDS = 10.0
+ADMISSION_MAX_WAIT = 30.0
+ADMISSION_MAX_QUEUE = 1000
+USER_STORE_BACKEND = "mongodb"
+USER_STORE_SQLITE_PATH = "user_keys.db"
+RESET_PERIOD = "day"
+RESET_CHECK_INTERVAL = 300
+QUOTA_MODE = "lazy"
+QUOTA_REFILL_PERIOD = 86400
+API_KEY_HASH_SECRET = "API_KEY_HASH_SECRET_HERE"
+LEGACY_PLAINTEXT_KEYS = True
+NEGATIVE_KEY_CACHE_SIZE = 100000
+NEGATIVE_KEY_CACHE_TTL = 60
+DISCORD_RELAY_SECRET = ""
+API_HOST = "0.0.0.0"
+API_PORT = 8080
+API_WORKERS = 1
+SHARED_STATE_BACKEND = "local"
+SHARED_STATE_SQLITE_PATH = "shared_state.db"
+NEGATIVE_KEY_SYNC_INTERVAL = 1.0
+LOG_FORMAT = "text"
+LOG_SAMPLING = {}
+WEBHOOK_QUEUE_SIZE = 1000
+TRACE_LOG_MIN_DURATION = 0.0
+ADMIN_SECRET = ""
+PROFILE_THRESHOLD = 2.0
+PROFILE_INTERVAL = 0.005
+PROFILE_DIRECTORY = "logs/profiles"
+MODELS_CACHE_MAX_AGE = 60
+REQUEST_BODY_LIMIT = 1048576
+PROMPT_CACHE_SIZE = 256
+PROMPT_CACHE_TTL = 600
+PROMPT_CACHE_CHARS = 67108864
+CHAT_AFFINITY_SIZE = 10000
+CHAT_AFFINITY_TTL = 1800
+PROVIDER_RELOAD_INTERVAL = 2.0
+PROVIDER_WATCH = False
+PROVIDER_DRAIN_TIMEOUT = 300
+SHUTDOWN_DRAIN_TIMEOUT = 60
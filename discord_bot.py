@@ -4,12 +4,18 @@ from discord.app_commands import Choice
 import random
 import time
 import aiohttp
-from config import DISCORD_TOKEN
+from config import DISCORD_TOKEN, DISCORD_RELAY_SECRET, ADMIN_SECRET, API_PORT, SHUTDOWN_DRAIN_TIMEOUT
 from discord import app_commands
-from services.user_service import UserService, UserNotFoundError, DatabaseError
+from services.user_service import UserService, UserNotFoundError, DatabaseError, plans
 import asyncio 
 import subprocess
 
+# /ask and channel chat relay through the API as the user; without the secret every
+# relayed request would be rejected, so relaying is switched off instead.
+RELAY_ENABLED = bool(DISCORD_RELAY_SECRET)
+if not RELAY_ENABLED:
+    print("Warning: DISCORD_RELAY_SECRET is not set; /ask and channel chat are disabled. Set it to the same value as the API's config.")
+
 intents = discord.Intents.default()
 intents.message_content = True  
 bot = commands.Bot(command_prefix='!', intents=intents)
@@ -39,7 +45,7 @@ async def on_message(message):
     if message.author == bot.user:
         return
 
-    if message.channel.id in channel_model_mapping:
+    if RELAY_ENABLED and message.channel.id in channel_model_mapping:
         model = channel_model_mapping[message.channel.id]
         
         processing_message = await message.reply("Model is generating its response...")
@@ -51,7 +57,7 @@ async def on_message(message):
                 await processing_message.edit(content="Error: No API key found. Use `/manage` to generate a new key.")
                 return
             
-            api_key = user_data['api_key']
+            api_key = user_data.api_key
             start_time = time.time()
             response_data = await make_api_request(api_key, model, message.content)
             
@@ -68,10 +74,12 @@ async def on_message(message):
 
     await bot.process_commands(message)  
 
-async def make_api_request(api_key, model, prompt):
+async def make_api_request(key_id, model, prompt):
+    # Only key ids are stored, so the bot relays for the user with the relay secret.
     url = "https://api.ozone-ai.com/v1/chat/completions"
     headers = {
-        "Authorization": f"Bearer {api_key}",
+        "Authorization": f"Bearer {DISCORD_RELAY_SECRET}",
+        "X-Ozone-Key-Id": key_id,
         "Content-Type": "application/json"
     }
     payload = {
@@ -104,15 +112,10 @@ async def reset_tokens_internal(interaction: discord.Interaction, user_discord_i
             await interaction.response.send_message(embed=create_embed("Error", "User not found."), ephemeral=True)
             return
             
-        if time.time() - user_data['last_reset'] >= 86400:
-            user_plan = user_data.get('plan', 'default')
-            token_limit = plans[user_plan]['tokens_per_day']
-            api_key = user_data['api_key']
-            user_service.update_tokens(api_key, token_limit - user_data['current_tokens'])
-            user_service.users.find_one_and_update(
-                {"discord_id": user_discord_id},
-                {"$set": {"last_reset": time.time()}}
-            )  
+        if user_data.reset_available:
+            token_limit = plans[user_data.plan]['tokens_per_day']
+            api_key = user_data.api_key
+            user_service.reset_user_tokens(api_key, token_limit)
             await interaction.response.send_message(embed=create_embed("Credits Reset", "Credits reset successfully."), ephemeral=True)
         else:
             await interaction.response.send_message(embed=create_embed("Error", "You can only reset credits once every 24 hours."), ephemeral=True)
@@ -135,21 +138,14 @@ async def manage(interaction: discord.Interaction):
         user_data = user_service.get_user_data(discord_id)
         
         if user_data:
-            current_key = user_data['api_key']
-            last_reset = user_data['last_reset']
-            user_plan = user_data.get('plan', 'default')
-            reset_available = time.time() - last_reset >= 86400
-
-            token_amount = plans[user_plan]['tokens_per_day']
-
-            view = ConfirmationView(discord_id) if reset_available else None
+            view = ConfirmationView(discord_id) if user_data.reset_available else None
 
             await interaction.response.send_message(embeds=[
                 create_embed("Your API Key", 
-                    f"Your API key: \n```{current_key}```\nPlease don't share this with anyone.", 
+                    f"Your API key: \n```{user_data.key_hint}```\nThe full key is only shown when it is generated. Use `/regeneratekey` if you lost it.", 
                     discord.Color.green()),
                 create_embed("Credit Balance", 
-                    f"Your current balance:\n```${user_data['current_tokens']}```\nUse your money wisely!", 
+                    f"Your current balance:\n```${user_data.current_tokens}```\nUse your money wisely!", 
                     discord.Color.orange())
             ], view=view, ephemeral=True)
         else:
@@ -193,7 +189,7 @@ async def ask(
         user_data = user_service.get_user_data(discord_id)
         
         if user_data:
-            api_key = user_data['api_key']
+            api_key = user_data.api_key
             start_time = time.time()
             response_data = await make_api_request(api_key, models.value, prompt)
             end_time = time.time()
@@ -221,6 +217,10 @@ async def ask(
             ephemeral=False
         )
 
+if not RELAY_ENABLED:
+    bot.tree.remove_command('ask')
+
+
 @bot.tree.command(name='regeneratekey')
 async def regenerate_key(interaction: discord.Interaction):
     discord_id = str(interaction.user.id)
@@ -250,7 +250,7 @@ async def regenerate_key(interaction: discord.Interaction):
 @has_admin_role()
 async def reset_tokens(interaction: discord.Interaction, api_key: str):
     try:
-        user_service.update_tokens(api_key, 90000)
+        user_service.update_tokens(user_service.key_id(api_key), 90000)
         await interaction.response.send_message(
             embed=create_embed("Balance Reset", "Balance reset successfully."), 
             ephemeral=True
@@ -265,16 +265,7 @@ async def reset_tokens(interaction: discord.Interaction, api_key: str):
 @has_admin_role()
 async def reset_all_tokens(interaction: discord.Interaction):
     try:
-        all_users = user_service.users.find()
-        for user in all_users:
-            user_plan = user.get('plan', 'default')
-            token_limit = plans[user_plan]['tokens_per_day']
-            api_key = user['_id']
-            user_service.update_tokens(api_key, token_limit - user['current_tokens'])
-            user_service.users.find_one_and_update(
-                {"_id": api_key},
-                {"$set": {"last_reset": time.time()}}
-            )
+        await asyncio.to_thread(user_service.reset_all_tokens)
         await interaction.response.send_message(
             embed=create_embed("Tokens Reset", "All users' tokens have been reset to their plan default."),
             ephemeral=True
@@ -288,7 +279,10 @@ async def reset_all_tokens(interaction: discord.Interaction):
 @has_admin_role()
 async def change_tokens(interaction: discord.Interaction, api_key: str, tokens: int):
     try:
-        user_service.update_tokens(api_key, tokens - user_service.get_user_data(api_key)['current_tokens'])
+        user = user_service.get_user_by_api_key(api_key)
+        if user is None:
+            raise UserNotFoundError(f"User {api_key} not found")
+        user_service.update_tokens(user.api_key, tokens - user.current_tokens)
         await interaction.response.send_message(
             embed=create_embed("Balance Changed", f"Balance changed to `{tokens}` for API key `{api_key}`."), 
             ephemeral=True
@@ -314,7 +308,7 @@ async def change_plan(interaction: discord.Interaction, api_key: str, plan_name:
 
     try:
         expiration_time = time.time() + (expiration_days * 86400)
-        user_service.change_plan(api_key, plan_name, expiration_time)
+        user_service.change_plan(user_service.key_id(api_key), plan_name, expiration_time)
         await interaction.response.send_message(embed=create_embed("Plan Changed", f"Plan for API key `{api_key}` changed to `{plan_name}`. Expires in `{expiration_days}` days."), ephemeral=True)
     except UserNotFoundError:
         await interaction.response.send_message(embed=create_embed("Error", f"No user found with API key `{api_key}`."), ephemeral=True)
@@ -325,11 +319,11 @@ async def change_plan(interaction: discord.Interaction, api_key: str, plan_name:
 @has_admin_role()
 async def get_key(interaction: discord.Interaction, user: discord.Member):
     try:
-        api_key = user_service.get_user_data(str(user.id))
-        if api_key:
+        user_data = user_service.get_user_data(str(user.id))
+        if user_data:
             await interaction.response.send_message(
                 embed=create_embed("User's API Key", 
-                f"API key for {user.mention}: ```{api_key}```"),
+                f"API key for {user.mention}: ```{user_data.key_hint}```"),
                 ephemeral=True
             )
         else:
@@ -352,28 +346,29 @@ async def add_key(interaction: discord.Interaction, user: discord.Member, api_ke
       return
       
     discord_id = str(user.id)
-    conn = sqlite3.connect('user_keys.db')
     try:
-      cursor = conn.cursor()
-
-      cursor.execute('SELECT id FROM users WHERE id = ?', (api_key,))
-      if cursor.fetchone():
+      if user_service.get_user_by_api_key(api_key):
           await interaction.response.send_message(embed=create_embed("Error", f"API key `{api_key}` already exists in the database."), ephemeral=True)
           return
 
-      cursor.execute('SELECT api_key FROM discord_to_api WHERE discord_id = ?', (discord_id,))
-      if cursor.fetchone():
+      if user_service.get_user_data(discord_id):
           await interaction.response.send_message(embed=create_embed("Error", f"User {user.mention} already has an API key. Use `/delete_key` first."), ephemeral=True)
           return
 
       expiration_time = time.time() + (expiration_days * 86400)
-      cursor.execute('INSERT INTO users (id, api_key, tokens, last_reset, plan, daily_token_limit, daily_token_expiration, plan_expiration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (api_key, api_key, plans[plan_name]['tokens_per_day'], time.time(), plan_name, plans[plan_name]['tokens_per_day'], expiration_time, expiration_time))
-      cursor.execute('INSERT INTO discord_to_api (discord_id, api_key) VALUES (?, ?)', (discord_id, api_key))
-      conn.commit()
+      user_service.create_user(api_key, {
+          'tokens': plans[plan_name]['tokens_per_day'],
+          'last_reset': time.time(),
+          'plan': plan_name,
+          'plan_expiration': expiration_time,
+          'daily_token_limit': plans[plan_name]['tokens_per_day'],
+          'daily_token_expiration': expiration_time,
+          'discord_id': discord_id
+      })
       
       await interaction.response.send_message(embed=create_embed("API Key Added", f"API key `{api_key}` has been added for {user.mention}."), ephemeral=True)
-    finally:
-      conn.close()
+    except DatabaseError as e:
+      await interaction.response.send_message(embed=create_embed("Error", str(e)), ephemeral=True)
       
 @bot.tree.command(name='delete_key')
 @has_admin_role()
@@ -401,11 +396,50 @@ async def delete_key(interaction: discord.Interaction, user: discord.Member):
 
 @bot.event
 async def on_ready():
+    await asyncio.to_thread(user_service.ensure_indexes)
     await bot.tree.sync()
     print(f'Logged in as {bot.user}')
 
 
 
+async def restart_api(api_dir: str, screen_name: str = "api", restart_cmd: str = "python3 api.py"):
+    # Ctrl-C lets uvicorn stop accepting connections and drain open streams
+    # (SHUTDOWN_DRAIN_TIMEOUT) before it exits; only then is the session replaced.
+    interrupt_process = await asyncio.create_subprocess_exec(
+        'screen', '-S', screen_name, '-X', 'stuff', '^C',
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    await interrupt_process.communicate()
+
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_TIMEOUT + 30
+    while time.monotonic() < deadline:
+        list_process = await asyncio.create_subprocess_exec(
+            'screen', '-ls', screen_name,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        list_stdout, _ = await list_process.communicate()
+        if f".{screen_name}\t" not in list_stdout.decode():
+            break
+        await asyncio.sleep(1)
+    else:
+        kill_process = await asyncio.create_subprocess_exec(
+            'screen', '-X', '-S', screen_name, 'quit',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        await kill_process.communicate()
+
+    create_process = await asyncio.create_subprocess_exec(
+        'screen', '-dmS', screen_name, 'bash', '-c', restart_cmd,
+        cwd=api_dir,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    await create_process.communicate()
+
+
 @bot.tree.command(name='pull')
 @has_admin_role()
 async def pull(interaction: discord.Interaction, api: str):
@@ -416,6 +450,10 @@ async def pull(interaction: discord.Interaction, api: str):
                 ephemeral=True
             )
             return
+        # Pulling and reloading can outlast Discord's three second reply window.
+        await interaction.response.defer()
+        # Without ADMIN_SECRET the API refuses /admin/providers/reload, so every pull restarts it.
+        hot_reload = bool(ADMIN_SECRET)
         pwd_process = await asyncio.create_subprocess_exec(
             'pwd',
             stdout=asyncio.subprocess.PIPE,
@@ -425,6 +463,17 @@ async def pull(interaction: discord.Interaction, api: str):
         print(pwd_stdout.decode())
         api_dir = pwd_stdout.decode().strip()
 
+        async def head():
+            rev_process = await asyncio.create_subprocess_exec(
+                'git', 'rev-parse', 'HEAD',
+                cwd=api_dir,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            rev_stdout, _ = await rev_process.communicate()
+            return rev_stdout.decode().strip()
+
+        before = await head()
         process = await asyncio.create_subprocess_exec(
             'git', 'pull',
             cwd=api_dir,
@@ -434,36 +483,69 @@ async def pull(interaction: discord.Interaction, api: str):
         stdout, stderr = await process.communicate()
 
         if process.returncode != 0:
-            await interaction.response.send_message(
+            await interaction.followup.send(
                 embed=create_embed("Error", f"Git pull failed:\n```{stderr.decode()}```"),
                 ephemeral=True
             )
             return
 
-        screen_name = f"api"
-        restart_cmd = f"python3 api.py"
-        
-        kill_process = await asyncio.create_subprocess_exec(
-            'screen', '-X', '-S', screen_name, 'quit',
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await kill_process.communicate()
+        after = await head()
+        if before == after:
+            await interaction.followup.send(
+                embed=create_embed("Success", f"{api} API is already up to date."),
+                ephemeral=False
+            )
+            return
 
-        create_process = await asyncio.create_subprocess_exec(
-            'screen', '-dmS', screen_name, 'bash', '-c', restart_cmd,
+        diff_process = await asyncio.create_subprocess_exec(
+            'git', 'diff', '--name-only', before, after,
+            cwd=api_dir,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
-        await create_process.communicate()
+        diff_stdout, _ = await diff_process.communicate()
+        changed = diff_stdout.decode().split()
+
+        # Provider-only changes are hot-reloaded: streams in flight finish on the old
+        # providers. Anything else, or a reload the API would not take, restarts the
+        # API process.
+        if hot_reload and diff_process.returncode == 0 and changed and all(path.startswith("providers/") for path in changed):
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(
+                        f"http://127.0.0.1:{API_PORT}/admin/providers/reload",
+                        headers={"Authorization": f"Bearer {ADMIN_SECRET}"}
+                    ) as response:
+                        status = response.status
+                        result = await response.json(content_type=None)
+            except (aiohttp.ClientError, ValueError) as e:
+                status, result = None, {"detail": str(e)}
+            if status == 200:
+                await interaction.followup.send(
+                    embed=create_embed("Success", f"Pulled {api} API and reloaded providers (generation {result['generation']}, {result['draining']['in_flight']} requests draining)."),
+                    ephemeral=False
+                )
+                return
+            if status == 500:
+                # A provider failed to load; the API keeps serving the previous providers,
+                # and a restart would start without the broken one.
+                await interaction.followup.send(
+                    embed=create_embed("Error", f"Provider reload failed:\n```{result.get('detail', result)}```"),
+                    ephemeral=True
+                )
+                return
+            print(f"Provider reload unavailable ({status}: {result.get('detail', result)}); restarting the API")
 
-        await interaction.response.send_message(
-            embed=create_embed("Success", f"Successfully pulled and restarted {api} API."),
+        asyncio.create_task(restart_api(api_dir))
+
+        await interaction.followup.send(
+            embed=create_embed("Success", f"Successfully pulled {api} API; it restarts once in-flight requests finish."),
             ephemeral=False
         )
 
     except Exception as e:
-        await interaction.response.send_message(
+        send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
+        await send(
             embed=create_embed("Error", f"An error occurred: {str(e)}"),
             ephemeral=True
         )
@@ -0,0 +1,94 @@
+"""Bulk-copy users between user store backends.
+
+    python migrate_users.py --source mongodb --target sqlite
+    python migrate_users.py --source legacy-sqlite --target mongodb --hash-keys
+
+``legacy-sqlite`` reads the ``users`` table written by the old key_management
+module so existing keys can be imported into the unified store. ``--hash-keys``
+rewrites plaintext API keys to key ids while copying; use it once, when moving
+users from a store written before keys were hashed.
+"""
+import argparse
+import sqlite3
+import time
+from itertools import islice
+from typing import Any, Dict, Iterator
+
+from config import MONGODB_URI, USER_STORE_SQLITE_PATH
+from services.storage import UserStore, MongoUserStore, SqliteUserStore
+from utils.api_keys import hash_api_key, key_hint
+
+
+def iter_legacy_users(path: str) -> Iterator[Dict[str, Any]]:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        for row in conn.execute('SELECT * FROM users'):
+            row = dict(row)
+            yield {
+                "_id": row["api_key"],
+                "current_tokens": row.get("tokens"),
+                "tokens": row.get("tokens"),
+                "last_reset": row.get("last_reset"),
+                "plan": row.get("plan") or "default",
+                "plan_expiration": row.get("plan_expiration"),
+                "daily_token_limit": row.get("daily_token_limit"),
+                "daily_token_expiration": row.get("daily_token_expiration"),
+                "discord_id": None,
+            }
+    finally:
+        conn.close()
+
+
+def hash_keys(source: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for document in source:
+        yield {**document, "_id": hash_api_key(document["_id"]), "key_hint": key_hint(document["_id"])}
+
+
+def open_store(backend: str, args) -> UserStore:
+    if backend == "mongodb":
+        return MongoUserStore(args.mongodb_uri)
+    return SqliteUserStore(args.sqlite_path)
+
+
+def migrate(source: Iterator[Dict[str, Any]], target: UserStore, batch_size: int) -> Dict[str, int]:
+    read = written = 0
+    while True:
+        batch = list(islice(source, batch_size))
+        if not batch:
+            break
+        read += len(batch)
+        written += target.bulk_insert(batch)
+        print(f"Copied {written}/{read} users")
+    return {"read": read, "written": written}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-copy users between user store backends.")
+    parser.add_argument("--source", choices=["mongodb", "sqlite", "legacy-sqlite"], required=True)
+    parser.add_argument("--target", choices=["mongodb", "sqlite"], required=True)
+    parser.add_argument("--mongodb-uri", default=MONGODB_URI)
+    parser.add_argument("--sqlite-path", default=USER_STORE_SQLITE_PATH)
+    parser.add_argument("--legacy-path", default="user_keys.db")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--hash-keys", action="store_true", help="store key ids instead of plaintext API keys")
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("source and target must differ")
+
+    if args.source == "legacy-sqlite":
+        source = iter_legacy_users(args.legacy_path)
+    else:
+        source = open_store(args.source, args).iter_users(args.batch_size)
+    if args.hash_keys:
+        source = hash_keys(source)
+
+    started = time.time()
+    result = migrate(source, open_store(args.target, args), args.batch_size)
+    skipped = result["read"] - result["written"]
+    print(f"Done in {time.time() - started:.1f}s: {result['written']} copied, {skipped} already present")
+
+
+if __name__ == "__main__":
+    main()
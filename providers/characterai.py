@@ -1,30 +1,30 @@
-import ujson
 from typing import AsyncGenerator, List, Dict, Optional
-from utils.common import (
-    generate_chatcmpl_id,
-    generate_system_fingerprint,
-)
-from utils.providers.base import RequestBody, BaseProvider
+from utils.providers.base import RequestBody, BaseProvider, Capability, ChatDelta
 from utils.logger import provider_logger
-import time
-import asyncio
-import os
+from config import CHAT_AFFINITY_SIZE, CHAT_AFFINITY_TTL
+from utils.prompt_cache import PromptBuilder, TTLCache, chain_digests
+from contextlib import aclosing
 from PyCharacterAI import get_client
 from PyCharacterAI.exceptions import SessionClosedError
 
 
 class CharacterAIProvider(BaseProvider):
+    costs = {
+        "c1.2": 0.00000009,
+    }
+    capabilities = frozenset({Capability.CHAT})
+    choice_fields = {"content_filter_results": None}
+
     def __init__(self, async_client=None):
-        super().__init__(async_client)
+        super().__init__(async_client, name="characterai")
         provider_logger.info("Initializing CharacterAIProvider")
         self.token = "CHARACTER_AI_TOKEN"
 
         self.character_id = "CHARACTER_AI_TOKEN"
         self.client = None
-        self.costs = {
-            "c1.2": 0.00000009,  
-        }
-        self.models = list(self.costs.keys())
+        self.prompts = PromptBuilder(self.render_message)
+        # Prefix digest of the conversation an upstream chat holds -> its chat_id.
+        self.chats = TTLCache(CHAT_AFFINITY_SIZE, CHAT_AFFINITY_TTL)
 
     async def get_client_instance(self):
         if self.client is None:
@@ -33,6 +33,45 @@ class CharacterAIProvider(BaseProvider):
             print(f"Authenticated as @{me.username}")
         return self.client
 
+    async def startup(self):
+        await self.get_client_instance()
+
+    async def shutdown(self):
+        if self.client is not None:
+            await self.client.close_session()
+            self.client = None
+        await super().shutdown()
+
+    async def health_check(self) -> bool:
+        client = await self.get_client_instance()
+        await client.account.fetch_me()
+        return True
+
+    def error_message(self, error: Exception) -> str:
+        if isinstance(error, SessionClosedError):
+            return "Character.ai Session Closed"
+        return str(error)
+
+    def render_message(self, message: Dict) -> str:
+        return f"{message['role']} said: {message['content']}\n"
+
+    def build_prompt(self, messages: List[Dict], digests: Optional[List[bytes]] = None) -> str:
+        return self.prompts.build(messages, digests).text + "c1.2 said: "
+
+    def resume_chat(self, messages: List[Dict], digests: List[bytes]) -> Optional[str]:
+        """The upstream chat that already holds every message but the last, if any.
+
+        Taken out of the map: once a turn is sent the chat has moved on, so a retry
+        or an edited branch of the same prefix replays into a new chat instead.
+        """
+        if len(messages) < 2 or messages[-1].get("role") != "user":
+            return None
+        return self.chats.pop(digests[-2])
+
+    def remember_chat(self, digests: List[bytes], reply: str, chat_id: str) -> None:
+        # The next turn arrives as these messages plus our reply plus a new user message.
+        self.chats.set(chain_digests([{"role": "assistant", "content": reply}], digests[-1])[0], chat_id)
+
     async def create_chat(self, client, character_id):
         chat, _ = await client.chat.create_chat(character_id)
         return chat
@@ -41,149 +80,42 @@ class CharacterAIProvider(BaseProvider):
         answer = await client.chat.send_message(
             character_id, chat_id, message, streaming=True
         )
-        async for message in answer:
-            yield message.get_primary_candidate().text
-
-    async def openai_proxy_stream(self, messages: List[Dict]) -> AsyncGenerator[str, None]:
-        client = await self.get_client_instance()
-        chat = await self.create_chat(client, self.character_id)
-
-        full_message = ""
-        for message in messages:
-            full_message += f"{message['role']} said: {message['content']}\n"
-        full_message += "c1.2 said: "
-
+        async with aclosing(answer) as stream:
+            async for message in stream:
+                yield message.get_primary_candidate().text
 
+    async def stream_reply(self, client, chat_id, message, reply: List[str]) -> AsyncGenerator[ChatDelta, None]:
         previous_full_response = ""
-        async for chunk in self.send_message(client, chat.chat_id, full_message, self.character_id):
-            new_content = chunk[len(previous_full_response):]
-            previous_full_response = chunk
-
-            openai_response_format = {
-                "choices": [
-                    {
-                        "delta": {"role": "assistant", "content": new_content},
-                        "finish_reason": None,
-                    }
-                ]
-            }
-            yield f"data: {ujson.dumps(openai_response_format)}\n\n"
-
-        openai_response_format = {
-            "choices": [{"delta": {}, "finish_reason": "stop"}]
-        }
-        yield f"data: {ujson.dumps(openai_response_format)}\n\n"
-        yield "data: [DONE]\n\n"
-
-    async def openai_proxy_no_stream(self, messages: List[Dict]) -> Dict:
+        async with aclosing(self.send_message(client, chat_id, message, self.character_id)) as stream:
+            async for chunk in stream:
+                new_content = chunk[len(previous_full_response):]
+                previous_full_response = chunk
+                reply.append(new_content)
+                yield ChatDelta(new_content, role="assistant")
+
+    async def stream_chat(self, body: RequestBody) -> AsyncGenerator[ChatDelta, None]:
+        messages = body.messages
         client = await self.get_client_instance()
-        chat = await self.create_chat(client, self.character_id)
-
-        full_message = ""
-        for message in messages:
-            full_message += f"{message['role']} said: {message['content']}\n"
-        full_message += "c1.2 said: "
-
-        full_response = ""
-        async for chunk in self.send_message(client, chat.chat_id, full_message, self.character_id):
-            full_response += chunk
-
-        openai_response_format = {
-            "choices": [
-                {
-                    "message": {"role": "assistant", "content": full_response},
-                    "finish_reason": "stop"
-                }
-            ]
-        }
-        return openai_response_format
-
-    async def create_chat_completions(self, body: RequestBody) -> AsyncGenerator[dict, None]:
-        chatcmpl_id = await generate_chatcmpl_id()
-        system_fingerprint = await generate_system_fingerprint()
-        
-        if not body.model in self.models:
-            yield {
-                "error": f"The model: {body.model} is not available",
-                "model": body.model,
-                "id": chatcmpl_id,
-                "system_fingerprint": system_fingerprint,
-            }
-            return
-
-        try:
-            if body.stream:
-                async for chunk in self.openai_proxy_stream(body.messages):
-                    if "[DONE]" in chunk:
-                        yield {
-                            "id": chatcmpl_id,
-                            "object": "chat.completion.chunk",
-                            "created": int(time.time()),
-                            "model": body.model,
-                            "choices": [{
-                                "index": 0,
-                                "delta": {},
-                                "finish_reason": "stop",
-                                "content_filter_results": None
-                            }],
-                            "system_fingerprint": system_fingerprint,
-                        }
-                        
-                    else:
-                        try:
-                          data = ujson.loads(chunk.split("data: ")[1].strip())
-                          delta = data.get("choices")[0].get("delta")
-                          finish_reason = data.get("choices")[0].get("finish_reason")
-                          yield {
-                            "id": chatcmpl_id,
-                            "object": "chat.completion.chunk",
-                            "created": int(time.time()),
-                            "model": body.model,
-                            "choices": [{
-                                "index": 0,
-                                "delta": delta,
-                                "finish_reason": finish_reason,
-                                "content_filter_results": None
-                            }],
-                            "system_fingerprint": system_fingerprint,
-                        }
-                        except Exception as e:
-                              provider_logger.error(f"Error parsing chunk {chunk} with error: {str(e)}")
-                              yield{
-                                "error": str(e),
-                                "model": body.model,
-                                "id": chatcmpl_id,
-                                "system_fingerprint": system_fingerprint
-                              }
-
-            else:
-                response = await self.openai_proxy_no_stream(body.messages)
-                yield {
-                    "id": chatcmpl_id,
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": body.model,
-                    "choices": [{
-                        "index": 0,
-                        "message": response.get("choices")[0].get("message"),
-                        "finish_reason": response.get("choices")[0].get("finish_reason"),
-                        "content_filter_results": None
-                    }],
-                    "system_fingerprint": system_fingerprint,
-                }
-        except SessionClosedError:
-            yield {
-                "error": "Character.ai Session Closed",
-                "model": body.model,
-                "id": chatcmpl_id,
-                "system_fingerprint": system_fingerprint,
-            }
-        except Exception as e:
-            provider_logger.error(f"Error in chat completion {chatcmpl_id}: {str(e)}", exc_info=True)
-            yield {
-                "error": str(e),
-                "model": body.model,
-                "id": chatcmpl_id,
-                "system_fingerprint": system_fingerprint,
-            }
-        return
+        digests = chain_digests(messages)
+        reply = []
+
+        chat_id = self.resume_chat(messages, digests)
+        if chat_id is not None:
+            try:
+                async with aclosing(self.stream_reply(client, chat_id, self.render_message(messages[-1]) + "c1.2 said: ", reply)) as deltas:
+                    async for delta in deltas:
+                        yield delta
+            except Exception as e:
+                if reply:
+                    raise
+                provider_logger.warning("Could not continue chat %s, replaying the conversation: %s", chat_id, e)
+                chat_id = None
+
+        if chat_id is None:
+            chat = await self.create_chat(client, self.character_id)
+            chat_id = chat.chat_id
+            async with aclosing(self.stream_reply(client, chat_id, self.build_prompt(messages, digests), reply)) as deltas:
+                async for delta in deltas:
+                    yield delta
+
+        self.remember_chat(digests, "".join(reply), chat_id)
@@ -0,0 +1,47 @@
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel
+from utils.auth_utils import is_admin_request
+from utils.profiling import slow_request_profiler
+from utils.provider_registry import ProviderRegistry
+from utils.provider_utils import ProviderLoadError
+
+
+class ProfilingSettings(BaseModel):
+    enabled: bool
+    threshold: Optional[float] = None
+
+
+def create_admin_routes(app: FastAPI, registry: ProviderRegistry):
+    def require_admin(http_request: Request):
+        if not is_admin_request(http_request):
+            raise HTTPException(status_code=403, detail="Forbidden")
+
+    @app.get("/admin/profiling")
+    async def get_profiling(http_request: Request):
+        require_admin(http_request)
+        return slow_request_profiler.status()
+
+    @app.post("/admin/profiling")
+    async def set_profiling(settings: ProfilingSettings, http_request: Request):
+        require_admin(http_request)
+        # Runs on the event loop thread, which is the thread the sampler watches.
+        if settings.enabled:
+            slow_request_profiler.enable(settings.threshold)
+        else:
+            slow_request_profiler.disable()
+        return slow_request_profiler.status()
+
+    @app.get("/admin/providers")
+    async def get_providers(http_request: Request):
+        require_admin(http_request)
+        return registry.status()
+
+    @app.post("/admin/providers/reload")
+    async def reload_providers(http_request: Request):
+        require_admin(http_request)
+        # Announced so every worker reloads; in-flight requests finish on the old generation.
+        try:
+            return await registry.reload(announce=True)
+        except ProviderLoadError as e:
+            raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,113 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from config import API_VERSION, BATCH_MAX_BODY_BYTES, BATCH_MAX_ITEMS
+from services.user_service import UserService, plans
+from services.shared_state import get_shared_state
+from utils.auth_utils import authenticate_request
+from services.batch_service import BatchStore, BatchRunner, BatchError, parse_batch_input, batch_object, estimate_prompt_cost
+from utils.provider_registry import ProviderRegistry
+from utils.request_decoding import read_body, RequestTooLarge
+from routes.chat import RATE_LIMITS
+
+
+def batch_error(message: str, hint: str, status_code: int) -> JSONResponse:
+    return JSONResponse(content={
+        "error": {
+            "status": "Failed",
+            "message": message,
+            "hint": hint,
+            "url": "/v1/batches",
+            "api_version": API_VERSION
+        }
+    }, status_code=status_code)
+
+
+def create_batch_routes(app: FastAPI, registry: ProviderRegistry):
+    user_service = UserService()
+    shared_state = get_shared_state()
+    store = BatchStore()
+    runner = BatchRunner(store, registry, user_service.update_tokens, user_service.get_user_by_key_id)
+
+    def authenticate(http_request: Request):
+        # Batches are owned and billed by key id, so raw keys never reach batches.db.
+        user = authenticate_request(http_request, user_service)
+        return user.api_key if user else None
+
+    def owned_batch(batch_id: str, api_key: str):
+        batch = store.get_batch(batch_id)
+        if batch is None or batch["api_key"] != api_key:
+            return None
+        return batch
+
+    @app.post("/v1/batches")
+    async def create_batch(http_request: Request):
+        user = authenticate_request(http_request, user_service)
+        if user is None:
+            return batch_error("Invalid API key", "Check your API key and try again.", 401)
+        plan = plans.get(user.plan, plans['default'])
+
+        # Accepting a batch counts as one request against the plan's rate limits.
+        request_counts = await shared_state.hit_async(user.api_key, [window for _, _, window in RATE_LIMITS])
+        for (limit_type, limit_value, _), request_count in zip(RATE_LIMITS, request_counts):
+            if request_count > plan[limit_type]:
+                return batch_error(f"{limit_value} Limit Exceeded.", "Reduce your request rate or upgrade your plan.", 429)
+
+        try:
+            # Batch uploads have their own limit: a plan's max_body_bytes is sized for one chat request.
+            items = parse_batch_input(await read_body(http_request, BATCH_MAX_BODY_BYTES))
+        except RequestTooLarge as e:
+            return batch_error(str(e), "Split the input into several batches.", 413)
+        except BatchError as e:
+            return batch_error(str(e), "Upload one chat completion request per JSONL line.", 400)
+        if len(items) > BATCH_MAX_ITEMS:
+            return batch_error(f"Batches are limited to {BATCH_MAX_ITEMS} requests", "Split the input into several batches.", 400)
+
+        # Items are billed as they complete; the balance must at least cover every prompt.
+        prompt_cost = estimate_prompt_cost(items, registry.providers)
+        if user.current_tokens < prompt_cost:
+            return batch_error(f"The batch prompts cost {prompt_cost:g} tokens, more than your balance of {user.current_tokens:g}",
+                               "Top up, wait for your quota to refill or submit a smaller batch.", 429)
+
+        batch_id = store.create_batch(user.api_key, items)
+        runner.submit(batch_id)
+        return JSONResponse(content=batch_object(store.get_batch(batch_id)))
+
+    @app.get("/v1/batches")
+    async def list_batches(http_request: Request, limit: int = 20):
+        api_key = authenticate(http_request)
+        if api_key is None:
+            return batch_error("Invalid API key", "Check your API key and try again.", 401)
+        return {"object": "list", "data": [batch_object(batch) for batch in store.list_batches(api_key, limit)]}
+
+    @app.get("/v1/batches/{batch_id}")
+    async def get_batch(batch_id: str, http_request: Request):
+        api_key = authenticate(http_request)
+        if api_key is None:
+            return batch_error("Invalid API key", "Check your API key and try again.", 401)
+        batch = owned_batch(batch_id, api_key)
+        if batch is None:
+            return batch_error("Batch not found", "Check the batch id.", 404)
+        return batch_object(batch)
+
+    @app.get("/v1/batches/{batch_id}/output")
+    async def get_batch_output(batch_id: str, http_request: Request):
+        api_key = authenticate(http_request)
+        if api_key is None:
+            return batch_error("Invalid API key", "Check your API key and try again.", 401)
+        if owned_batch(batch_id, api_key) is None:
+            return batch_error("Batch not found", "Check the batch id.", 404)
+        return StreamingResponse(store.iter_output(batch_id), media_type="application/jsonl")
+
+    @app.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(batch_id: str, http_request: Request):
+        api_key = authenticate(http_request)
+        if api_key is None:
+            return batch_error("Invalid API key", "Check your API key and try again.", 401)
+        batch = owned_batch(batch_id, api_key)
+        if batch is None:
+            return batch_error("Batch not found", "Check the batch id.", 404)
+        if batch["status"] == "in_progress":
+            runner.cancel(batch_id)
+        return batch_object(store.get_batch(batch_id))
+
+    return runner
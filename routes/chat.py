@@ -1,23 +1,31 @@
 from fastapi import FastAPI, HTTPException, Request
-from config import API_VERSION
-from fastapi.responses import StreamingResponse, JSONResponse
+from config import API_VERSION, MAX_CHOICES, REQUEST_BODY_LIMIT
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 import httpx
 import json
 import time
-from duckduckgo_search import DDGS
 from services.user_service import UserService, UserNotFoundError, DatabaseError
-from utils.token_utils import reset_daily_tokens, calculate_tokens
+from services.shared_state import get_shared_state
+from utils.token_utils import calculate_tokens, get_output_length
 from utils.streaming_utils import completion_streamer
-from utils.auth_utils import validate_user_auth
-from utils.provider_utils import initialize_providers
+from utils.disconnect_utils import cancel_on_disconnect, ClientDisconnected
+from utils.fanout_utils import fan_out_completions, fan_out_stream, with_provider_slot
+from utils.admission import admission_scheduler, AdmissionRejected
+from utils.auth_utils import authenticate_request
 from utils.discord_logger import log_chat_completion
-from utils.base import ChatCompletionRequest
-from utils.logger import chat_logger
+from utils.p_selector import select_provider
+from utils.provider_registry import ProviderGeneration, ProviderRegistry
+from utils.request_decoding import decode_chat_request, read_body, RequestDecodeError, RequestTooLarge
+from utils.logger import chat_logger, request_id_var
+from utils.tracing import span, set_request_id
+from utils.metrics import completion_duration, output_chars_per_second, http_errors, provider_label
 import uuid
 
 with open("data/plans.json", "r") as f:
     plans = json.loads(f.read())
 
+RATE_LIMITS = [('rpm', 'RPM', 60), ('rph', 'RPH', 3600), ('rpd', 'RPD', 86400)]
+
 def create_error_response(error_message: str, model: str, timestamp: int = None):
     if timestamp is None:
         timestamp = int(time.time())
@@ -35,39 +43,76 @@ def create_error_response(error_message: str, model: str, timestamp: int = None)
         "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
     }
 
-def get_output_length(response: dict) -> int:
-    if 'choices' in response and response['choices']:
-        output_length = len(response['choices'][0]['message'].get('content', ''))
-        if 'function_call' in response['choices'][0]['message']:
-            function_call = response['choices'][0]['message']['function_call']
-            output_length += len(function_call.get('name', ''))
-            output_length += len(function_call.get('arguments', ''))
-        return output_length
-    elif 'content' in response:
-        return len(response.get('content', ''))
-    return 0
-
-
-def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient):
+def create_chat_routes(app: FastAPI, registry: ProviderRegistry, client: httpx.AsyncClient):
     user_service = UserService() 
+    shared_state = get_shared_state()
 
     @app.post("/v1/chat/completions")
-    async def chat_completions(request: ChatCompletionRequest, http_request: Request):
+    async def chat_completions(http_request: Request):
+        # The request keeps the provider generation it started on; a reload waits for
+        # it, and for a stream until its last chunk, before stopping that generation.
+        generation = registry.acquire()
+        try:
+            response = await serve_chat_completion(http_request, generation)
+        except BaseException:
+            generation.release()
+            raise
+        if not isinstance(response, StreamingResponse):
+            generation.release()
+        return response
+
+    async def serve_chat_completion(http_request: Request, generation: ProviderGeneration):
+        providers = generation.providers
         request_id = str(uuid.uuid4())
-        chat_logger.info(f"Request {request_id}: Starting chat completion request for model {request.model}")
+        request_id_var.set(request_id)
+        set_request_id(request_id)
+        # Auth needs only headers, so the plan's body limit is known before the body is read.
+        try:
+            with span("auth"):
+                user_data = authenticate_request(http_request, user_service)
+        except DatabaseError as e:
+            chat_logger.error("Request %s: Database error: %s", request_id, e)
+            raise HTTPException(status_code=500, detail=str(e))
+        body_limit = plans.get(user_data.plan if user_data else "default", plans['default']).get("max_body_bytes", REQUEST_BODY_LIMIT)
+        try:
+            with span("read_body"):
+                body = await read_body(http_request, body_limit)
+            with span("decode"):
+                request, message_stats = decode_chat_request(body)
+        except RequestTooLarge as e:
+            chat_logger.info("Request %s: %s", request_id, e)
+            return JSONResponse(content={
+    "error": {
+        "status": "Failed",
+        "message": str(e),
+        "hint": "Shorten the conversation or upgrade your plan for a larger request limit.",
+        "url": "/v1/chat/completions",
+        "api_version": API_VERSION
+    }
+}, status_code=413)
+        except RequestDecodeError as e:
+            chat_logger.info("Request %s: Invalid request body: %s", request_id, e)
+            return JSONResponse(content={
+    "error": {
+        "status": "Failed",
+        "message": f"Invalid request body: {e}",
+        "hint": "Send a JSON object with a model and a non-empty messages array.",
+        "url": "/v1/chat/completions",
+        "api_version": API_VERSION
+    }
+}, status_code=400)
+        chat_logger.info("Request %s: Starting chat completion request for model %s", request_id, request.model)
         
         try:
             start_time = time.time()
             
             model = request.model
-            chat_logger.info(f"Request {request_id}: Processing model {model}")
+            chat_logger.info("Request %s: Processing model %s", request_id, model)
 
             with open("data/restricted_models.json", "r") as f:
                 restricted_models = json.loads(f.read())
             
             if model in restricted_models.get("restricted_models", {}):
-                user_id = http_request.headers.get("Authorization", "").split(" ")[1]
-                user_data = user_service.get_user_by_api_key(user_id)
                 if user_data is None:
                     return JSONResponse(content={
     "error": {
@@ -78,7 +123,7 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
         "api_version": API_VERSION
     }
 }, status_code=401)
-                plan_name = user_data["plan"]
+                plan_name = user_data.plan
                 allowed_plans = restricted_models["restricted_models"][model]
                 if plan_name not in allowed_plans:
                     return JSONResponse(content={
@@ -92,6 +137,8 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
 }, status_code=403)
 
             def perform_duckduckgo_search(query: str) -> list:
+                # Imported on first use; only ":web" models need it.
+                from duckduckgo_search import DDGS
                 ddgs = DDGS()
                 results = ddgs.text(query, max_results=5)
                 return [
@@ -103,22 +150,24 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
                     for result in results
                 ]
 
-            providers = initialize_providers(async_client=client, provider_directory="providers")
             forced_provider = None
             if ":web" in model:
-                search_query = " ".join(msg['content'] for msg in request.messages)
-                search_results = perform_duckduckgo_search(search_query)
+                # The latest user message is the query; earlier turns are context, not search terms.
+                with span("web_search"):
+                    search_results = perform_duckduckgo_search(message_stats.last_user_message)
+                search_message = f"Web search results: {search_results}"
                 request.messages.append({
                     "role": "system",
-                    "content": f"Web search results: {search_results}"
+                    "content": search_message
                 })
+                message_stats.input_length += len(search_message)
                 request.model = model.replace(":web", "")
 
             for provider_id, provider in providers.items():
                 if "@" in model and model.split("@")[0] == provider_id:
                     model_name = model.split("@")[1]
                     if model_name not in provider.models:
-                        chat_logger.error(f"Request {request_id}: Invalid model {model_name} for provider {provider_id}")
+                        chat_logger.error("Request %s: Invalid model %s for provider %s", request_id, model_name, provider_id)
                         return JSONResponse(content={
     "error": {
         "status": "Failed",
@@ -132,12 +181,9 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
                     request.model = model_name
                     break
             
-            providers = initialize_providers(async_client=client, provider_directory="providers")
-            provider = forced_provider or next(
-                (p for p in providers.values() if request.model in p.models), None
-            )
+            provider = forced_provider or select_provider(providers, request.model)
             if not provider:
-                chat_logger.error(f"Request {request_id}: No provider found for model {request.model}")
+                chat_logger.error("Request %s: No provider found for model %s", request_id, request.model)
                 return JSONResponse(content={
     "error": {
         "status": "Failed",
@@ -149,24 +195,23 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
 }, status_code=404)
 
 
-            user_id = http_request.headers.get("Authorization", "").split(" ")[1]
-            
-            chat_logger.info(f"Request {request_id}: Authenticated user {user_id}")
-            
+            user_id = None
             try:
-                 user_data = user_service.get_user_by_api_key(user_id)
                  if user_data is None:
                     raise HTTPException(status_code=401, detail="Invalid API key")
-                 if user_data.get('daily_token_expiration') is None or time.time() >= user_data['daily_token_expiration']:
-                    reset_daily_tokens()
-                    user_data = user_service.get_user_by_api_key(user_id)
 
-                 plan_name = user_data["plan"]
+                 # Billing and logs use the key id, never the raw API key.
+                 user_id = user_data.api_key
+                 chat_logger.info("Request %s: Authenticated user %s", request_id, user_id)
+
+                 plan_name = user_data.plan
                  plan = plans.get(plan_name, plans['default'])
 
-                 user_tokens = user_data['current_tokens']
-                 for limit_type, limit_value in [('rpm', 'RPM'), ('rph', 'RPH'), ('rpd', 'RPD')]:
-                     if user_tokens > plan[limit_type]:
+                 # Counted in shared state so the limits hold across every worker.
+                 with span("rate_limit"):
+                    request_counts = await shared_state.hit_async(user_id, [window for _, _, window in RATE_LIMITS])
+                 for (limit_type, limit_value, _), request_count in zip(RATE_LIMITS, request_counts):
+                     if request_count > plan[limit_type]:
                        return JSONResponse(content={
     "error": {
         "status": "Out of Quota",
@@ -177,11 +222,21 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
     }
 }, status_code=429)
 
-                 input_length = sum(len(msg['content']) for msg in request.messages)
-                 completion_method = (
-                    getattr(provider, 'create_chat_completions', None) or 
-                    getattr(provider, 'create_translation', None)
-                 )
+                 choice_count = 1 if request.n is None else request.n
+                 if choice_count < 1 or choice_count > MAX_CHOICES:
+                    return JSONResponse(content={
+    "error": {
+        "status": "Failed",
+        "message": f"n must be between 1 and {MAX_CHOICES}",
+        "hint": "Request fewer choices.",
+        "url": "/v1/chat/completions",
+        "api_version": API_VERSION
+    }
+}, status_code=400)
+
+                 # Every choice replays the prompt upstream, so the prompt is billed per choice.
+                 input_length = message_stats.input_length * choice_count
+                 completion_method = provider.chat_method()
                 
                  if not completion_method:
                     return JSONResponse(content={
@@ -194,22 +249,59 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
     }
 }, status_code=500)
 
+                 try:
+                    with span("admission"):
+                        await admission_scheduler.acquire(plan_name)
+                 except AdmissionRejected as e:
+                    chat_logger.info("Request %s: Shed by admission scheduler for plan %s: %s", request_id, plan_name, e)
+                    return JSONResponse(content={
+    "error": {
+        "status": "Overloaded",
+        "message": "Upstream capacity is saturated.",
+        "hint": "Retry shortly or upgrade your plan for reserved capacity.",
+        "url": "/v1/chat/completions",
+        "api_version": API_VERSION
+    }
+}, status_code=503)
+
                  if request.stream:
-                    return await completion_streamer(provider, request, user_id, input_length, user_service.update_tokens, plan_name, client)
-                
-                 tried_providers = {provider}
-                 response = None
-                 while True:
-                    try:
-                        response = None
-                        async for chunk in completion_method(request):
-                           if isinstance(chunk, dict):
-                                 if "error" in chunk:
-                                    return JSONResponse(content={"error": chunk["error"]})
-                                 response = chunk
+                    def finish_stream():
+                        admission_scheduler.release()
+                        generation.release()
+
+                    if choice_count > 1:
+                        source = fan_out_stream(provider, request, choice_count)
+                    else:
+                        source = with_provider_slot(provider, provider.create_chat_completions(request))
+                    return await completion_streamer(provider, request, user_id, input_length, user_service.update_tokens, plan_name, client, http_request, source, finish_stream)
+
+                 try:
+                     tried_providers = {provider}
+                     response = None
+                     while True:
+                        try:
+                            response = None
+                            upstream_started = time.time()
+                            if choice_count > 1:
+                                source = fan_out_completions(completion_method, provider, request, choice_count)
+                            else:
+                                source = with_provider_slot(provider, completion_method(request))
+                            try:
+                                with span("upstream"):
+                                    async for chunk in cancel_on_disconnect(source, http_request, "non_stream"):
+                                       if isinstance(chunk, dict):
+                                             if "error" in chunk:
+                                                return JSONResponse(content={"error": chunk["error"]})
+                                             response = chunk
+                            except ClientDisconnected:
+                                output_length = get_output_length(response) if response else 0
+                                model_multiplier = provider.costs.get(request.model, 1)
+                                user_service.update_tokens(user_id, -calculate_tokens(input_length, output_length, model_multiplier))
+                                chat_logger.info("Request %s: Client disconnected before completion, billed %s output characters", request_id, output_length)
+                                return Response(status_code=499)
 
-                        if not response:
-                             return JSONResponse(content={
+                            if not response:
+                                 return JSONResponse(content={
     "error": {
         "status": "Failed",
         "message": "No response received from provider",
@@ -219,70 +311,74 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
     }
 }, status_code=500)
                         
-                        output_length = get_output_length(response)
-                        model_multiplier = provider.costs.get(request.model, 1)
-                        total_tokens_used = calculate_tokens(input_length, output_length, model_multiplier)
-                        user_service.update_tokens(user_id, -total_tokens_used)
+                            output_length = get_output_length(response)
+                            upstream_duration = time.time() - upstream_started
+                            completion_duration.observe(upstream_duration, request.model, provider_label(provider), "false")
+                            if output_length and upstream_duration > 0:
+                                output_chars_per_second.observe(output_length / upstream_duration, request.model, provider_label(provider))
+                            model_multiplier = provider.costs.get(request.model, 1)
+                            total_tokens_used = calculate_tokens(input_length, output_length, model_multiplier)
+                            with span("billing"):
+                                user_service.update_tokens(user_id, -total_tokens_used)
                         
-                        await log_chat_completion(
-                                user_id=user_id,
-                                input_tokens=input_length,
-                                output_tokens=output_length,
-                                execution_time=time.time() - start_time,
-                                model=request.model
-                            )
+                            with span("log"):
+                                await log_chat_completion(
+                                        user_id=user_id,
+                                        input_tokens=input_length,
+                                        output_tokens=output_length,
+                                        execution_time=time.time() - start_time,
+                                        model=request.model
+                                    )
                         
-                        return JSONResponse(content=response)
+                            return JSONResponse(content=response)
                         
-                    except DatabaseError as e:
-                        chat_logger.error(f"Request {request_id}: Database error: {str(e)}", exc_info=True)
-                        return JSONResponse(content={
-                            "error": {
-                                "status": "Failed",
-                                "message": "A database error occurred while processing your request.",
-                                "hint": "Please try again later.",
-                                "url": "/v1/chat/completions",
-                                "api_version": API_VERSION
-                            }
-                        }, status_code=500)
+                        except DatabaseError as e:
+                            chat_logger.error("Request %s: Database error: %s", request_id, e, exc_info=True)
+                            return JSONResponse(content={
+                                "error": {
+                                    "status": "Failed",
+                                    "message": "A database error occurred while processing your request.",
+                                    "hint": "Please try again later.",
+                                    "url": "/v1/chat/completions",
+                                    "api_version": API_VERSION
+                                }
+                            }, status_code=500)
 
-                    except UserNotFoundError:
-                        chat_logger.error(f"Request {request_id}: Invalid API key for user {user_id}")
-                        return JSONResponse(content={
-                            "error": {
-                                "status": "Failed",
-                                "message": "Invalid API key",
-                                "hint": "Check your API key and try again.",
-                                "url": f"/{API_VERSION}/chat/completions",
-                                "api_version": API_VERSION
-                            }
-                        }, status_code=401)
+                        except UserNotFoundError:
+                            chat_logger.error("Request %s: Invalid API key for user %s", request_id, user_id)
+                            return JSONResponse(content={
+                                "error": {
+                                    "status": "Failed",
+                                    "message": "Invalid API key",
+                                    "hint": "Check your API key and try again.",
+                                    "url": f"/{API_VERSION}/chat/completions",
+                                    "api_version": API_VERSION
+                                }
+                            }, status_code=401)
 
-                    except HTTPException as e:
-                        chat_logger.error(f"Request {request_id}: HTTP error: {str(e)}", exc_info=True)
-                        return JSONResponse(content={
-                            "error": {
-                                "status": "Failed",
-                                "message": e.detail,
-                                "hint": "Check your API key and try again.",
-                                "url": f"/{API_VERSION}/chat/completions",
-                                "api_version": API_VERSION
-                            }
-                        }, status_code=e.status_code)
+                        except HTTPException as e:
+                            chat_logger.error("Request %s: HTTP error: %s", request_id, e, exc_info=True)
+                            return JSONResponse(content={
+                                "error": {
+                                    "status": "Failed",
+                                    "message": e.detail,
+                                    "hint": "Check your API key and try again.",
+                                    "url": f"/{API_VERSION}/chat/completions",
+                                    "api_version": API_VERSION
+                                }
+                            }, status_code=e.status_code)
 
-                    except Exception as e:
-                        if "Attempted to access streaming response content" in str(e):
-                            new_provider = select_provider(request.model, async_client=client)
-                            if new_provider and new_provider not in tried_providers:
-                                provider = new_provider
-                                tried_providers.add(provider)
-                                completion_method = (
-                                    getattr(provider, 'create_chat_completions', None) or 
-                                    getattr(provider, 'create_translation', None)
-                                )
-                                continue
+                        except Exception as e:
+                            if "Attempted to access streaming response content" in str(e):
+                                new_provider = select_provider(providers, request.model, exclude=tried_providers)
+                                if new_provider:
+                                    provider = new_provider
+                                    tried_providers.add(provider)
+                                    completion_method = provider.chat_method()
+                                    continue
 
-                        return JSONResponse(content={
+                            http_errors.inc("/v1/chat/completions", type(e).__name__)
+                            return JSONResponse(content={
     "error": {
         "status": "Failed",
         "message": str(e),
@@ -291,17 +387,21 @@ def create_chat_routes(app: FastAPI, providers: dict, client: httpx.AsyncClient)
         "api_version": API_VERSION
     }
 }, status_code=500)
+                 finally:
+                    admission_scheduler.release()
+                
                         
             except UserNotFoundError:
-                chat_logger.error(f"Request {request_id}: Invalid API key for user {user_id}")
+                chat_logger.error("Request %s: Invalid API key for user %s", request_id, user_id)
                 raise HTTPException(status_code=401, detail="Invalid API key")
             except DatabaseError as e:
-                chat_logger.error(f"Request {request_id}: Database error: {str(e)}")
+                chat_logger.error("Request %s: Database error: %s", request_id, e)
                 raise HTTPException(status_code=500, detail=str(e))
             
 
         except Exception as e:
-            chat_logger.error(f"Request {request_id}: Fatal error: {str(e)}", exc_info=True)
+            chat_logger.error("Request %s: Fatal error: %s", request_id, e, exc_info=True)
+            http_errors.inc("/v1/chat/completions", type(e).__name__)
             return JSONResponse(content={
     "error": {
         "status": "Failed",
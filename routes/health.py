@@ -0,0 +1,30 @@
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from utils.auth_utils import is_admin_request
+from utils.provider_utils import check_providers
+
+
+def create_health_routes(app: FastAPI, providers: dict = None):
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz():
+        # app.state.startup is filled in by the lifespan in api.py as each step completes.
+        startup = getattr(app.state, "startup", {})
+        ready = getattr(app.state, "ready", False)
+        return JSONResponse(
+            content={"status": "ready" if ready else "starting", "checks": startup},
+            status_code=200 if ready else 503
+        )
+
+    @app.get("/healthz/providers")
+    async def provider_health(http_request: Request):
+        # Runs each provider's health_check; failures take the provider out of selection until it passes again.
+        # That is upstream traffic and a routing change, so only admins may trigger it.
+        if not is_admin_request(http_request):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        results = await check_providers(providers or {})
+        healthy = all(result == "ok" for result in results.values())
+        return JSONResponse(content={"status": "ok" if healthy else "degraded", "providers": results}, status_code=200 if healthy else 503)
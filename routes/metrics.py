@@ -0,0 +1,12 @@
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from utils.metrics import registry, register_runtime_gauges
+from utils.discord_logger import webhook_queue_depth
+
+
+def create_metrics_routes(app: FastAPI):
+    register_runtime_gauges(webhook_queue_depth)
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,42 +1,123 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from collections import defaultdict
+from functools import lru_cache
+import hashlib
+import json
+from config import API_VERSION, MODELS_CACHE_MAX_AGE
+
+@lru_cache(maxsize=1024)
+def pretty_model_name(model_name: str) -> str:
+    # "gpt-4o-mini" -> "GPT 4o Mini": title case, but a letter after a digit stays lower.
+    titled = model_name.replace("-", " ").title().replace("Gpt", "GPT")
+    return ''.join(c.lower() if i > 0 and c.isupper() and model_name[i-1].isdigit() else c for i, c in enumerate(titled))
+
+def build_model_list(providers: dict) -> list:
+    model_data = defaultdict(lambda: {"providers": [], "costs": []})
+
+    for provider_name, provider in providers.items():
+        for model_name in provider.models:
+            credit_cost = provider.costs.get(model_name, 1)
+            model_data[model_name]["providers"].append(provider_name)
+            model_data[model_name]["costs"].append(credit_cost)
+
+    model_list = []
+    for model_name, data in model_data.items():
+        providers_list = data["providers"]
+        costs = data["costs"]
+
+        min_cost = min(costs)
+
+        model_list.append({
+            "id": model_name,
+            "name": pretty_model_name(model_name),
+            "object": "model",
+            "created": 0,
+            "owned_by": providers_list[0] if len(providers_list) == 1 else providers_list,
+            "parent": None,
+            "root": None,
+            "permission": {
+                "allow_create_engine": True,
+                "allow_sampling": True,
+                "allow_logprobs": True,
+                "allow_search_indices": True,
+                "allow_view": True,
+                "allow_fine_tuning": True,
+                "organization": "*",
+                "is_blocking": False
+            },
+            "cost": min_cost
+        })
+    return model_list
+
+def _encode(content) -> tuple:
+    body = json.dumps(content, separators=(",", ":")).encode()
+    return body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+class ModelIndex:
+    """/v1/models and /v1/models/{id}, serialized once per provider registry.
+
+    The registry is keyed by the provider instances it holds: loading or reloading
+    providers replaces instances, which rebuilds the index on the next request.
+    """
+
+    def __init__(self, providers: dict):
+        self.providers = providers
+        self.key = None
+        self.listing = None
+        self.models = {}
+
+    def refresh(self) -> None:
+        key = tuple((name, id(provider)) for name, provider in self.providers.items())
+        if key == self.key:
+            return
+        model_list = build_model_list(self.providers)
+        self.listing = _encode({"data": model_list})
+        self.models = {model["id"]: _encode(model) for model in model_list}
+        self.key = key
+
+    def listing_body(self) -> tuple:
+        self.refresh()
+        return self.listing
+
+    def model_body(self, model_id: str):
+        self.refresh()
+        return self.models.get(model_id)
+
+def _not_modified(http_request: Request, etag: str) -> bool:
+    if_none_match = http_request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _cached_response(http_request: Request, encoded: tuple) -> Response:
+    body, etag = encoded
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={MODELS_CACHE_MAX_AGE}"}
+    if _not_modified(http_request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 def create_model_routes(app: FastAPI, providers: dict):
+    index = ModelIndex(providers)
+
     @app.get("/v1/models")
-    async def get_models():
-        model_data = defaultdict(lambda: {"providers": [], "costs": []})
-        
-        for provider_name, provider in providers.items():
-            for model_name in provider.models:
-                credit_cost = provider.costs.get(model_name, 1)
-                model_data[model_name]["providers"].append(provider_name)
-                model_data[model_name]["costs"].append(credit_cost)
-        
-        model_list = []
-        for model_name, data in model_data.items():
-            providers_list = data["providers"]
-            costs = data["costs"]
-            
-            min_cost = min(costs)
-            
-            model_list.append({
-                "id": model_name,
-                "name": ''.join(c.lower() if i > 0 and c.isupper() and model_name[i-1].isdigit() else c for i, c in enumerate(model_name.replace("-", " ").title().replace("Gpt", "GPT"))),
-                "object": "model",
-                "created": 0,
-                "owned_by": providers_list[0] if len(providers_list) == 1 else providers_list,
-                "parent": None,
-                "root": None,
-                "permission": {
-                    "allow_create_engine": True,
-                    "allow_sampling": True,
-                    "allow_logprobs": True,
-                    "allow_search_indices": True,
-                    "allow_view": True,
-                    "allow_fine_tuning": True,
-                    "organization": "*",
-                    "is_blocking": False
-                },
-                "cost": min_cost
-            })
-        return {"data": model_list}
+    async def get_models(http_request: Request):
+        return _cached_response(http_request, index.listing_body())
+
+    @app.get("/v1/models/{model_id:path}")
+    async def get_model(model_id: str, http_request: Request):
+        encoded = index.model_body(model_id)
+        if encoded is None:
+            return JSONResponse(content={
+    "error": {
+        "status": "Failed",
+        "message": f"Model {model_id} not found",
+        "hint": "List available models at /v1/models.",
+        "url": f"/v1/models/{model_id}",
+        "api_version": API_VERSION
+    }
+}, status_code=404)
+        return _cached_response(http_request, encoded)
+
+    return index
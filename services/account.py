@@ -0,0 +1,83 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence
+
+from utils.quota import refilled_balance
+
+# Column order shared with SqliteUserStore.COLUMNS so rows decode positionally.
+ACCOUNT_COLUMNS = (
+    "api_key",
+    "current_tokens",
+    "tokens",
+    "last_reset",
+    "plan",
+    "plan_expiration",
+    "daily_token_limit",
+    "daily_token_expiration",
+    "discord_id",
+    "last_refill",
+    "key_hint",
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Account:
+    """Immutable view of a stored user shared by the auth, quota and Discord paths.
+
+    ``api_key`` is the stored key id (see ``utils.api_keys.hash_api_key``), never the key itself.
+    ``balance`` is the stored balance as of ``last_refill``; ``current_tokens`` and the
+    reset fields are computed when accessed rather than when the record is decoded.
+    """
+
+    api_key: str
+    balance: float = 0
+    tokens: float = 0
+    last_reset: Optional[float] = None
+    plan: str = "default"
+    plan_expiration: Optional[float] = None
+    daily_token_limit: Optional[float] = None
+    daily_token_expiration: Optional[float] = None
+    discord_id: Optional[str] = None
+    last_refill: Optional[float] = None
+    key_hint: Optional[str] = None
+
+    @classmethod
+    def from_document(cls, document: Optional[Dict[str, Any]]) -> Optional["Account"]:
+        if not document:
+            return None
+        get = document.get
+        return cls(
+            document["_id"],
+            get("current_tokens") or 0,
+            get("tokens") or 0,
+            get("last_reset"),
+            get("plan") or "default",
+            get("plan_expiration"),
+            get("daily_token_limit"),
+            get("daily_token_expiration"),
+            get("discord_id"),
+            get("last_refill"),
+            get("key_hint"),
+        )
+
+    @classmethod
+    def from_row(cls, row: Optional[Sequence[Any]]) -> Optional["Account"]:
+        if row is None:
+            return None
+        api_key, balance, tokens, last_reset, plan, *rest = row
+        return cls(api_key, balance or 0, tokens or 0, last_reset, plan or "default", *rest)
+
+    @property
+    def current_tokens(self) -> float:
+        return refilled_balance(self.balance, self.daily_token_limit, self.last_refill or self.last_reset, time.time())
+
+    @property
+    def time_since_reset(self) -> float:
+        return time.time() - (self.last_reset or 0)
+
+    @property
+    def reset_available(self) -> bool:
+        return self.time_since_reset >= 86400
+
+    def plan_expired(self, now: Optional[float] = None) -> bool:
+        return self.plan != "default" and bool(self.plan_expiration) and (now or time.time()) > self.plan_expiration
@@ -0,0 +1,386 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import BATCH_DB_PATH, BATCH_CONCURRENCY, BATCH_CHUNK_SIZE
+from utils.base import ChatCompletionRequest
+from utils.request_decoding import scan_messages, RequestDecodeError
+from utils.fanout_utils import provider_slot
+from utils.admission import admission_scheduler, AdmissionRejected
+from utils.p_selector import select_provider
+from utils.provider_registry import ProviderRegistry
+from utils.logger import chat_logger
+from utils.token_utils import calculate_tokens, get_output_length
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Rows fetched per query when streaming a batch's output.
+OUTPUT_PAGE_SIZE = 500
+# Seconds a batch item waits before asking the admission scheduler again after being shed.
+ADMISSION_RETRY_DELAY = 1.0
+
+
+class BatchError(Exception):
+    pass
+
+
+class BatchStore:
+    def __init__(self, db_path: str = BATCH_DB_PATH):
+        self.path = db_path
+        self._local = threading.local()
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                api_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                completed_at REAL,
+                total INTEGER NOT NULL,
+                completed INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                billed REAL DEFAULT 0,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS batch_items (
+                batch_id TEXT NOT NULL,
+                line INTEGER NOT NULL,
+                custom_id TEXT,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                response TEXT,
+                cost REAL DEFAULT 0,
+                billed INTEGER DEFAULT 0,
+                PRIMARY KEY (batch_id, line)
+            );
+            CREATE INDEX IF NOT EXISTS batch_items_pending ON batch_items (batch_id, status);
+            CREATE INDEX IF NOT EXISTS batches_api_key ON batches (api_key);
+        ''')
+        conn.commit()
+
+    def connection(self) -> sqlite3.Connection:
+        # Output is streamed from Starlette's threadpool, so each thread gets its own connection.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def create_batch(self, api_key: str, items: List[Dict[str, Any]]) -> str:
+        conn = self.connection()
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        with conn:
+            conn.execute(
+                'INSERT INTO batches (id, api_key, status, created_at, total) VALUES (?, ?, ?, ?, ?)',
+                (batch_id, api_key, "in_progress", time.time(), len(items))
+            )
+            conn.executemany(
+                'INSERT INTO batch_items (batch_id, line, custom_id, body) VALUES (?, ?, ?, ?)',
+                ((batch_id, line, item.get("custom_id"), json.dumps(item["body"])) for line, item in enumerate(items))
+            )
+        return batch_id
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        conn = self.connection()
+        row = conn.execute('SELECT * FROM batches WHERE id = ?', (batch_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_batches(self, api_key: str, limit: int = 20) -> List[Dict[str, Any]]:
+        conn = self.connection()
+        rows = conn.execute(
+            'SELECT * FROM batches WHERE api_key = ? ORDER BY created_at DESC LIMIT ?', (api_key, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def unfinished_batches(self) -> List[str]:
+        conn = self.connection()
+        rows = conn.execute("SELECT id FROM batches WHERE status IN ('in_progress', 'cancelling')").fetchall()
+        return [row["id"] for row in rows]
+
+    def pending_items(self, batch_id: str) -> List[Dict[str, Any]]:
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT line, custom_id, body FROM batch_items WHERE batch_id = ? AND status = 'pending' ORDER BY line",
+            (batch_id,)
+        ).fetchall()
+        return [{"line": row["line"], "custom_id": row["custom_id"], "body": json.loads(row["body"])} for row in rows]
+
+    def unbilled_cost(self, batch_id: str) -> float:
+        conn = self.connection()
+        row = conn.execute(
+            "SELECT COALESCE(SUM(cost), 0) FROM batch_items WHERE batch_id = ? AND status != 'pending' AND billed = 0",
+            (batch_id,)
+        ).fetchone()
+        return row[0]
+
+    def record_results(self, batch_id: str, results: List[Dict[str, Any]]) -> None:
+        conn = self.connection()
+        completed = sum(1 for result in results if result["status"] == "completed")
+        with conn:
+            conn.executemany(
+                'UPDATE batch_items SET status = ?, response = ?, cost = ? WHERE batch_id = ? AND line = ?',
+                ((result["status"], json.dumps(result["response"]), result["cost"], batch_id, result["line"]) for result in results)
+            )
+            conn.execute(
+                'UPDATE batches SET completed = completed + ?, failed = failed + ? WHERE id = ?',
+                (completed, len(results) - completed, batch_id)
+            )
+
+    def mark_billed(self, batch_id: str, amount: float) -> None:
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "UPDATE batch_items SET billed = 1 WHERE batch_id = ? AND status != 'pending' AND billed = 0",
+                (batch_id,)
+            )
+            conn.execute('UPDATE batches SET billed = billed + ? WHERE id = ?', (amount, batch_id))
+
+    def set_status(self, batch_id: str, status: str, error: Optional[str] = None) -> None:
+        conn = self.connection()
+        completed_at = time.time() if status in ("completed", "failed", "cancelled") else None
+        with conn:
+            conn.execute(
+                'UPDATE batches SET status = ?, error = COALESCE(?, error), completed_at = ? WHERE id = ?',
+                (status, error, completed_at, batch_id)
+            )
+
+    def iter_output(self, batch_id: str) -> Iterator[str]:
+        # Starlette advances this generator from whichever threadpool thread is free,
+        # so each page is a separate query on that thread's connection.
+        line = -1
+        while True:
+            rows = self.connection().execute(
+                "SELECT line, custom_id, status, response FROM batch_items WHERE batch_id = ? AND status != 'pending' AND line > ? ORDER BY line LIMIT ?",
+                (batch_id, line, OUTPUT_PAGE_SIZE)
+            ).fetchall()
+            for row in rows:
+                response = json.loads(row["response"]) if row["response"] else None
+                failed = row["status"] != "completed"
+                yield json.dumps({
+                    "id": f"batch_req_{batch_id}_{row['line']}",
+                    "custom_id": row["custom_id"],
+                    "response": None if failed else {"status_code": 200, "body": response},
+                    "error": response if failed else None
+                }) + "\n"
+            if len(rows) < OUTPUT_PAGE_SIZE:
+                return
+            line = rows[-1]["line"]
+
+
+def parse_batch_input(raw: bytes) -> List[Dict[str, Any]]:
+    items = []
+    for number, line in enumerate(raw.decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise BatchError(f"Line {number} is not valid JSON")
+        if item.get("url", BATCH_ENDPOINT) != BATCH_ENDPOINT:
+            raise BatchError(f"Line {number}: only {BATCH_ENDPOINT} is supported")
+        if not isinstance(item.get("body"), dict) or "model" not in item["body"] or "messages" not in item["body"]:
+            raise BatchError(f"Line {number}: body must contain model and messages")
+        items.append(item)
+    if not items:
+        raise BatchError("Batch input is empty")
+    return items
+
+
+def find_provider(providers: dict, model: str):
+    if "@" in model:
+        provider_id, model_name = model.split("@", 1)
+        provider = providers.get(provider_id)
+        if provider and model_name in provider.models:
+            return provider, model_name
+        return None, model
+    return select_provider(providers, model), model
+
+
+def estimate_prompt_cost(items: List[Dict[str, Any]], providers: dict) -> float:
+    """What the prompts of ``items`` cost, the least the batch will be billed."""
+    total = 0
+    for item in items:
+        provider, model_name = find_provider(providers, item["body"].get("model", ""))
+        if provider is None:
+            continue
+        try:
+            input_length = scan_messages(item["body"]["messages"]).input_length
+        except RequestDecodeError:
+            continue
+        total += calculate_tokens(input_length, 0, provider.costs.get(model_name, 1))
+    return total
+
+
+class BatchRunner:
+    def __init__(self, store: BatchStore, registry: ProviderRegistry, update_tokens, get_user=None, concurrency: int = BATCH_CONCURRENCY, chunk_size: int = BATCH_CHUNK_SIZE):
+        self.store = store
+        self.registry = registry
+        self.update_tokens = update_tokens
+        self.get_user = get_user
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.slots = asyncio.Semaphore(concurrency)
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, batch_id: str) -> None:
+        if batch_id not in self.tasks:
+            task = asyncio.ensure_future(self.run(batch_id))
+            self.tasks[batch_id] = task
+            task.add_done_callback(lambda _: self.tasks.pop(batch_id, None))
+
+    def resume(self) -> None:
+        for batch_id in self.store.unfinished_batches():
+            chat_logger.info("Resuming batch %s", batch_id)
+            self.submit(batch_id)
+
+    def cancel(self, batch_id: str) -> None:
+        self.store.set_status(batch_id, "cancelling")
+
+    def _schedule(self, items: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # Round-robin across providers so one slow upstream cannot starve the others.
+        queues = OrderedDict()
+        for item in items:
+            provider, _ = find_provider(self.registry.providers, item["body"].get("model", ""))
+            queues.setdefault(id(provider), deque()).append(item)
+        while queues:
+            for key in list(queues):
+                yield queues[key].popleft()
+                if not queues[key]:
+                    del queues[key]
+
+    async def _run_item(self, item: Dict[str, Any], tier: str = "default") -> Dict[str, Any]:
+        # Each item holds the provider generation it runs on, so a reload drains it first.
+        with self.registry.lease() as generation:
+            return await self._run_item_on(item, generation.providers, tier)
+
+    async def _admit(self, tier: str) -> None:
+        # Items share upstream capacity with interactive requests of the owner's plan.
+        # A shed item waits and asks again rather than failing.
+        while True:
+            try:
+                await admission_scheduler.acquire(tier)
+                return
+            except AdmissionRejected:
+                await asyncio.sleep(ADMISSION_RETRY_DELAY)
+
+    async def _run_item_on(self, item: Dict[str, Any], providers: dict, tier: str) -> Dict[str, Any]:
+        result = {"line": item["line"], "status": "failed", "cost": 0, "response": None}
+        provider, model_name = find_provider(providers, item["body"].get("model", ""))
+        if provider is None:
+            result["response"] = {"message": "Model not found"}
+            return result
+
+        try:
+            request = ChatCompletionRequest(**{**item["body"], "model": model_name, "stream": False, "n": 1})
+            message_stats = scan_messages(request.messages)
+        except Exception as e:
+            result["response"] = {"message": f"Invalid request body: {e}"}
+            return result
+
+        async with self.slots:
+            await self._admit(tier)
+            try:
+                async with provider_slot(provider):
+                    response = None
+                    try:
+                        async for chunk in provider.create_chat_completions(request):
+                            if isinstance(chunk, dict):
+                                response = chunk
+                    except Exception as e:
+                        result["response"] = {"message": str(e)}
+                        return result
+            finally:
+                admission_scheduler.release()
+
+        if not response or "error" in response:
+            result["response"] = {"message": str(response.get("error")) if response else "No response received from provider"}
+            return result
+
+        input_length = message_stats.input_length
+        result["cost"] = calculate_tokens(input_length, get_output_length(response), provider.costs.get(model_name, 1))
+        result["status"] = "completed"
+        result["response"] = response
+        return result
+
+    def _tier(self, batch: Dict[str, Any]) -> str:
+        owner = self.get_user(batch["api_key"]) if self.get_user else None
+        return owner.plan if owner else "default"
+
+    async def run(self, batch_id: str) -> None:
+        batch = self.store.get_batch(batch_id)
+        if batch is None:
+            return
+        workers = []
+        try:
+            self._bill(batch)
+            tier = self._tier(batch)
+            # Workers pull from one round-robin schedule, so a slow item holds up only
+            # its own worker. Results are recorded and billed every chunk_size items.
+            schedule = self._schedule(self.store.pending_items(batch_id))
+            results = []
+            cancelled = exhausted = False
+
+            def flush() -> None:
+                nonlocal cancelled
+                if results:
+                    self.store.record_results(batch_id, results)
+                    results.clear()
+                    self._bill(batch)
+                if self.store.get_batch(batch_id)["status"] == "cancelling":
+                    cancelled = True
+
+            async def work() -> None:
+                nonlocal exhausted
+                while not cancelled:
+                    item = next(schedule, None)
+                    if item is None:
+                        exhausted = True
+                        return
+                    results.append(await self._run_item(item, tier))
+                    if len(results) >= self.chunk_size:
+                        flush()
+
+            flush()
+            workers = [asyncio.ensure_future(work()) for _ in range(self.concurrency)]
+            await asyncio.gather(*workers)
+            flush()
+            self.store.set_status(batch_id, "completed" if exhausted else "cancelled")
+        except Exception as e:
+            chat_logger.error("Batch %s failed: %s", batch_id, e, exc_info=True)
+            self.store.set_status(batch_id, "failed", str(e))
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    def _bill(self, batch: Dict[str, Any]) -> None:
+        # One ledger write per chunk_size items instead of one per item.
+        amount = self.store.unbilled_cost(batch["id"])
+        if amount:
+            self.update_tokens(batch["api_key"], -amount)
+            self.store.mark_billed(batch["id"], amount)
+
+
+def batch_object(batch: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": batch["id"],
+        "object": "batch",
+        "endpoint": BATCH_ENDPOINT,
+        "status": batch["status"],
+        "created_at": int(batch["created_at"]),
+        "completed_at": int(batch["completed_at"]) if batch["completed_at"] else None,
+        "output_file_id": f"{batch['id']}/output",
+        "errors": {"data": [{"message": batch["error"]}]} if batch["error"] else None,
+        "request_counts": {
+            "total": batch["total"],
+            "completed": batch["completed"],
+            "failed": batch["failed"]
+        },
+        "billed": batch["billed"]
+    }
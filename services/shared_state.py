@@ -0,0 +1,190 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from config import SHARED_STATE_BACKEND, SHARED_STATE_SQLITE_PATH
+from services.storage import DatabaseError
+
+
+class SharedState:
+    """State every API worker must agree on.
+
+    ``hit`` counts requests in fixed windows (rate limits), ``bump``/``version``
+    carry cache invalidations between processes and ``claim`` elects one worker
+    for one-off jobs. Credit balances are not here: the user store already
+    applies them atomically for every worker.
+    """
+
+    def hit(self, key: str, windows: Sequence[int], now: Optional[float] = None) -> List[int]:
+        """Count one request for ``key`` and return the count in each window of ``windows`` seconds."""
+        raise NotImplementedError
+
+    async def hit_async(self, key: str, windows: Sequence[int], now: Optional[float] = None) -> List[int]:
+        """``hit`` for request handlers; backends that can block run it off the event loop."""
+        return self.hit(key, windows, now)
+
+    def bump(self, topic: str) -> int:
+        raise NotImplementedError
+
+    def version(self, topic: str) -> int:
+        raise NotImplementedError
+
+    def claim(self, name: str, ttl: float, now: Optional[float] = None) -> bool:
+        """Return True for the first caller of ``name`` until ``ttl`` seconds pass."""
+        raise NotImplementedError
+
+
+class LocalSharedState(SharedState):
+    """In-process state; only correct with a single worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, List[int]] = {}
+        self._versions: Dict[str, int] = {}
+        self._claims: Dict[str, float] = {}
+
+    def hit(self, key: str, windows: Sequence[int], now: Optional[float] = None) -> List[int]:
+        now = time.time() if now is None else now
+        counts = []
+        with self._lock:
+            for window in windows:
+                bucket = int(now // window)
+                counter = self._counters.get((key, window))
+                if counter is None or counter[0] != bucket:
+                    counter = self._counters[(key, window)] = [bucket, 0]
+                counter[1] += 1
+                counts.append(counter[1])
+        return counts
+
+    def bump(self, topic: str) -> int:
+        with self._lock:
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+            return self._versions[topic]
+
+    def version(self, topic: str) -> int:
+        return self._versions.get(topic, 0)
+
+    def claim(self, name: str, ttl: float, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._claims.get(name, 0) > now:
+                return False
+            self._claims[name] = now + ttl
+            return True
+
+
+class SqliteSharedState(SharedState):
+    """State in a WAL-mode SQLite file shared by every worker on the host."""
+
+    HIT = '''
+        INSERT INTO rate_counters (key, window, bucket, count) VALUES (?, ?, ?, 1)
+        ON CONFLICT (key, window) DO UPDATE SET
+            count = CASE WHEN bucket = excluded.bucket THEN count + 1 ELSE 1 END,
+            bucket = excluded.bucket
+        RETURNING count
+    '''
+    BUMP = '''
+        INSERT INTO versions (topic, version) VALUES (?, 1)
+        ON CONFLICT (topic) DO UPDATE SET version = version + 1
+        RETURNING version
+    '''
+    VERSION = "SELECT version FROM versions WHERE topic = ?"
+    CLAIM = '''
+        INSERT INTO claims (name, expires) VALUES (:name, :expires)
+        ON CONFLICT (name) DO UPDATE SET expires = excluded.expires WHERE claims.expires <= :now
+        RETURNING expires
+    '''
+
+    def __init__(self, path: str = SHARED_STATE_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_counters (
+                    key TEXT NOT NULL,
+                    window INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (key, window)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS versions (
+                    topic TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS claims (
+                    name TEXT PRIMARY KEY,
+                    expires REAL NOT NULL
+                )
+            ''')
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, cached_statements=64)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, windows: Sequence[int], now: Optional[float] = None) -> List[int]:
+        now = time.time() if now is None else now
+        conn = self.connection()
+        try:
+            with conn:
+                return [conn.execute(self.HIT, (key, window, int(now // window))).fetchone()[0] for window in windows]
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error counting requests: {str(e)}")
+
+    async def hit_async(self, key: str, windows: Sequence[int], now: Optional[float] = None) -> List[int]:
+        # A write can wait up to busy_timeout for another worker's lock; that must not stall the loop.
+        return await asyncio.to_thread(self.hit, key, windows, now)
+
+    def bump(self, topic: str) -> int:
+        conn = self.connection()
+        try:
+            with conn:
+                return conn.execute(self.BUMP, (topic,)).fetchone()[0]
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error publishing invalidation: {str(e)}")
+
+    def version(self, topic: str) -> int:
+        try:
+            row = self.connection().execute(self.VERSION, (topic,)).fetchone()
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error reading invalidation version: {str(e)}")
+        return row[0] if row else 0
+
+    def claim(self, name: str, ttl: float, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        conn = self.connection()
+        try:
+            with conn:
+                return conn.execute(self.CLAIM, {"name": name, "expires": now + ttl, "now": now}).fetchone() is not None
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error claiming {name}: {str(e)}")
+
+
+SHARED_STATE_BACKENDS = {
+    "local": LocalSharedState,
+    "sqlite": SqliteSharedState,
+}
+
+_states: Dict[str, SharedState] = {}
+_states_lock = threading.Lock()
+
+
+def get_shared_state(backend: str = SHARED_STATE_BACKEND) -> SharedState:
+    with _states_lock:
+        if backend not in _states:
+            if backend not in SHARED_STATE_BACKENDS:
+                raise DatabaseError(f"Unknown shared state backend: {backend}")
+            _states[backend] = SHARED_STATE_BACKENDS[backend]()
+        return _states[backend]
@@ -0,0 +1,644 @@
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from pymongo import MongoClient, IndexModel, ASCENDING
+from pymongo.errors import PyMongoError, BulkWriteError, DuplicateKeyError, OperationFailure
+
+from config import MONGODB_URI, USER_STORE_BACKEND, USER_STORE_SQLITE_PATH
+from services.account import Account, ACCOUNT_COLUMNS
+
+
+class DatabaseError(Exception):
+    pass
+
+
+class UserNotFoundError(DatabaseError):
+    pass
+
+
+USER_FIELDS = ACCOUNT_COLUMNS[1:]
+
+
+class UserStore:
+    """Storage backend for user documents.
+
+    Documents use the MongoDB shape: ``_id`` is the key id (the keyed hash of the API
+    key, see ``utils.api_keys``) and the remaining keys are ``USER_FIELDS``. Every backend accepts and returns that shape.
+    """
+
+    def ensure_indexes(self) -> None:
+        pass
+
+    def get_by_api_key(self, api_key: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_by_discord_id(self, discord_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def account_by_api_key(self, api_key: str) -> Optional[Account]:
+        return Account.from_document(self.get_by_api_key(api_key, USER_FIELDS))
+
+    def account_by_discord_id(self, discord_id: str) -> Optional[Account]:
+        return Account.from_document(self.get_by_discord_id(discord_id, USER_FIELDS))
+
+    def insert(self, document: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def bulk_insert(self, documents: Iterable[Dict[str, Any]]) -> int:
+        raise NotImplementedError
+
+    def increment_tokens(self, api_key: str, amount: float) -> bool:
+        raise NotImplementedError
+
+    def set_fields(self, api_key: str, fields: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def set_fields_by_discord_id(self, discord_id: str, fields: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def change_api_key(self, discord_id: str, new_api_key: str, fields: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Move the user to ``new_api_key``, also setting ``fields``, and return the old document."""
+        raise NotImplementedError
+
+    def rekey(self, api_key: str, new_api_key: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+        """Move the user stored under ``api_key`` to ``new_api_key``, also setting ``fields``.
+
+        True if the user is now under ``new_api_key``, including when a concurrent
+        call moved it first; False if neither key exists.
+        """
+        raise NotImplementedError
+
+    def delete_by_discord_id(self, discord_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def iter_users(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def refill_and_increment(self, api_key: str, amount: float, now: float, period: float) -> bool:
+        """Apply the lazy refill accrued since ``last_refill`` plus ``amount`` in one atomic write."""
+        raise NotImplementedError
+
+    def reset_to_plan_limits(self, limits: Dict[str, float], default_limit: float, reset_before: float, now: float) -> int:
+        """Refill every user last reset at or before ``reset_before`` to its plan limit."""
+        raise NotImplementedError
+
+    def reset_expired_daily_limits(self, now: float, period: float = 86400) -> int:
+        """Refill users whose daily allowance expired and start a new ``period``."""
+        raise NotImplementedError
+
+
+class MongoUserStore(UserStore):
+    def __init__(self, mongodb_url: str = MONGODB_URI, database: str = "ozone_db"):
+        try:
+            self.client = MongoClient(mongodb_url)
+            self.db = self.client[database]
+            self.users = self.db.users
+        except PyMongoError as e:
+            raise DatabaseError(f"MongoDB connection error: {str(e)}")
+        # None until the first key move finds out whether the server supports transactions.
+        self.transactions: Optional[bool] = None
+
+    # (name, keys, options) for every index the user queries rely on.
+    INDEXES = (
+        ("discord_id_unique", [("discord_id", ASCENDING)], {"unique": True, "partialFilterExpression": {"discord_id": {"$gt": ""}}}),
+        ("last_reset", [("last_reset", ASCENDING)], {}),
+        ("daily_token_expiration", [("daily_token_expiration", ASCENDING)], {}),
+    )
+    # Indexes earlier versions created that no query uses any more; dropped so writes stop maintaining them.
+    RETIRED_INDEXES = ("plan_expiration",)
+
+    def ensure_indexes(self) -> None:
+        try:
+            self.users.create_indexes([IndexModel(keys, name=name, **options) for name, keys, options in self.INDEXES])
+            existing = self.users.index_information()
+            for name in self.RETIRED_INDEXES:
+                if name in existing:
+                    self.users.drop_index(name)
+        except PyMongoError as e:
+            raise DatabaseError(f"Error creating user indexes: {str(e)}")
+        self.recover_pending_moves()
+
+    def _projection(self, fields: Optional[Iterable[str]]) -> Optional[Dict[str, int]]:
+        return {field: 1 for field in fields} if fields is not None else None
+
+    def get_by_api_key(self, api_key: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return self.users.find_one({"_id": api_key}, self._projection(fields))
+        except PyMongoError as e:
+            raise DatabaseError(f"Error fetching user by API key: {str(e)}")
+
+    def get_by_discord_id(self, discord_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            user = self.users.find_one({"discord_id": discord_id}, self._projection(fields))
+            if user is None:
+                # A key change that crashed after deleting the original leaves only the parked copy.
+                pending = self.users.find_one({"discord_id": f"{discord_id}:pending"})
+                if pending is not None and self._recover_move(pending) is not None:
+                    user = self.users.find_one({"discord_id": discord_id}, self._projection(fields))
+            return user
+        except PyMongoError as e:
+            raise DatabaseError(f"Error fetching user data: {str(e)}")
+
+    def insert(self, document: Dict[str, Any]) -> None:
+        try:
+            result = self.users.insert_one(document)
+        except PyMongoError as e:
+            raise DatabaseError(f"Error creating user: {str(e)}")
+        if not result.acknowledged:
+            raise DatabaseError("Failed to create new user")
+
+    def bulk_insert(self, documents: Iterable[Dict[str, Any]]) -> int:
+        documents = list(documents)
+        if not documents:
+            return 0
+        try:
+            return len(self.users.insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            return e.details.get("nInserted", 0)
+        except PyMongoError as e:
+            raise DatabaseError(f"Error inserting users: {str(e)}")
+
+    def increment_tokens(self, api_key: str, amount: float) -> bool:
+        try:
+            result = self.users.update_one({"_id": api_key}, {"$inc": {"current_tokens": amount}})
+        except PyMongoError as e:
+            raise DatabaseError(f"Error updating tokens: {str(e)}")
+        return result.matched_count > 0
+
+    def set_fields(self, api_key: str, fields: Dict[str, Any]) -> bool:
+        try:
+            result = self.users.update_one({"_id": api_key}, {"$set": fields})
+        except PyMongoError as e:
+            raise DatabaseError(f"Error updating user: {str(e)}")
+        return result.matched_count > 0
+
+    def set_fields_by_discord_id(self, discord_id: str, fields: Dict[str, Any]) -> bool:
+        try:
+            result = self.users.update_one({"discord_id": discord_id}, {"$set": fields})
+        except PyMongoError as e:
+            raise DatabaseError(f"Error updating user: {str(e)}")
+        return result.matched_count > 0
+
+    # Moves older than this are abandoned rather than still running in another process.
+    PENDING_MOVE_TIMEOUT = 60
+
+    def _move(self, user: Dict[str, Any], new_api_key: str, fields: Optional[Dict[str, Any]]) -> None:
+        # _id is immutable in MongoDB, so the document is re-inserted under the new key.
+        moved = {**user, **(fields or {}), "_id": new_api_key}
+        if self.transactions is not False:
+            try:
+                with self.client.start_session() as session:
+                    with session.start_transaction():
+                        self.users.delete_one({"_id": user["_id"]}, session=session)
+                        self.users.insert_one(moved, session=session)
+                self.transactions = True
+                return
+            except OperationFailure as e:
+                # IllegalOperation: a standalone server, which has no transactions.
+                if e.code != 20 or self.transactions:
+                    raise
+                self.transactions = False
+
+        # Without transactions the copy is parked under a pending discord_id, because
+        # discord_id is unique, until the original is gone. recover_pending_moves
+        # finishes or undoes a move interrupted between these steps.
+        discord_id = user.get("discord_id")
+        if not discord_id:
+            self.users.insert_one(moved)
+            self.users.delete_one({"_id": user["_id"]})
+            return
+        self.users.insert_one({**moved, "discord_id": f"{discord_id}:pending", "pending_since": time.time()})
+        try:
+            self.users.delete_one({"_id": user["_id"]})
+        except PyMongoError:
+            self.users.delete_one({"_id": new_api_key})
+            raise
+        self.users.update_one({"_id": new_api_key}, {"$set": {"discord_id": discord_id}, "$unset": {"pending_since": ""}})
+
+    def _recover_move(self, pending: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        discord_id = pending["discord_id"][:-len(":pending")]
+        if self.users.find_one({"discord_id": discord_id}, {"_id": 1}):
+            # The original was never deleted: the move failed, so the copy goes.
+            self.users.delete_one({"_id": pending["_id"]})
+            return None
+        self.users.update_one({"_id": pending["_id"]}, {"$set": {"discord_id": discord_id}, "$unset": {"pending_since": ""}})
+        return self.users.find_one({"_id": pending["_id"]})
+
+    def recover_pending_moves(self, now: Optional[float] = None) -> int:
+        """Finish or undo key moves left half done by a crash; returns how many were found."""
+        cutoff = (now or time.time()) - self.PENDING_MOVE_TIMEOUT
+        try:
+            stale = list(self.users.find({"discord_id": {"$regex": ":pending$"}, "pending_since": {"$lt": cutoff}}))
+            for pending in stale:
+                self._recover_move(pending)
+        except PyMongoError as e:
+            raise DatabaseError(f"Error recovering pending key changes: {str(e)}")
+        return len(stale)
+
+    def change_api_key(self, discord_id: str, new_api_key: str, fields: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            user = self.users.find_one({"discord_id": discord_id})
+            if not user:
+                return None
+            self._move(user, new_api_key, fields)
+            return user
+        except DuplicateKeyError:
+            return None
+        except PyMongoError as e:
+            raise DatabaseError(f"Error regenerating API key: {str(e)}")
+
+    def rekey(self, api_key: str, new_api_key: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+        try:
+            user = self.users.find_one({"_id": api_key})
+            if not user:
+                return False
+            self._move(user, new_api_key, fields)
+            return True
+        except DuplicateKeyError:
+            return True
+        except PyMongoError as e:
+            raise DatabaseError(f"Error rekeying user: {str(e)}")
+
+    def delete_by_discord_id(self, discord_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return self.users.find_one_and_delete({"discord_id": discord_id}, projection=self._projection(fields))
+        except PyMongoError as e:
+            raise DatabaseError(f"Error deleting user: {str(e)}")
+
+    def iter_users(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        try:
+            yield from self.users.find().batch_size(batch_size)
+        except PyMongoError as e:
+            raise DatabaseError(f"Error reading users: {str(e)}")
+
+    def count(self) -> int:
+        try:
+            return self.users.estimated_document_count()
+        except PyMongoError as e:
+            raise DatabaseError(f"Error counting users: {str(e)}")
+
+    def refill_and_increment(self, api_key: str, amount: float, now: float, period: float) -> bool:
+        balance = {"$ifNull": ["$current_tokens", 0]}
+        limit = {"$ifNull": ["$daily_token_limit", 0]}
+        elapsed = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$last_refill", {"$ifNull": ["$last_reset", now]}]}]}]}
+        refilled = {"$max": [balance, {"$min": [limit, {"$add": [balance, {"$divide": [{"$multiply": [limit, elapsed]}, period]}]}]}]}
+        try:
+            result = self.users.update_one(
+                {"_id": api_key},
+                [{"$set": {"current_tokens": {"$add": [refilled, amount]}, "last_refill": now}}]
+            )
+        except PyMongoError as e:
+            raise DatabaseError(f"Error updating tokens: {str(e)}")
+        return result.matched_count > 0
+
+    def reset_to_plan_limits(self, limits: Dict[str, float], default_limit: float, reset_before: float, now: float) -> int:
+        plan_limit = {"$switch": {
+            "branches": [{"case": {"$eq": ["$plan", plan]}, "then": limit} for plan, limit in limits.items()],
+            "default": default_limit
+        }}
+        try:
+            result = self.users.update_many(
+                {"$or": [{"last_reset": None}, {"last_reset": {"$lte": reset_before}}]},
+                [{"$set": {"current_tokens": plan_limit, "last_reset": now, "last_refill": now}}]
+            )
+        except PyMongoError as e:
+            raise DatabaseError(f"Error resetting tokens: {str(e)}")
+        return result.modified_count
+
+    def reset_expired_daily_limits(self, now: float, period: float = 86400) -> int:
+        try:
+            result = self.users.update_many(
+                {
+                    "daily_token_limit": {"$ne": None},
+                    "$or": [{"daily_token_expiration": None}, {"daily_token_expiration": {"$lte": now}}]
+                },
+                [{"$set": {"current_tokens": "$daily_token_limit", "daily_token_expiration": now + period, "last_refill": now}}]
+            )
+        except PyMongoError as e:
+            raise DatabaseError(f"Error resetting daily tokens: {str(e)}")
+        return result.modified_count
+
+
+    def query_filters(self, now: float) -> Dict[str, Dict[str, Any]]:
+        return {
+            "get_by_api_key": {"_id": ""},
+            # Real ids are non-empty, which is what lets the planner use the partial unique index.
+            "get_by_discord_id": {"discord_id": "0"},
+            "reset_to_plan_limits": {"$or": [{"last_reset": None}, {"last_reset": {"$lte": now}}]},
+            "reset_expired_daily_limits": {
+                "daily_token_limit": {"$ne": None},
+                "$or": [{"daily_token_expiration": None}, {"daily_token_expiration": {"$lte": now}}]
+            },
+        }
+
+    def collection_scans(self, now: float) -> Dict[str, list]:
+        """Explain every query shape the store issues and report the ones that scan the collection."""
+        scans = {}
+        for name, query in self.query_filters(now).items():
+            try:
+                plan = self.users.find(query).explain()["queryPlanner"]["winningPlan"]
+            except PyMongoError as e:
+                raise DatabaseError(f"Error explaining {name}: {str(e)}")
+            stages = list(_plan_stages(plan))
+            if "COLLSCAN" in stages:
+                scans[name] = stages
+        return scans
+
+
+def _plan_stages(plan: Dict[str, Any]) -> Iterator[str]:
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+class SqliteUserStore(UserStore):
+    """SQLite backend in WAL mode with one connection per thread.
+
+    Statements are constant strings so sqlite3's per-connection statement cache
+    keeps them prepared between calls.
+    """
+
+    COLUMNS = ACCOUNT_COLUMNS
+    SELECT = f"SELECT {', '.join(COLUMNS)} FROM accounts"
+    SELECT_BY_API_KEY = SELECT + " WHERE api_key = ?"
+    SELECT_BY_DISCORD_ID = SELECT + " WHERE discord_id = ?"
+    INSERT = f"INSERT INTO accounts ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})"
+    INSERT_OR_IGNORE = INSERT.replace("INSERT", "INSERT OR IGNORE", 1)
+    INCREMENT_TOKENS = "UPDATE accounts SET current_tokens = COALESCE(current_tokens, 0) + ? WHERE api_key = ?"
+    REFILL_AND_INCREMENT = '''
+        UPDATE accounts
+        SET current_tokens = MAX(
+                COALESCE(current_tokens, 0),
+                MIN(
+                    COALESCE(daily_token_limit, 0),
+                    COALESCE(current_tokens, 0)
+                        + COALESCE(daily_token_limit, 0) * MAX(:now - COALESCE(last_refill, last_reset, :now), 0) / :period
+                )
+            ) + :amount,
+            last_refill = :now
+        WHERE api_key = :api_key
+    '''
+
+    def __init__(self, path: str = USER_STORE_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS accounts (
+                api_key TEXT PRIMARY KEY,
+                current_tokens REAL DEFAULT 0,
+                tokens REAL DEFAULT 0,
+                last_reset REAL,
+                plan TEXT DEFAULT 'default',
+                plan_expiration REAL,
+                daily_token_limit REAL,
+                daily_token_expiration REAL,
+                discord_id TEXT UNIQUE,
+                last_refill REAL,
+                key_hint TEXT
+            )
+        ''')
+        conn.commit()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, cached_statements=256)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def _document(self, row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        document = dict(zip(USER_FIELDS, row[1:]))
+        document["_id"] = row[0]
+        return document
+
+    def _row(self, document: Dict[str, Any]) -> tuple:
+        return (document["_id"],) + tuple(document.get(field) for field in USER_FIELDS)
+
+    def _check_fields(self, fields: Dict[str, Any]) -> None:
+        unknown = set(fields) - set(USER_FIELDS)
+        if unknown:
+            raise DatabaseError(f"Unknown user fields: {', '.join(sorted(unknown))}")
+
+    def get_by_api_key(self, api_key: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return self._document(self.connection().execute(self.SELECT_BY_API_KEY, (api_key,)).fetchone())
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error fetching user by API key: {str(e)}")
+
+    def get_by_discord_id(self, discord_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return self._document(self.connection().execute(self.SELECT_BY_DISCORD_ID, (discord_id,)).fetchone())
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error fetching user data: {str(e)}")
+
+    def account_by_api_key(self, api_key: str) -> Optional[Account]:
+        try:
+            return Account.from_row(self.connection().execute(self.SELECT_BY_API_KEY, (api_key,)).fetchone())
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error fetching user by API key: {str(e)}")
+
+    def account_by_discord_id(self, discord_id: str) -> Optional[Account]:
+        try:
+            return Account.from_row(self.connection().execute(self.SELECT_BY_DISCORD_ID, (discord_id,)).fetchone())
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error fetching user data: {str(e)}")
+
+    def insert(self, document: Dict[str, Any]) -> None:
+        conn = self.connection()
+        try:
+            with conn:
+                conn.execute(self.INSERT, self._row(document))
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error creating user: {str(e)}")
+
+    def bulk_insert(self, documents: Iterable[Dict[str, Any]]) -> int:
+        conn = self.connection()
+        try:
+            with conn:
+                before = conn.total_changes
+                conn.executemany(self.INSERT_OR_IGNORE, (self._row(document) for document in documents))
+                return conn.total_changes - before
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error inserting users: {str(e)}")
+
+    def increment_tokens(self, api_key: str, amount: float) -> bool:
+        conn = self.connection()
+        try:
+            with conn:
+                return conn.execute(self.INCREMENT_TOKENS, (amount, api_key)).rowcount > 0
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error updating tokens: {str(e)}")
+
+    def refill_and_increment(self, api_key: str, amount: float, now: float, period: float) -> bool:
+        conn = self.connection()
+        try:
+            with conn:
+                cursor = conn.execute(self.REFILL_AND_INCREMENT, {"api_key": api_key, "amount": amount, "now": now, "period": period})
+                return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error updating tokens: {str(e)}")
+
+    def _update(self, key_column: str, key: str, fields: Dict[str, Any]) -> bool:
+        self._check_fields(fields)
+        if not fields:
+            lookup = self.get_by_api_key if key_column == "api_key" else self.get_by_discord_id
+            return lookup(key) is not None
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        conn = self.connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    f"UPDATE accounts SET {assignments} WHERE {key_column} = ?",
+                    tuple(fields.values()) + (key,)
+                )
+                return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error updating user: {str(e)}")
+
+    def set_fields(self, api_key: str, fields: Dict[str, Any]) -> bool:
+        return self._update("api_key", api_key, fields)
+
+    def set_fields_by_discord_id(self, discord_id: str, fields: Dict[str, Any]) -> bool:
+        return self._update("discord_id", discord_id, fields)
+
+    def change_api_key(self, discord_id: str, new_api_key: str, fields: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        fields = fields or {}
+        self._check_fields(fields)
+        assignments = "".join(f", {field} = ?" for field in fields)
+        conn = self.connection()
+        try:
+            with conn:
+                user = self._document(conn.execute(self.SELECT_BY_DISCORD_ID, (discord_id,)).fetchone())
+                if user is None:
+                    return None
+                conn.execute(
+                    f"UPDATE accounts SET api_key = ?{assignments} WHERE discord_id = ?",
+                    (new_api_key,) + tuple(fields.values()) + (discord_id,)
+                )
+                return user
+        except sqlite3.IntegrityError:
+            return None
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error regenerating API key: {str(e)}")
+
+    def rekey(self, api_key: str, new_api_key: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+        fields = fields or {}
+        self._check_fields(fields)
+        assignments = "".join(f", {field} = ?" for field in fields)
+        conn = self.connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    f"UPDATE accounts SET api_key = ?{assignments} WHERE api_key = ?",
+                    (new_api_key,) + tuple(fields.values()) + (api_key,)
+                )
+                return cursor.rowcount > 0
+        except sqlite3.IntegrityError:
+            return True
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error rekeying user: {str(e)}")
+
+    def delete_by_discord_id(self, discord_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        conn = self.connection()
+        try:
+            with conn:
+                user = self._document(conn.execute(self.SELECT_BY_DISCORD_ID, (discord_id,)).fetchone())
+                if user is not None:
+                    conn.execute("DELETE FROM accounts WHERE discord_id = ?", (discord_id,))
+                return user
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error deleting user: {str(e)}")
+
+    def iter_users(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        try:
+            cursor = self.connection().execute(self.SELECT)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield self._document(row)
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error reading users: {str(e)}")
+
+    def count(self) -> int:
+        try:
+            return self.connection().execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error counting users: {str(e)}")
+
+    def reset_to_plan_limits(self, limits: Dict[str, float], default_limit: float, reset_before: float, now: float) -> int:
+        plan_cases = " ".join("WHEN ? THEN ?" for _ in limits)
+        params = [value for plan, limit in limits.items() for value in (plan, limit)]
+        conn = self.connection()
+        try:
+            with conn:
+                return conn.execute(
+                    f"""UPDATE accounts
+                        SET current_tokens = CASE plan {plan_cases} ELSE ? END,
+                            last_reset = ?,
+                            last_refill = ?
+                        WHERE last_reset IS NULL OR last_reset <= ?""",
+                    params + [default_limit, now, now, reset_before]
+                ).rowcount
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error resetting tokens: {str(e)}")
+
+    def reset_expired_daily_limits(self, now: float, period: float = 86400) -> int:
+        conn = self.connection()
+        try:
+            with conn:
+                return conn.execute(
+                    """UPDATE accounts
+                        SET current_tokens = daily_token_limit,
+                            daily_token_expiration = ?,
+                            last_refill = ?
+                        WHERE daily_token_limit IS NOT NULL
+                          AND (daily_token_expiration IS NULL OR daily_token_expiration <= ?)""",
+                    (now + period, now, now)
+                ).rowcount
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Error resetting daily tokens: {str(e)}")
+
+
+USER_STORE_BACKENDS = {
+    "mongodb": MongoUserStore,
+    "sqlite": SqliteUserStore,
+}
+
+_stores: Dict[str, UserStore] = {}
+_stores_lock = threading.Lock()
+
+
+def create_user_store(backend: str, **options) -> UserStore:
+    if backend not in USER_STORE_BACKENDS:
+        raise DatabaseError(f"Unknown user store backend: {backend}")
+    return USER_STORE_BACKENDS[backend](**options)
+
+
+def get_user_store(backend: str = USER_STORE_BACKEND) -> UserStore:
+    with _stores_lock:
+        if backend not in _stores:
+            _stores[backend] = create_user_store(backend)
+        return _stores[backend]
+
+
+def use_user_store(store: UserStore, backend: str = USER_STORE_BACKEND) -> None:
+    """Make ``store`` the process-wide store for ``backend`` (benchmarks, load tests)."""
+    with _stores_lock:
+        _stores[backend] = store
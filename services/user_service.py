@@ -2,183 +2,140 @@ from typing import Optional, Dict, Any
 from utils.logger import user_logger
 import time
 import json
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
-from config import MONGODB_URI
-
-class DatabaseError(Exception):
-    pass
-
-class UserNotFoundError(DatabaseError):
-    pass
+from services.storage import UserStore, DatabaseError, UserNotFoundError, get_user_store
+from services.account import Account
+from utils.quota import lazy_refill_enabled
+from utils.api_keys import hash_api_key, key_hint, negative_keys, API_KEYS_TOPIC
+from services.shared_state import SharedState, get_shared_state
+from utils.metrics import db_duration
+from config import QUOTA_REFILL_PERIOD, LEGACY_PLAINTEXT_KEYS
 
 with open("data/plans.json", "r") as f:
     plans = json.loads(f.read())
 
 class UserService:
-    def __init__(self, mongodb_url: str = MONGODB_URI):
-        try:
-            self.client = MongoClient(mongodb_url)
-            self.db = self.client.ozone_db
-            self.users = self.db.users
-        except PyMongoError as e:
-            user_logger.error(f"Failed to connect to MongoDB: {str(e)}")
-            raise DatabaseError(f"MongoDB connection error: {str(e)}")
-
-    def get_user_data(self, user_id: str) -> Optional[Dict[str, Any]]:
-        try:
-            result = self.users.find_one({"discord_id": user_id})
-            if not result:
-                return None
-
-            current_time = time.time()
-            time_since_reset = current_time - (result.get('last_reset', 0) or 0)
-
-            return {
-                "api_key": result.get('_id'), 
-                "current_tokens": result.get('current_tokens', 0),
-                "last_reset": result.get('last_reset'),
-                "daily_token_limit": result.get('daily_token_limit'),
-                "daily_token_expiration": result.get('daily_token_expiration'),
-                "plan_expiration": result.get('plan_expiration'),
-                "reset_available": time_since_reset >= 86400,
-                "time_since_reset": time_since_reset,
-                "plan": result.get('plan', 'default') 
-            }
-        except PyMongoError as e:
-            raise DatabaseError(f"Error fetching user data: {str(e)}")
-            
-    def update_tokens(self, user_id: str, token_change: int) -> None:
-        try:
-            result = self.users.find_one_and_update(
-                {"_id": user_id},
-                {"$inc": {"current_tokens": token_change}},
-                return_document=True
-            )
-            
-            if not result:
-                raise UserNotFoundError(f"User {user_id} not found")
-
+    """User accounts keyed by key id.
 
-        except PyMongoError as e:
-            raise DatabaseError(f"Error updating tokens: {str(e)}")
-
-    def create_user(self, api_key: str, user_data: Dict[str, Any]) -> None:
+    Only ``get_user_by_api_key``, ``create_user``, ``regenerate_api_key`` and
+    ``key_id`` take a raw API key; every other method takes the key id found on
+    ``Account.api_key``.
+    """
 
+    def __init__(self, store: Optional[UserStore] = None, shared_state: Optional[SharedState] = None):
         try:
-            document = {
-                "_id": api_key,
-                "current_tokens": user_data.get("daily_token_limit", 0),
-                "tokens": user_data.get('tokens', 0),
-                "last_reset": user_data.get('last_reset', time.time()),
-                "plan": user_data.get('plan', 'default'),
-                "daily_token_limit": user_data.get('daily_token_limit', 0),
-                "discord_id": user_data.get('discord_id')
-            }
+            self.store = store or get_user_store()
+            self.shared_state = shared_state or get_shared_state()
+        except DatabaseError as e:
+            user_logger.error("Failed to open user store: %s", e)
+            raise
+
+    def ensure_indexes(self) -> None:
+        self.store.ensure_indexes()
+
+    @staticmethod
+    def key_id(api_key: str) -> str:
+        return hash_api_key(api_key)
+
+    def get_user_data(self, user_id: str) -> Optional[Account]:
+        with db_duration.time("get_user_data"):
+            return self.store.account_by_discord_id(user_id)
             
-            if "plan" in user_data and user_data["plan"] in plans:
-                document["current_tokens"] = plans[user_data["plan"]]["tokens_per_day"]
+    def update_tokens(self, user_id: str, token_change: int) -> None:
+        with db_duration.time("update_tokens"):
+            if lazy_refill_enabled():
+                found = self.store.refill_and_increment(user_id, token_change, time.time(), QUOTA_REFILL_PERIOD)
             else:
-                document["current_tokens"] = 0
+                found = self.store.increment_tokens(user_id, token_change)
+        if not found:
+            raise UserNotFoundError(f"User {user_id} not found")
 
-            
-            result = self.users.insert_one(document)
-            
-            if not result.acknowledged:
-                raise DatabaseError("Failed to create new user")
-                
-            
-        except PyMongoError as e:
-            raise DatabaseError(f"Error creating user: {str(e)}")
+    def create_user(self, api_key: str, user_data: Dict[str, Any]) -> None:
+        key_id = hash_api_key(api_key)
+        document = {
+            "_id": key_id,
+            "key_hint": key_hint(api_key),
+            "current_tokens": user_data.get("daily_token_limit", 0),
+            "tokens": user_data.get('tokens', 0),
+            "last_reset": user_data.get('last_reset', time.time()),
+            "last_refill": time.time(),
+            "plan": user_data.get('plan', 'default'),
+            "plan_expiration": user_data.get('plan_expiration'),
+            "daily_token_limit": user_data.get('daily_token_limit', 0),
+            "daily_token_expiration": user_data.get('daily_token_expiration'),
+            "discord_id": user_data.get('discord_id')
+        }
+        
+        if "plan" in user_data and user_data["plan"] in plans:
+            document["current_tokens"] = plans[user_data["plan"]]["tokens_per_day"]
+        else:
+            document["current_tokens"] = 0
+
+        self.store.insert(document)
+        negative_keys.discard(key_id)
+        self.shared_state.bump(API_KEYS_TOPIC)
 
     def change_plan(self, api_key: str, plan_name: str, expiration_time: float) -> None:
-        try:
-          update_data = {
-              "$set": {
-                "plan": plan_name,
-                  "plan_expiration": expiration_time
-              }
-          }
-          
-          if plan_name in plans:
-            update_data["$set"]["current_tokens"] = plans[plan_name]["tokens_per_day"]
-          
-          result = self.users.find_one_and_update(
-                {"_id": api_key},
-                update_data,
-                return_document=True
-            )
-
-          if not result:
-              raise UserNotFoundError(f"User {api_key} not found")
-              
-
-        except PyMongoError as e:
-          raise DatabaseError(f"Error updating user plan: {str(e)}")
+        update_data = {
+            "plan": plan_name,
+            "plan_expiration": expiration_time
+        }
+        
+        if plan_name in plans:
+            update_data["current_tokens"] = plans[plan_name]["tokens_per_day"]
+            update_data["daily_token_limit"] = plans[plan_name]["tokens_per_day"]
+            update_data["last_refill"] = time.time()
+        
+        if not self.store.set_fields(api_key, update_data):
+            raise UserNotFoundError(f"User {api_key} not found")
+
+    def reset_user_tokens(self, api_key: str, token_limit: float) -> None:
+        now = time.time()
+        if not self.store.set_fields(api_key, {"current_tokens": token_limit, "last_reset": now, "last_refill": now}):
+            raise UserNotFoundError(f"User {api_key} not found")
     
-    def get_user_by_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
-
-        try:
-            result = self.users.find_one({"_id": api_key})
-            if not result:
-                return None
-
-            current_time = time.time()
-            time_since_reset = current_time - (result.get('last_reset', 0) or 0)
-
-
-            return {
-                "api_key": result.get('_id'), 
-                "current_tokens": result.get('current_tokens', 0),
-                "last_reset": result.get('last_reset'),
-                "daily_token_limit": result.get('daily_token_limit'),
-                "daily_token_expiration": result.get('daily_token_expiration'),
-                "plan_expiration": result.get('plan_expiration'),
-                "reset_available": time_since_reset >= 86400,
-                "time_since_reset": time_since_reset,
-                "plan": result.get('plan', 'default')  
-            }
-            print(result)
-            return result
-        except PyMongoError as e:
-            raise DatabaseError(f"Error fetching user by API key: {str(e)}")
+    def reset_all_tokens(self) -> int:
+        now = time.time()
+        limits = {name: plan["tokens_per_day"] for name, plan in plans.items()}
+        return self.store.reset_to_plan_limits(limits, plans["default"]["tokens_per_day"], now, now)
+    
+    def get_user_by_api_key(self, api_key: str) -> Optional[Account]:
+        key_id = hash_api_key(api_key)
+        negative_keys.sync(self.shared_state.version)
+        if key_id in negative_keys:
+            return None
+        with db_duration.time("get_user_by_api_key"):
+            user = self.store.account_by_api_key(key_id)
+            if user is None and LEGACY_PLAINTEXT_KEYS:
+                user = self._rehash_legacy_key(api_key, key_id)
+        if user is None:
+            negative_keys.add(key_id)
+        return user
+
+    def _rehash_legacy_key(self, api_key: str, key_id: str) -> Optional[Account]:
+        # Users stored before keys were hashed are keyed by the plaintext key; the
+        # first lookup with that key moves the user to its key id.
+        if not self.store.rekey(api_key, key_id, {"key_hint": key_hint(api_key)}):
+            return None
+        user_logger.info("Rehashed legacy plaintext key %s", key_hint(api_key))
+        return self.store.account_by_api_key(key_id)
+
+    def get_user_by_key_id(self, key_id: str) -> Optional[Account]:
+        with db_duration.time("get_user_by_key_id"):
+            return self.store.account_by_api_key(key_id)
             
     def regenerate_api_key(self, discord_id: str, new_api_key: str) -> Optional[int]:
-        try:
-            user = self.users.find_one({"discord_id": discord_id})
-            if not user:
-                return None
-
-            current_tokens = user.get('tokens')
-            
-            result = self.users.find_one_and_update(
-                {"discord_id": discord_id},
-                {"$set": {"_id": new_api_key}},
-                return_document=True
-            )
-
-            if not result:
-                return None
-            
-
-            return current_tokens
-
-        except PyMongoError as e:
-            raise DatabaseError(f"Error regenerating API key: {str(e)}")
+        key_id = hash_api_key(new_api_key)
+        user = self.store.change_api_key(discord_id, key_id, {"key_hint": key_hint(new_api_key)})
+        if not user:
+            return None
+        negative_keys.discard(key_id)
+        negative_keys.add(user["_id"])
+        self.shared_state.bump(API_KEYS_TOPIC)
+        return user.get('tokens')
 
     def delete_user(self, discord_id: str) -> Optional[str]:
-        try:
-            user = self.users.find_one({"discord_id": discord_id})
-            if not user:
-                return None
-
-            api_key = user.get('_id')
-            result = self.users.delete_one({"discord_id": discord_id})
-
-            if result.deleted_count == 0:
-                return None
-
-            return api_key
-
-        except PyMongoError as e:
-            raise DatabaseError(f"Error deleting user: {str(e)}")
\ No newline at end of file
+        user = self.store.delete_by_discord_id(discord_id, ("_id", "key_hint"))
+        if not user:
+            return None
+        negative_keys.add(user["_id"])
+        return user.get('key_hint') or user["_id"]
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import math
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from config import (
+    ADMISSION_CAPACITY,
+    ADMISSION_RESERVED,
+    ADMISSION_AGING_SECONDS,
+    ADMISSION_MAX_WAIT,
+    ADMISSION_MAX_QUEUE,
+)
+
+with open("data/plans.json", "r") as f:
+    plans = json.loads(f.read())
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("tier", "rank", "enqueued", "future")
+
+    def __init__(self, tier: str, rank: int, future: asyncio.Future):
+        self.tier = tier
+        self.rank = rank
+        self.enqueued = time.monotonic()
+        self.future = future
+
+
+class AdmissionScheduler:
+    """Admits requests to upstream providers by plan tier.
+
+    Tiers rank in ``plans.json`` order. Waiting requests are admitted by rank plus
+    ``waited / aging_seconds`` so low tiers are never starved, while ``reserved``
+    keeps a fraction of capacity for a tier and everything above it (e.g.
+    ``{"premium": 0.3}``). Requests that would wait longer than ``max_wait`` or
+    find ``max_queue`` waiters ahead of them are shed with ``AdmissionRejected``.
+    """
+
+    def __init__(
+        self,
+        capacity: int = ADMISSION_CAPACITY,
+        reserved: Optional[Dict[str, float]] = None,
+        aging_seconds: float = ADMISSION_AGING_SECONDS,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        tiers: Optional[List[str]] = None,
+    ):
+        self.capacity = capacity
+        self.aging_seconds = aging_seconds
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.tiers = tiers or list(plans)
+        self.ranks = {tier: rank for rank, tier in enumerate(self.tiers)}
+        reserved = ADMISSION_RESERVED if reserved is None else reserved
+        self.limits = [self._limit_for(rank, reserved) for rank in range(len(self.tiers))]
+        self.in_use = 0
+        self.waiters: List[_Waiter] = []
+        self.tier_stats = defaultdict(lambda: {"admitted": 0, "shed": 0, "queue_wait_total": 0.0, "queue_wait_max": 0.0, "queued": 0})
+
+    def _limit_for(self, rank: int, reserved: Dict[str, float]) -> int:
+        held_back = max((fraction for tier, fraction in reserved.items() if self.ranks.get(tier, -1) > rank), default=0)
+        return self.capacity - math.ceil(self.capacity * held_back)
+
+    def rank(self, tier: str) -> int:
+        return self.ranks.get(tier, 0)
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        self.waiters.sort(key=lambda waiter: waiter.rank + (now - waiter.enqueued) / self.aging_seconds, reverse=True)
+        for waiter in list(self.waiters):
+            if self.in_use >= self.capacity:
+                break
+            if self.in_use < self.limits[waiter.rank]:
+                self.waiters.remove(waiter)
+                self.in_use += 1
+                waiter.future.set_result(True)
+
+    def _record(self, tier: str, waited: float, admitted: bool) -> None:
+        stats = self.tier_stats[tier]
+        if admitted:
+            stats["admitted"] += 1
+            stats["queue_wait_total"] += waited
+            stats["queue_wait_max"] = max(stats["queue_wait_max"], waited)
+        else:
+            stats["shed"] += 1
+
+    def _make_room(self, rank: int) -> bool:
+        # A full queue sheds its lowest-ranked waiter rather than a higher-tier arrival.
+        lowest = min(self.waiters, key=lambda waiter: (waiter.rank, -waiter.enqueued))
+        if lowest.rank >= rank:
+            return False
+        self.waiters.remove(lowest)
+        lowest.future.set_exception(AdmissionRejected("Displaced by a higher-priority request"))
+        return True
+
+    async def acquire(self, tier: str) -> None:
+        if len(self.waiters) >= self.max_queue and not self._make_room(self.rank(tier)):
+            self._record(tier, 0, False)
+            raise AdmissionRejected(f"Admission queue is full ({self.max_queue} waiting)")
+
+        waiter = _Waiter(tier, self.rank(tier), asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        self._dispatch()
+        if not waiter.future.done():
+            self.tier_stats[tier]["queued"] += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+            except AdmissionRejected:
+                self._record(tier, time.monotonic() - waiter.enqueued, False)
+                raise
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if not waiter.future.done():
+                    self.waiters.remove(waiter)
+                    waiter.future.cancel()
+                elif waiter.future.exception() is None:
+                    self.release()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._record(tier, time.monotonic() - waiter.enqueued, False)
+                raise AdmissionRejected(f"Upstream capacity saturated for {self.max_wait}s")
+        self._record(tier, time.monotonic() - waiter.enqueued, True)
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._dispatch()
+
+
+admission_scheduler = AdmissionScheduler()
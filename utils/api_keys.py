@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+
+from config import API_KEY_HASH_SECRET, NEGATIVE_KEY_CACHE_SIZE, NEGATIVE_KEY_CACHE_TTL, NEGATIVE_KEY_SYNC_INTERVAL
+
+# API keys are never stored. The user store is keyed by an HMAC-SHA256 of the key
+# under API_KEY_HASH_SECRET (the "key id"), and only a short hint is kept for display.
+
+_secret = API_KEY_HASH_SECRET.encode()
+
+# Shared-state topic bumped whenever a key is created, so other workers drop
+# negative entries that may now be valid.
+API_KEYS_TOPIC = "api_keys"
+
+
+def hash_api_key(api_key: str) -> str:
+    return hmac.new(_secret, api_key.encode(), hashlib.sha256).hexdigest()
+
+
+def key_hint(api_key: str) -> str:
+    return f"{api_key[:12]}...{api_key[-4:]}"
+
+
+class NegativeKeyCache:
+    """LRU of key ids recently found not to exist, each remembered for ``ttl`` seconds.
+
+    Entries are key ids rather than raw keys, so a deleted or regenerated key can be
+    added by the process that removed it. Keys minted by another process are picked
+    up by ``sync`` within ``sync_interval``, and at worst after ``ttl``.
+    """
+
+    def __init__(self, maxsize: int = NEGATIVE_KEY_CACHE_SIZE, ttl: float = NEGATIVE_KEY_CACHE_TTL, sync_interval: float = NEGATIVE_KEY_SYNC_INTERVAL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+        self.version = None
+        self.next_sync = 0.0
+
+    def __contains__(self, key_id: str) -> bool:
+        expires = self.entries.get(key_id)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self.entries[key_id]
+            return False
+        self.entries.move_to_end(key_id)
+        self.hits += 1
+        return True
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, key_id: str) -> None:
+        self.entries[key_id] = time.monotonic() + self.ttl
+        self.entries.move_to_end(key_id)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def discard(self, key_id: str) -> None:
+        self.entries.pop(key_id, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def sync(self, read_version) -> None:
+        now = time.monotonic()
+        if now < self.next_sync:
+            return
+        self.next_sync = now + self.sync_interval
+        version = read_version(API_KEYS_TOPIC)
+        if version != self.version:
+            self.version = version
+            self.entries.clear()
+
+
+negative_keys = NegativeKeyCache()
@@ -1,7 +1,34 @@
-import time
+import hmac
 import logging
+from typing import Optional
 from fastapi import HTTPException, Request
+from config import DISCORD_RELAY_SECRET, ADMIN_SECRET
 from key_management import get_user, update_user_plan
+from services.account import Account
+
+def bearer_token(http_request: Request) -> Optional[str]:
+    auth_header = http_request.headers.get("Authorization", "")
+    if not auth_header.startswith("Bearer "):
+        return None
+    return auth_header[len("Bearer "):]
+
+def authenticate_request(http_request: Request, user_service) -> Optional[Account]:
+    token = bearer_token(http_request)
+    if not token:
+        return None
+
+    # The Discord bot only knows key ids, so it relays for a user with the shared
+    # relay secret plus the user's key id instead of the user's API key.
+    relay_key_id = http_request.headers.get("X-Ozone-Key-Id")
+    if relay_key_id and DISCORD_RELAY_SECRET and hmac.compare_digest(token.encode(), DISCORD_RELAY_SECRET.encode()):
+        return user_service.get_user_by_key_id(relay_key_id)
+
+    return user_service.get_user_by_api_key(token)
+
+def is_admin_request(http_request: Request) -> bool:
+    # Admin endpoints are disabled unless ADMIN_SECRET is set.
+    token = bearer_token(http_request)
+    return bool(token and ADMIN_SECRET and hmac.compare_digest(token.encode(), ADMIN_SECRET.encode()))
 
 def validate_user_auth(http_request: Request):
     auth_header = http_request.headers.get("Authorization")
@@ -17,11 +44,11 @@ def validate_user_auth(http_request: Request):
         raise HTTPException(status_code=401, detail="Unauthorized: User not found")
     
 
-    if user['plan'] != 'default' and user['plan_expiration'] and time.time() > user['plan_expiration']:
+    if user.plan_expired():
         update_user_plan(user_id, 'default', None)
         user = get_user(user_id)
 
-    if user['tokens'] < 0:
+    if user.current_tokens < 0:
         raise HTTPException(status_code=429, detail="Not enough quota available for this request.")
 
     return user
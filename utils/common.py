@@ -1,37 +1,79 @@
-import random
+import os
 import string
+import threading
 import time
 
+ID_ALPHABET = string.ascii_lowercase + string.digits
+# Bytes 0..251 map onto the 36 characters evenly (252 = 7 * 36); the rest are dropped.
+_ID_TABLE = bytes(ID_ALPHABET.encode()[i % len(ID_ALPHABET)] for i in range(256))
+_ID_DROP = bytes(range(7 * len(ID_ALPHABET), 256))
+_ID_POOL_BYTES = 4096
+
+
+class _IdPool:
+    """Random id characters drawn from one os.urandom call per ~4000 characters."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def take(self, length):
+        with self.lock:
+            start = self.position
+            if start + length > len(self.buffer):
+                self.buffer = os.urandom(_ID_POOL_BYTES).translate(_ID_TABLE, _ID_DROP).decode()
+                start = 0
+            self.position = start + length
+            return self.buffer[start:start + length]
+
+
+_id_pool = _IdPool()
+
+def new_chatcmpl_id():
+    return f"chatcmpl-{_id_pool.take(29)}"
+
+def new_system_fingerprint():
+    return f"fp_{_id_pool.take(9)}"
+
 async def generate_chatcmpl_id():
-    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=29))
-    return f"chatcmpl-{random_str}"
+    return new_chatcmpl_id()
 
 async def generate_system_fingerprint():
-    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=9))
-    return f"fp_{random_str}"
+    return new_system_fingerprint()
 
-async def format_chunk(content, chatcmpl_id, model, finish_reason, stream=True):
-    if stream:
-        return {
+class ChunkTemplate:
+    """Builds the chunks of one completion from the fields they all share."""
+
+    __slots__ = ("base", "choice_fields")
+
+    def __init__(self, chatcmpl_id, model, system_fingerprint=None, stream=True, choice_fields=None):
+        # Extra keys for every choice, e.g. {"content_filter_results": None}.
+        self.choice_fields = choice_fields or {}
+        self.base = {
             "id": chatcmpl_id,
-            "object": "chat.completion.chunk",
-            "created": int(time.time()),
+            "object": "chat.completion.chunk" if stream else "chat.completion",
+            "created": 0,
             "model": model,
-            "choices": [{
-                "index": 0,
-                "delta": content,
-                "finish_reason": finish_reason
-            }]
         }
-    else:
-        return {
-            "id": chatcmpl_id,
-            "object": "chat.completion",
-            "created": int(time.time()),
-            "model": model,
-            "choices": [{
-                "index": 0,
-                "message": content,
-                "finish_reason": finish_reason
-            }]
-        }
\ No newline at end of file
+        if system_fingerprint is not None:
+            self.base["system_fingerprint"] = system_fingerprint
+
+    def chunk(self, delta, finish_reason=None):
+        chunk = self.base.copy()
+        chunk["created"] = int(time.time())
+        chunk["choices"] = [{"index": 0, "delta": delta, "finish_reason": finish_reason, **self.choice_fields}]
+        return chunk
+
+    def completion(self, message, finish_reason="stop"):
+        chunk = self.base.copy()
+        chunk["created"] = int(time.time())
+        chunk["choices"] = [{"index": 0, "message": message, "finish_reason": finish_reason, **self.choice_fields}]
+        return chunk
+
+def build_chunk(content, chatcmpl_id, model, finish_reason, stream=True):
+    template = ChunkTemplate(chatcmpl_id, model, stream=stream)
+    return template.chunk(content, finish_reason) if stream else template.completion(content, finish_reason)
+
+async def format_chunk(content, chatcmpl_id, model, finish_reason, stream=True):
+    return build_chunk(content, chatcmpl_id, model, finish_reason, stream)
@@ -0,0 +1,67 @@
+import asyncio
+from collections import Counter
+from contextlib import suppress
+from typing import AsyncGenerator, Optional
+
+from fastapi import Request
+
+from config import DISCONNECT_POLL_INTERVAL
+from utils.logger import chat_logger
+
+abandoned_requests = Counter()
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def wait_for_disconnect(http_request: Request, poll_interval: float = DISCONNECT_POLL_INTERVAL):
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(poll_interval)
+
+
+async def cancel_on_disconnect(
+    source: AsyncGenerator,
+    http_request: Optional[Request],
+    kind: str = "stream",
+    poll_interval: float = DISCONNECT_POLL_INTERVAL,
+) -> AsyncGenerator:
+    """Relay items from ``source`` until the client goes away.
+
+    On disconnect the pending ``__anext__`` is cancelled, ``source`` is closed so the
+    provider can tear down its upstream stream, and ``ClientDisconnected`` is raised
+    to the consumer.
+    """
+    if http_request is None:
+        try:
+            async for item in source:
+                yield item
+        finally:
+            await source.aclose()
+        return
+
+    watcher = asyncio.ensure_future(wait_for_disconnect(http_request, poll_interval))
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(source.__anext__())
+            await asyncio.wait({step, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if step.done():
+                try:
+                    item = step.result()
+                except StopAsyncIteration:
+                    return
+                step = None
+                yield item
+                continue
+
+            abandoned_requests[kind] += 1
+            chat_logger.info("Client disconnected, cancelling upstream %s generation", kind)
+            raise ClientDisconnected()
+    finally:
+        watcher.cancel()
+        if step is not None and not step.done():
+            step.cancel()
+            with suppress(asyncio.CancelledError, StopAsyncIteration, Exception):
+                await step
+        await source.aclose()
@@ -1,15 +1,23 @@
-import aiohttp
+import asyncio
 import time
-import sqlite3
 from typing import Dict, Any, Optional
 from services.user_service import UserService
+from config import WEBHOOK_QUEUE_SIZE
+from utils.logger import chat_logger
 
 DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1339042476828393512/ndWtdlUPrIDOe3mpcL_EiZIrofqWJy2JHcCMpWXBkiGWPkEwgHV0VdZ1iv_aNZsjOMZD"
 
-def get_discord_id(api_key: str) -> Optional[str]:
-    user_service = UserService()
-    user = user_service.get_user_by_api_key(api_key=api_key)
-    return "User ID fetching down"
+# Logs are queued and sent by one background task, so a request never waits on
+# the user lookup or the webhook round trip.
+_webhook_queue: Optional[asyncio.Queue] = None
+dropped_webhooks = 0
+
+def get_discord_id(key_id: str) -> Optional[str]:
+    user = UserService().get_user_by_key_id(key_id)
+    return user.discord_id if user else None
+
+def webhook_queue_depth() -> int:
+    return _webhook_queue.qsize() if _webhook_queue is not None else 0
 
 async def log_chat_completion(
     user_id: str,
@@ -19,14 +27,11 @@ async def log_chat_completion(
     model: str,
     is_streaming: bool = False
 ):
-    discord_id = get_discord_id(user_id)
-    user_display = f"<@{discord_id}>" if discord_id else f"`{user_id}`"
-    
     embed = {
         "title": f"Chat Completion Log ({'Streaming' if is_streaming else 'Non-Streaming'})",
         "color": 3447003, 
         "fields": [
-            {"name": "User", "value": user_display, "inline": True},
+            {"name": "User", "value": None, "inline": True},
             {"name": "Model", "value": model, "inline": True},
             {"name": "Execution Time", "value": f"{execution_time:.2f}s", "inline": True},
             {"name": "Input Tokens", "value": str(input_tokens), "inline": True},
@@ -36,7 +41,7 @@ async def log_chat_completion(
         "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S.000Z')
     }
     
-    await _send_webhook({"embeds": [embed]})
+    _enqueue_webhook(user_id, embed)
 
 async def log_image_generation(
     user_id: str,
@@ -44,14 +49,11 @@ async def log_image_generation(
     output_urls: list,
     model: str
 ):
-    discord_id = get_discord_id(user_id)
-    user_display = f"<@{discord_id}>" if discord_id else f"`{user_id}`"
-    
     embed = {
         "title": "Image Generation Log",
         "color": 15105570, 
         "fields": [
-            {"name": "User", "value": user_display, "inline": True},
+            {"name": "User", "value": None, "inline": True},
             {"name": "Model", "value": model, "inline": True},
             {"name": "Prompt", "value": prompt},
             {"name": "Generated Images", "value": "\n".join([f"[Image {i+1}]({url})" for i, url in enumerate(output_urls)])}
@@ -62,10 +64,32 @@ async def log_image_generation(
     if output_urls:
         embed["thumbnail"] = {"url": output_urls[0]}
     
-    await _send_webhook({"embeds": [embed]})
+    _enqueue_webhook(user_id, embed)
+
+def _enqueue_webhook(user_id: str, embed: Dict[str, Any]):
+    global _webhook_queue, dropped_webhooks
+    if _webhook_queue is None:
+        _webhook_queue = asyncio.Queue(WEBHOOK_QUEUE_SIZE)
+        asyncio.get_running_loop().create_task(_webhook_sender(_webhook_queue))
+    try:
+        _webhook_queue.put_nowait((user_id, embed))
+    except asyncio.QueueFull:
+        dropped_webhooks += 1
 
-async def _send_webhook(payload: Dict[str, Any]):
+async def _webhook_sender(queue: asyncio.Queue):
+    # aiohttp costs ~200ms to import and is only needed once a log is sent.
+    import aiohttp
     async with aiohttp.ClientSession() as session:
-        async with session.post(DISCORD_WEBHOOK_URL, json=payload) as response:
-            if response.status not in (200, 204):
-                print(f"Failed to send to Discord webhook: {response.status}") 
\ No newline at end of file
+        while True:
+            user_id, embed = await queue.get()
+            try:
+                discord_id = await asyncio.to_thread(get_discord_id, user_id)
+                embed["fields"][0]["value"] = f"<@{discord_id}>" if discord_id else f"`{user_id[:12]}`"
+                await _send_webhook(session, {"embeds": [embed]})
+            except Exception as e:
+                chat_logger.error("Failed to send Discord log: %s", e)
+
+async def _send_webhook(session, payload: Dict[str, Any]):
+    async with session.post(DISCORD_WEBHOOK_URL, json=payload) as response:
+        if response.status not in (200, 204):
+            chat_logger.error("Failed to send to Discord webhook: %s", response.status) 
\ No newline at end of file
@@ -0,0 +1,131 @@
+import asyncio
+import weakref
+import ujson
+from contextlib import aclosing, suppress
+from typing import AsyncGenerator
+
+
+# Keyed by provider instance: each provider generation gets its own limit, read
+# from the class it was loaded with, and drops it once it is retired.
+_provider_slots: "weakref.WeakKeyDictionary[object, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+_DONE = object()
+
+
+def provider_slot(provider) -> asyncio.Semaphore:
+    slot = _provider_slots.get(provider)
+    if slot is None:
+        slot = _provider_slots[provider] = asyncio.Semaphore(provider.max_concurrency)
+    return slot
+
+
+async def with_provider_slot(provider, source: AsyncGenerator) -> AsyncGenerator:
+    """Iterate ``source`` while holding one of ``provider``'s ``max_concurrency`` slots."""
+    async with provider_slot(provider):
+        async with aclosing(source) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+
+def single_choice_request(request):
+    return request.model_copy(update={"n": 1})
+
+
+def merge_choices(responses: list) -> dict:
+    merged = dict(responses[0])
+    merged["choices"] = []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    has_usage = False
+
+    for index, response in enumerate(responses):
+        choice = dict(response["choices"][0])
+        choice["index"] = index
+        merged["choices"].append(choice)
+        if response.get("usage"):
+            has_usage = True
+            for key in usage:
+                usage[key] += response["usage"].get(key, 0) or 0
+
+    if has_usage:
+        merged["usage"] = usage
+    return merged
+
+
+class _ChoiceFailed(Exception):
+    def __init__(self, response: dict):
+        self.response = response
+
+
+async def fan_out_completions(completion_method, provider, request, n: int) -> AsyncGenerator[dict, None]:
+    async def generate(index: int):
+        async with provider_slot(provider):
+            response = None
+            async for chunk in completion_method(single_choice_request(request)):
+                if isinstance(chunk, dict):
+                    if "error" in chunk:
+                        raise _ChoiceFailed(chunk)
+                    response = chunk
+            return response
+
+    tasks = [asyncio.ensure_future(generate(index)) for index in range(n)]
+    try:
+        responses = await asyncio.gather(*tasks)
+    except _ChoiceFailed as e:
+        responses = [e.response]
+    finally:
+        # One failed choice fails the request; stop the others from holding slots and spending quota.
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError, Exception):
+                await task
+
+    for response in responses:
+        if response is None:
+            return
+        if "error" in response:
+            yield response
+            return
+
+    yield merge_choices(responses)
+
+
+async def fan_out_stream(provider, request, n: int) -> AsyncGenerator[dict, None]:
+    queue = asyncio.Queue()
+
+    async def generate(index: int):
+        try:
+            async with provider_slot(provider):
+                stream = provider.create_chat_completions(single_choice_request(request))
+                try:
+                    async for chunk in stream:
+                        if not isinstance(chunk, dict):
+                            try:
+                                chunk = ujson.loads(chunk)
+                            except Exception:
+                                continue
+                        if chunk.get("choices"):
+                            chunk["choices"][0]["index"] = index
+                        await queue.put(chunk)
+                finally:
+                    await stream.aclose()
+        except Exception as e:
+            await queue.put({"error": str(e)})
+        finally:
+            await queue.put(_DONE)
+
+    tasks = [asyncio.ensure_future(generate(index)) for index in range(n)]
+    remaining = n
+    try:
+        while remaining:
+            chunk = await queue.get()
+            if chunk is _DONE:
+                remaining -= 1
+                continue
+            yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
@@ -1,34 +1,148 @@
+import atexit
+import contextvars
+import json
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import zlib
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
 
-def setup_logger(name, log_file='api.log', level=logging.INFO):
+from config import LOG_FORMAT, LOG_SAMPLING
+
+# Request id of the request being handled, attached to every record logged while
+# it is set (see RequestContextFilter).
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+class LazyRotatingFileHandler(RotatingFileHandler):
+	# Neither the logs directory nor the file is touched until the first record,
+	# so importing a module that defines a logger has no filesystem side effects.
+	def __init__(self, filename, **kwargs):
+		super().__init__(filename, delay=True, **kwargs)
+
+	def _open(self):
+		os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+		return super()._open()
+
+class DeferredQueueHandler(QueueHandler):
+	# The stock prepare() formats the message on the calling thread. Records stay
+	# in this process, so they are queued as-is and the listener thread does all
+	# %-formatting and I/O.
+	def prepare(self, record):
+		return record
+
+class RequestContextFilter(logging.Filter):
+	def filter(self, record):
+		record.request_id = request_id_var.get()
+		return True
+
+class SamplingFilter(logging.Filter):
+	"""Keeps ``rate`` of INFO-and-below records; warnings and errors always pass.
+
+	Records logged under a request id are kept or dropped per request, so a sampled
+	request keeps all of its lines.
+	"""
+	def __init__(self, rate):
+		super().__init__()
+		self.rate = rate
+		self.threshold = int(rate * 10000)
+		self.credit = 0.0
+
+	def filter(self, record):
+		if record.levelno > logging.INFO:
+			return True
+		request_id = getattr(record, "request_id", None)
+		if request_id is not None:
+			return zlib.crc32(request_id.encode()) % 10000 < self.threshold
+		self.credit += self.rate
+		if self.credit >= 1:
+			self.credit -= 1
+			return True
+		return False
+
+class JsonFormatter(logging.Formatter):
+	def format(self, record):
+		entry = {
+			"ts": self.formatTime(record),
+			"level": record.levelname,
+			"logger": record.name,
+			"message": record.getMessage(),
+		}
+		request_id = getattr(record, "request_id", None)
+		if request_id is not None:
+			entry["request_id"] = request_id
+		if record.exc_info:
+			entry["exc_info"] = self.formatException(record.exc_info)
+		return json.dumps(entry)
+
+def make_formatter(log_format=LOG_FORMAT):
+	if log_format == "json":
+		return JsonFormatter()
+	return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+_log_queue = queue.SimpleQueue()
+_listener = None
+_handlers = []
+_file_only = set()
+
+class ConsoleFilter(logging.Filter):
+	def filter(self, record):
+		return record.name not in _file_only
+
+def _restart_listener():
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+	_listener = QueueListener(_log_queue, *_handlers, respect_handler_level=True)
+	_listener.start()
+
+def stop_logging():
+	"""Flush queued records and stop the listener thread."""
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+		_listener = None
+
+atexit.register(stop_logging)
+
+def setup_logger(name, log_file='api.log', level=logging.INFO, log_format=LOG_FORMAT, sample_rate=None, console=True):
 	logger = logging.getLogger(name)
 	logger.setLevel(level)
-	
-	formatter = logging.Formatter(
-		'%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-	)
-	
-	console_handler = logging.StreamHandler(sys.stdout)
-	console_handler.setFormatter(formatter)
-	logger.addHandler(console_handler)
-	
-	if not os.path.exists('logs'):
-		os.makedirs('logs')
-	file_handler = RotatingFileHandler(
+	# The root logger's handlers are synchronous; everything goes through the queue.
+	logger.propagate = False
+
+	formatter = make_formatter(log_format)
+
+	if not _handlers:
+		console_handler = logging.StreamHandler(sys.stdout)
+		console_handler.setFormatter(formatter)
+		console_handler.addFilter(ConsoleFilter())
+		_handlers.append(console_handler)
+	if not console:
+		_file_only.add(name)
+
+	file_handler = LazyRotatingFileHandler(
 		f'logs/{log_file}',
 		maxBytes=10*1024*1024,
 		backupCount=5
 	)
 	file_handler.setFormatter(formatter)
-	logger.addHandler(file_handler)
-	
+	file_handler.addFilter(logging.Filter(name))
+	_handlers.append(file_handler)
+	_restart_listener()
+
+	queue_handler = DeferredQueueHandler(_log_queue)
+	queue_handler.addFilter(RequestContextFilter())
+	if sample_rate is None:
+		sample_rate = LOG_SAMPLING.get(name, 1.0)
+	if sample_rate < 1.0:
+		queue_handler.addFilter(SamplingFilter(sample_rate))
+	logger.addHandler(queue_handler)
+
 	return logger
 
 chat_logger = setup_logger('chat_service', 'chat.log')
 user_logger = setup_logger('user_service', 'user.log')
 provider_logger = setup_logger('provider_service', 'provider.log')
 
-__all__ = ['chat_logger', 'user_logger', 'provider_logger', 'setup_logger']
\ No newline at end of file
+__all__ = ['chat_logger', 'user_logger', 'provider_logger', 'setup_logger', 'request_id_var', 'stop_logging']
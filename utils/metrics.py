@@ -0,0 +1,221 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# In-process metrics rendered in the Prometheus text format at /metrics. Every
+# series is a plain list or float keyed by its label values, so recording is a
+# dict lookup plus an add; nothing is formatted until /metrics is scraped.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per series: one slot per bucket plus +Inf, then sum and count.
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> Iterable[str]:
+        bounds = self.buckets + (float("inf"),)
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {_number(series[-1])}"
+
+
+class Gauge:
+    """Read at scrape time from ``read``, which returns ``{label values: value}``.
+
+    ``kind="counter"`` exposes a monotonic value kept elsewhere (e.g. a
+    ``collections.Counter``) without copying it into this registry.
+    """
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], Dict[Tuple[str, ...], float]], labelnames: Sequence[str] = (), kind: str = "gauge"):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.read = read
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.read().items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, read, labelnames: Sequence[str] = (), kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, documentation, read, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "ozone_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+http_errors = registry.counter(
+    "ozone_http_errors_total", "Unhandled errors and error responses by route and class.", ("route", "error_class"))
+completion_duration = registry.histogram(
+    "ozone_completion_duration_seconds", "Upstream completion time by model and provider.", ("model", "provider", "stream"))
+time_to_first_token = registry.histogram(
+    "ozone_time_to_first_token_seconds", "Time from request start to the first streamed content.", ("model", "provider"))
+output_chars_per_second = registry.histogram(
+    "ozone_output_chars_per_second", "Output throughput of completed generations, in billed characters per second.",
+    ("model", "provider"), RATE_BUCKETS)
+db_duration = registry.histogram(
+    "ozone_db_operation_duration_seconds", "User store latency by operation.", ("operation",), FAST_BUCKETS)
+
+
+def provider_label(provider) -> str:
+    return type(provider).__name__.lower() if provider is not None else "none"
+
+
+def route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request by its route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            http_errors.inc(route_label(scope), type(e).__name__)
+            raise
+        finally:
+            route = route_label(scope)
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route, str(status))
+            if status >= 500:
+                http_errors.inc(route, f"http_{status}")
+
+
+_runtime_gauges_registered = False
+
+
+def register_runtime_gauges(read_webhook_queue: Optional[Callable[[], int]] = None) -> None:
+    global _runtime_gauges_registered
+    if _runtime_gauges_registered:
+        return
+    _runtime_gauges_registered = True
+
+    from utils.admission import admission_scheduler
+    from utils.disconnect_utils import abandoned_requests
+    from utils.stream_buffer import buffer_stats
+
+    registry.gauge("ozone_stream_buffer", "Stream buffer state (bytes, streams, pauses, aborts).",
+                   lambda: {(key,): value for key, value in buffer_stats().items()}, ("stat",))
+    registry.gauge("ozone_abandoned_requests_total", "Requests whose client disconnected before completion.",
+                   lambda: {(kind,): count for kind, count in abandoned_requests.items()}, ("kind",), "counter")
+    registry.gauge("ozone_admission_in_use", "Upstream slots in use.", lambda: {(): admission_scheduler.in_use})
+    registry.gauge("ozone_admission_waiting", "Requests waiting for an upstream slot.", lambda: {(): len(admission_scheduler.waiters)})
+
+    def tier_stat(name):
+        return lambda: {(tier,): stats[name] for tier, stats in admission_scheduler.tier_stats.items()}
+
+    registry.gauge("ozone_admission_admitted_total", "Requests admitted upstream by plan tier.", tier_stat("admitted"), ("tier",), "counter")
+    registry.gauge("ozone_admission_shed_total", "Requests shed by the admission scheduler by plan tier.", tier_stat("shed"), ("tier",), "counter")
+    registry.gauge("ozone_admission_queued_total", "Requests that had to wait for an upstream slot by plan tier.", tier_stat("queued"), ("tier",), "counter")
+    registry.gauge("ozone_admission_queue_wait_seconds_total", "Time admitted requests spent waiting for a slot by plan tier.",
+                   tier_stat("queue_wait_total"), ("tier",), "counter")
+    registry.gauge("ozone_admission_queue_wait_max_seconds", "Longest wait for a slot by plan tier.", tier_stat("queue_wait_max"), ("tier",))
+    if read_webhook_queue is not None:
+        registry.gauge("ozone_webhook_queue_depth", "Discord log webhooks waiting to be sent.", lambda: {(): read_webhook_queue()})
@@ -0,0 +1,123 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import PROFILE_THRESHOLD, PROFILE_INTERVAL, PROFILE_DIRECTORY
+from utils.logger import chat_logger
+
+# Opt-in profiler for slow requests. cProfile cannot be scoped to one request on
+# an event loop (every task shares the thread), so while enabled a background
+# thread samples the loop thread's stack every ``interval`` seconds into a ring
+# buffer. When a request ends slower than ``threshold``, the samples taken during
+# it are written as folded stacks (flamegraph.pl / speedscope input) to
+# PROFILE_DIRECTORY/<request_id>.folded. Other requests running concurrently show
+# up in the same window; the trace log says what else was in flight.
+
+MAX_SAMPLES = 60000
+MAX_PROFILES = 200
+
+
+def fold_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL, max_samples: int = MAX_SAMPLES):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.deque(maxlen=max_samples)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples.append((time.perf_counter(), fold_stack(frame)))
+
+    def window(self, started: float, ended: float) -> Dict[str, int]:
+        counts = collections.Counter()
+        for taken, stack in list(self.samples):
+            if started <= taken <= ended:
+                counts[stack] += 1
+        return counts
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold: float = PROFILE_THRESHOLD, directory: str = PROFILE_DIRECTORY):
+        self.threshold = threshold
+        self.directory = directory
+        self.sampler: Optional[StackSampler] = None
+        self.captured: List[dict] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.sampler is not None
+
+    def enable(self, threshold: Optional[float] = None, interval: float = PROFILE_INTERVAL) -> None:
+        """Start sampling the calling thread, which must be the event loop thread."""
+        if threshold is not None:
+            self.threshold = threshold
+        if self.sampler is None:
+            self.sampler = StackSampler(threading.get_ident(), interval)
+            self.sampler.start()
+            chat_logger.info("Slow request profiling enabled (threshold %.3fs)", self.threshold)
+
+    def disable(self) -> None:
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+            chat_logger.info("Slow request profiling disabled")
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "interval": self.sampler.interval if self.sampler else None,
+            "captured": self.captured[-20:],
+        }
+
+    async def capture(self, trace) -> None:
+        duration = trace.elapsed()
+        if self.sampler is None or duration < self.threshold:
+            return
+        counts = self.sampler.window(trace.started, trace.started + duration)
+        if not counts:
+            return
+        name = trace.request_id or f"{trace.path.strip('/').replace('/', '_')}-{int(trace.wall_started * 1000)}"
+        path = os.path.join(self.directory, f"{name}.folded")
+        await asyncio.to_thread(self._write, path, counts)
+        self.captured.append({"request_id": trace.request_id, "path": trace.path, "duration": round(duration, 3), "file": path})
+        del self.captured[:-MAX_PROFILES]
+        chat_logger.warning("Request %s: %.3fs over the %.3fs profiling threshold, profile written to %s",
+                            trace.request_id, duration, self.threshold, path)
+
+    @staticmethod
+    def _write(path: str, counts: Dict[str, int]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+
+slow_request_profiler = SlowRequestProfiler()
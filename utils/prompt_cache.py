@@ -0,0 +1,129 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, List, Optional, TypeVar
+
+import ujson
+
+from config import PROMPT_CACHE_CHARS, PROMPT_CACHE_SIZE, PROMPT_CACHE_TTL
+
+# Chat clients resend the whole conversation every turn, so consecutive requests
+# share every message but the newest ones. Messages are hashed as a chain
+# (digest i covers messages[:i + 1]), which names each prefix of a conversation
+# in one pass; providers memoize work per prefix digest and only redo the tail.
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """LRU of values, each kept for ``ttl`` seconds after it was stored.
+
+    With ``weigh``, the cache also evicts until the summed weight of its values
+    is at most ``maxweight``.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, maxweight: Optional[int] = None, weigh: Optional[Callable[[V], int]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.entries: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def _weight(self, value: V) -> int:
+        return self.weigh(value) if self.weigh else 0
+
+    def get(self, key) -> Optional[V]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value: V) -> None:
+        self.pop(key)
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.weight += self._weight(value)
+        while self.entries and (len(self.entries) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight)):
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.weight -= self._weight(evicted)
+
+    def pop(self, key) -> Optional[V]:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.weight -= self._weight(entry[1])
+        return entry[1]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.weight = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def chain_digests(messages: List[Dict[str, Any]], start: bytes = b"") -> List[bytes]:
+    """Digest of every prefix of ``messages``: ``result[i]`` covers ``messages[:i + 1]``.
+
+    Each digest is a BLAKE2b hash of the previous digest and one message, so it is
+    stable across processes and restarts and safe to use as a shared cache key.
+    """
+    digests = []
+    previous = start
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = ujson.dumps(content, sort_keys=True)
+        digest = hashlib.blake2b(previous, digest_size=16)
+        digest.update(f"{message.get('role')}\0".encode())
+        digest.update(content.encode())
+        previous = digest.digest()
+        digests.append(previous)
+    return digests
+
+
+class BuiltPrompt:
+    __slots__ = ("text", "digests", "reused")
+
+    def __init__(self, text: str, digests: List[bytes], reused: int):
+        self.text = text
+        # Prefix digests of the messages the prompt was built from.
+        self.digests = digests
+        # How many leading messages came from the cache rather than being rendered.
+        self.reused = reused
+
+
+class PromptBuilder:
+    """Renders a message list into one prompt string, memoized by conversation prefix.
+
+    ``render`` turns one message into its part of the prompt. The rendered text of
+    each built conversation is cached under its prefix digest, so the next turn of
+    the same conversation only renders the messages added since. Prompts grow with
+    the conversation, so the cache is bounded by ``maxchars`` of cached text as
+    well as by entry count.
+    """
+
+    def __init__(self, render: Callable[[Dict[str, Any]], str], maxsize: int = PROMPT_CACHE_SIZE, ttl: float = PROMPT_CACHE_TTL,
+                 maxchars: int = PROMPT_CACHE_CHARS):
+        self.render = render
+        self.cache: TTLCache[str] = TTLCache(maxsize, ttl, maxweight=maxchars, weigh=len)
+
+    def build(self, messages: List[Dict[str, Any]], digests: Optional[List[bytes]] = None) -> BuiltPrompt:
+        if digests is None:
+            digests = chain_digests(messages)
+        reused = 0
+        prefix = ""
+        for index in range(len(digests) - 1, -1, -1):
+            cached = self.cache.get(digests[index])
+            if cached is not None:
+                prefix, reused = cached, index + 1
+                break
+        text = prefix + "".join(self.render(message) for message in messages[reused:])
+        if digests and reused < len(digests):
+            self.cache.set(digests[-1], text)
+        return BuiltPrompt(text, digests, reused)
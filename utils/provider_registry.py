@@ -0,0 +1,186 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from config import PROVIDER_DRAIN_TIMEOUT, PROVIDER_RELOAD_INTERVAL, PROVIDER_WATCH
+from services.shared_state import get_shared_state
+from utils.logger import provider_logger
+from utils.provider_utils import provider_mtimes, start_providers, stop_providers
+from utils.providers.base import BaseProvider
+
+# Providers are loaded in generations. A request leases the generation that is
+# current when it arrives and keeps using its provider instances until it (or
+# its stream) ends. A reload imports the changed provider modules, starts a new
+# generation and switches new requests to it in one step; the old generation is
+# shut down once its last lease is released, or after PROVIDER_DRAIN_TIMEOUT.
+#
+# Reloads are triggered by POST /admin/providers/reload, which bumps a shared
+# topic so every worker process follows, and, with PROVIDER_WATCH, by changes to
+# the provider files themselves.
+
+PROVIDERS_TOPIC = "providers"
+
+
+class ProviderGeneration:
+    def __init__(self, number: int, providers: Dict[str, BaseProvider]):
+        self.number = number
+        self.providers = providers
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.stopped = False
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def acquire(self) -> None:
+        self.in_flight += 1
+        self.idle.clear()
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self.idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait until no request holds this generation; False if ``timeout`` passed first."""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self) -> None:
+        if not self.stopped:
+            self.stopped = True
+            await stop_providers(self.providers)
+
+    def status(self) -> dict:
+        return {"generation": self.number, "providers": sorted(self.providers), "in_flight": self.in_flight, "loaded_at": int(self.loaded_at)}
+
+
+class ProviderRegistry:
+    """The current provider generation, plus the retired ones still draining.
+
+    ``providers`` is the dict the routes were built with; it always holds the
+    current generation's providers. ``load`` returns fresh provider instances and
+    runs in a thread; ``watch_directory`` is the directory whose files trigger a
+    reload when PROVIDER_WATCH is on.
+    """
+
+    def __init__(self, providers: Dict[str, BaseProvider], load: Callable[[], Dict[str, BaseProvider]], watch_directory: Optional[str] = None):
+        self.providers = providers
+        self.load = load
+        self.watch_directory = watch_directory
+        self.current = ProviderGeneration(0, {})
+        self.retiring: List[ProviderGeneration] = []
+        self.lock = asyncio.Lock()
+        self.drains = set()
+        self.version = 0
+        self.mtimes = None
+        self.watcher: Optional[asyncio.Task] = None
+
+    def acquire(self) -> ProviderGeneration:
+        """Lease the current generation; the caller must ``release()`` it exactly once."""
+        generation = self.current
+        generation.acquire()
+        return generation
+
+    @contextmanager
+    def lease(self):
+        generation = self.acquire()
+        try:
+            yield generation
+        finally:
+            generation.release()
+
+    async def install(self, providers: Dict[str, BaseProvider]) -> Dict[str, str]:
+        """Start ``providers`` and make them the current generation."""
+        sessions = await start_providers(providers)
+        previous = self.current
+        # No await between these lines: a request sees either generation, never a mix.
+        self.current = ProviderGeneration(previous.number + 1, providers)
+        self.providers.clear()
+        self.providers.update(providers)
+        if previous.providers:
+            self._retire(previous)
+        return sessions
+
+    async def reload(self, announce: bool = False) -> dict:
+        """Load a new generation from the provider modules and switch to it.
+
+        With ``announce`` the reload is published so other workers follow. If a
+        changed module fails to import, ProviderLoadError propagates and the
+        current generation keeps serving.
+        """
+        async with self.lock:
+            if announce:
+                self.version = await asyncio.to_thread(get_shared_state().bump, PROVIDERS_TOPIC)
+            if self.watch_directory:
+                self.mtimes = provider_mtimes(self.watch_directory)
+            started = time.perf_counter()
+            providers = await asyncio.to_thread(self.load)
+            previous = self.current
+            sessions = await self.install(providers)
+        provider_logger.info("Loaded provider generation %s (%s) in %.2fs; generation %s draining %s requests",
+                             self.current.number, ", ".join(sorted(providers)), time.perf_counter() - started, previous.number, previous.in_flight)
+        return {**self.current.status(), "provider_sessions": sessions, "draining": previous.status()}
+
+    def _retire(self, generation: ProviderGeneration) -> None:
+        self.retiring.append(generation)
+        task = asyncio.ensure_future(self._drain_and_stop(generation))
+        self.drains.add(task)
+        task.add_done_callback(self.drains.discard)
+
+    async def _drain_and_stop(self, generation: ProviderGeneration) -> None:
+        if not await generation.drain(PROVIDER_DRAIN_TIMEOUT):
+            provider_logger.warning("Provider generation %s still had %s requests in flight after %ss; shutting it down",
+                                    generation.number, generation.in_flight, PROVIDER_DRAIN_TIMEOUT)
+        await generation.stop()
+        self.retiring.remove(generation)
+        provider_logger.info("Provider generation %s retired", generation.number)
+
+    async def shutdown(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` for every generation's requests, then stop them all.
+
+        Returns False if requests were still in flight when the providers were stopped.
+        """
+        self.stop_watching()
+        generations = [self.current, *self.retiring]
+        drained = await asyncio.gather(*(generation.drain(timeout) for generation in generations))
+        for task in list(self.drains):
+            task.cancel()
+        await asyncio.gather(*self.drains, return_exceptions=True)
+        for generation in generations:
+            await generation.stop()
+        return all(drained)
+
+    def status(self) -> dict:
+        return {**self.current.status(), "retiring": [generation.status() for generation in self.retiring]}
+
+    async def watch(self, interval: float = PROVIDER_RELOAD_INTERVAL) -> None:
+        shared_state = get_shared_state()
+        self.version = await asyncio.to_thread(shared_state.version, PROVIDERS_TOPIC)
+        if self.watch_directory and self.mtimes is None:
+            self.mtimes = provider_mtimes(self.watch_directory)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                version = await asyncio.to_thread(shared_state.version, PROVIDERS_TOPIC)
+                changed = version != self.version
+                if PROVIDER_WATCH and self.watch_directory:
+                    changed = changed or provider_mtimes(self.watch_directory) != self.mtimes
+                if changed:
+                    self.version = version
+                    await self.reload()
+            except Exception as e:
+                # reload() took its snapshot first, so a broken file is retried once it changes again.
+                provider_logger.error("Provider reload failed: %s", e, exc_info=True)
+
+    def start_watching(self) -> asyncio.Task:
+        if self.watcher is None or self.watcher.done():
+            self.watcher = asyncio.ensure_future(self.watch())
+        return self.watcher
+
+    def stop_watching(self) -> None:
+        if self.watcher is not None:
+            self.watcher.cancel()
@@ -1,36 +1,84 @@
 
-import importlib
+import asyncio
+import importlib.util
 import inspect
+import itertools
 import os
 import sys
-import os
-import importlib
-from typing import Dict, Any
-import sys
+from types import ModuleType
+from typing import Dict, Any, Tuple
 
 import httpx
 
 from utils.providers.base import BaseProvider
+from utils.logger import provider_logger
+
+PROVIDER_STARTUP_TIMEOUT = 30
+
+# Every provider module as of its last successful import, with the file's
+# modification time then. A changed file is executed into a new module object
+# under a numbered name, so the module a running generation uses is never
+# re-executed underneath it; unchanged modules are shared between generations.
+_loaded_modules: Dict[str, Tuple[float, ModuleType]] = {}
+_module_versions = itertools.count(1)
+
+
+class ProviderLoadError(Exception):
+    pass
+
+
+def provider_mtimes(provider_directory: str) -> Dict[str, float]:
+    mtimes = {}
+    for filename in os.listdir(provider_directory):
+        if filename.endswith(".py") and filename != "__init__.py":
+            mtimes[filename[:-3]] = os.path.getmtime(os.path.join(provider_directory, filename))
+    return mtimes
+
+def _load_module(module_name: str, path: str) -> ModuleType:
+    qualified_name = f"providers.{module_name}_v{next(_module_versions)}"
+    spec = importlib.util.spec_from_file_location(qualified_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[qualified_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[qualified_name]
+        raise
+    return module
 
 def discover_providers(provider_directory: str) -> Dict[str, Any]:
+    """Provider classes by id from every module in ``provider_directory``.
 
+    Modules whose file changed since they were last loaded are loaded afresh. A
+    new module that fails to import is skipped, as at startup; a changed module
+    that fails raises ProviderLoadError so a broken deploy cannot drop a working
+    provider.
+    """
     provider_path = os.path.abspath(provider_directory)
     if provider_path not in sys.path:
         sys.path.insert(0, provider_path)
         
     providers = {}
 
-    for filename in os.listdir(provider_directory):
-        if filename.endswith(".py") and filename != "__init__.py":
-            module_name = filename[:-3]
-            try:
-                module = importlib.import_module(f"providers.{module_name}")
-                for name, obj in inspect.getmembers(module):
-                    if inspect.isclass(obj) and issubclass(obj, BaseProvider) and obj != BaseProvider:
-                        provider_name = name.lower().replace(" ", "_").replace("-", "_")
-                        providers[provider_name] = obj
-            except Exception as e:
-                print(f"Error loading provider from {filename}: {e}")
+    for module_name, mtime in provider_mtimes(provider_directory).items():
+        loaded = _loaded_modules.get(module_name)
+        try:
+            if loaded is not None and loaded[0] == mtime:
+                module = loaded[1]
+            else:
+                module = _load_module(module_name, os.path.join(provider_path, f"{module_name}.py"))
+                if loaded is not None:
+                    # Generations still serving keep their reference to the old module.
+                    sys.modules.pop(loaded[1].__name__, None)
+                _loaded_modules[module_name] = (mtime, module)
+            for name, obj in inspect.getmembers(module):
+                if inspect.isclass(obj) and issubclass(obj, BaseProvider) and obj != BaseProvider:
+                    provider_name = name.lower().replace(" ", "_").replace("-", "_")
+                    providers[provider_name] = obj
+        except Exception as e:
+            if loaded is not None:
+                raise ProviderLoadError(f"Error reloading provider from {module_name}.py: {e}") from e
+            print(f"Error loading provider from {module_name}.py: {e}")
     return providers
 
 def initialize_providers(async_client: httpx.AsyncClient, provider_directory: str) -> Dict[str, BaseProvider]:
@@ -44,3 +92,37 @@ def initialize_providers(async_client: httpx.AsyncClient, provider_directory: st
             print(f"Error initializing provider {name}: {e}")
             print(f"Error initializing provider {name}: {e}")
     return initialized_providers
+
+async def check_providers(providers: Dict[str, BaseProvider], timeout: float = 10) -> Dict[str, str]:
+    """Run every provider's health_check and record the outcome on ``provider.healthy``."""
+    async def check(provider):
+        try:
+            healthy = bool(await asyncio.wait_for(provider.health_check(), timeout))
+            error = None
+        except Exception as e:
+            healthy, error = False, str(e)
+        provider.healthy = healthy
+        return "ok" if healthy else f"failed: {error or 'unhealthy'}"
+
+    results = await asyncio.gather(*(check(provider) for provider in providers.values()))
+    return dict(zip(providers, results))
+
+async def start_providers(providers: Dict[str, BaseProvider]) -> Dict[str, str]:
+    async def start(name, provider):
+        try:
+            await asyncio.wait_for(provider.startup(), PROVIDER_STARTUP_TIMEOUT)
+            return "ok"
+        except Exception as e:
+            # A provider that cannot warm up still serves by connecting lazily.
+            provider_logger.error("Provider %s failed to start: %s", name, e)
+            return f"failed: {str(e)}"
+
+    results = await asyncio.gather(*(start(name, provider) for name, provider in providers.items()))
+    return dict(zip(providers, results))
+
+async def stop_providers(providers: Dict[str, BaseProvider]) -> None:
+    for name, provider in providers.items():
+        try:
+            await provider.shutdown()
+        except Exception as e:
+            provider_logger.error("Provider %s failed to shut down: %s", name, e)
@@ -1,6 +1,15 @@
-from typing import List, Dict, Optional, Union
+from contextlib import aclosing
+from dataclasses import dataclass
+from enum import Enum
+from typing import AsyncIterator, FrozenSet, List, Dict, Optional, Union
+
+import httpx
 from pydantic import BaseModel
 
+from config import PROVIDER_MAX_CONCURRENCY
+from utils.common import ChunkTemplate, new_chatcmpl_id, new_system_fingerprint
+from utils.logger import provider_logger
+
 class RequestBody(BaseModel):
     model: str
     messages: Optional[List[Dict]] = None
@@ -17,14 +26,148 @@ class Message(BaseModel):
     role: str
     content: str
 
+class Capability(str, Enum):
+    CHAT = "chat"
+    TRANSLATION = "translation"
+    TTS = "tts"
+    TRANSCRIPTION = "transcription"
+    IMAGE = "image"
+    MODERATION = "moderation"
+
+# Methods that imply a capability for providers that do not declare ``capabilities``.
+CAPABILITY_METHODS = {
+    Capability.CHAT: ("create_chat_completions", "stream_chat"),
+    Capability.TRANSLATION: ("create_translation",),
+    Capability.TTS: ("create_tts_completions",),
+    Capability.TRANSCRIPTION: ("create_transcription",),
+    Capability.IMAGE: ("create_image",),
+    Capability.MODERATION: ("create_moderation",),
+}
+
+@dataclass(slots=True)
+class ChatDelta:
+    """One increment of a streamed chat completion, as yielded by ``stream_chat``."""
+    content: str = ""
+    role: Optional[str] = None
+    function_call: Optional[Dict] = None
+    finish_reason: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        delta = {}
+        if self.role is not None:
+            delta["role"] = self.role
+        if self.content or self.role is not None:
+            delta["content"] = self.content
+        if self.function_call is not None:
+            delta["function_call"] = self.function_call
+        return delta
+
 class BaseProvider:
-    def __init__(self, name: str):
-        self.name = name
-        self.models = []
-        self.costs = {}
+    """Interface every module in ``providers/`` implements.
 
-    def create_chat_completions(self, body: RequestBody):
-        raise NotImplementedError
+    Subclasses declare what they serve as class attributes: ``costs`` (model id to
+    credit multiplier; ``models`` defaults to its keys), ``capabilities`` (inferred
+    from the ``create_*`` methods a subclass defines when not declared),
+    ``max_concurrency`` for upstream calls in flight, and ``pool_limits`` to get a
+    dedicated HTTP client instead of the shared one.
+
+    Chat providers implement ``stream_chat``, yielding ``ChatDelta``s; the base
+    ``create_chat_completions`` turns those into OpenAI chunks or a completion and
+    reports upstream failures as error chunks. Providers that already produce
+    OpenAI chunks may override ``create_chat_completions`` instead.
+    """
+    name: str = ""
+    models: List[str] = []
+    costs: Dict[str, float] = {}
+    capabilities: FrozenSet[Capability] = frozenset()
+    max_concurrency: int = PROVIDER_MAX_CONCURRENCY
+    pool_limits: Optional[httpx.Limits] = None
+    request_timeout: float = 150
+    # Extra keys on every choice of the chunks the base class builds.
+    choice_fields: Dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "capabilities" not in cls.__dict__:
+            cls.capabilities = frozenset(
+                capability for capability, methods in CAPABILITY_METHODS.items()
+                if any(getattr(cls, method, None) is not getattr(BaseProvider, method, None) for method in methods)
+            )
 
-    def create_tts_completions(self, body: RequestBody):
+    def __init__(self, async_client: Optional[httpx.AsyncClient] = None, name: Optional[str] = None):
+        self.name = name or self.name or type(self).__name__.lower()
+        self.owns_client = self.pool_limits is not None
+        if self.owns_client:
+            async_client = httpx.AsyncClient(limits=self.pool_limits, timeout=self.request_timeout)
+        self.async_client = async_client
+        self.costs = dict(self.costs)
+        self.models = list(self.models) or list(self.costs)
+        # Set by health checks; select_provider skips unhealthy providers.
+        self.healthy = True
+
+    def supports(self, capability: Capability) -> bool:
+        return capability in self.capabilities
+
+    def chat_method(self):
+        """The method that serves /v1/chat/completions, or None."""
+        if Capability.CHAT in self.capabilities:
+            return self.create_chat_completions
+        if Capability.TRANSLATION in self.capabilities:
+            return self.create_translation
+        return None
+
+    async def startup(self) -> None:
+        """Open sessions and warm caches before the first request."""
+
+    async def shutdown(self) -> None:
+        if self.owns_client and self.async_client is not None:
+            await self.async_client.aclose()
+
+    async def health_check(self) -> bool:
+        """Cheap upstream check for /healthz/providers; must not bill or create chats."""
+        return True
+
+    def error_message(self, error: Exception) -> str:
+        return str(error)
+
+    async def stream_chat(self, body: RequestBody) -> AsyncIterator[ChatDelta]:
         raise NotImplementedError
+        yield
+
+    async def create_chat_completions(self, body: RequestBody) -> AsyncIterator[Dict]:
+        chatcmpl_id = new_chatcmpl_id()
+        system_fingerprint = new_system_fingerprint()
+        if body.model not in self.models:
+            yield {
+                "error": f"The model: {body.model} is not available",
+                "model": body.model,
+                "id": chatcmpl_id,
+                "system_fingerprint": system_fingerprint,
+            }
+            return
+
+        template = ChunkTemplate(chatcmpl_id, body.model, system_fingerprint, stream=body.stream, choice_fields=self.choice_fields)
+        finish_reason = "stop"
+        content = []
+        try:
+            async with aclosing(self.stream_chat(body)) as deltas:
+                async for delta in deltas:
+                    if delta.finish_reason:
+                        finish_reason = delta.finish_reason
+                    if body.stream:
+                        if delta.content or delta.role is not None or delta.function_call is not None:
+                            yield template.chunk(delta.to_dict())
+                    else:
+                        content.append(delta.content)
+            if body.stream:
+                yield template.chunk({}, finish_reason)
+            else:
+                yield template.completion({"role": "assistant", "content": "".join(content)}, finish_reason)
+        except Exception as e:
+            provider_logger.error("Error in chat completion %s from %s: %s", chatcmpl_id, self.name, e, exc_info=True)
+            yield {
+                "error": self.error_message(e),
+                "model": body.model,
+                "id": chatcmpl_id,
+                "system_fingerprint": system_fingerprint,
+            }
@@ -0,0 +1,29 @@
+import time
+from typing import Any, Dict, Optional
+
+from config import QUOTA_MODE, QUOTA_REFILL_PERIOD
+
+# Quota is a lazily refilled balance: current_tokens is the balance as of
+# last_refill, and it grows by daily_token_limit per QUOTA_REFILL_PERIOD up to
+# daily_token_limit. Balances above the limit (e.g. admin top-ups) are kept.
+
+
+def lazy_refill_enabled() -> bool:
+    return QUOTA_MODE == "lazy"
+
+
+def refilled_balance(balance: float, limit: Optional[float], last_refill: Optional[float], now: float, period: float = QUOTA_REFILL_PERIOD) -> float:
+    if not lazy_refill_enabled() or not limit or last_refill is None:
+        return balance
+    refilled = min(limit, balance + limit * max(now - last_refill, 0) / period)
+    return max(balance, refilled)
+
+
+def effective_balance(document: Dict[str, Any], now: Optional[float] = None, period: float = QUOTA_REFILL_PERIOD) -> float:
+    return refilled_balance(
+        document.get("current_tokens") or 0,
+        document.get("daily_token_limit"),
+        document.get("last_refill") or document.get("last_reset"),
+        time.time() if now is None else now,
+        period,
+    )
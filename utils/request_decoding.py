@@ -0,0 +1,137 @@
+from dataclasses import dataclass
+from typing import Any, List, Literal, Tuple, TypedDict, Union
+
+from pydantic import ValidationError
+
+from utils.base import ChatCompletionRequest
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _DecodeErrors = (orjson.JSONDecodeError,)
+except ImportError:
+    import ujson
+
+    _loads = ujson.loads
+    _DecodeErrors = (ValueError,)
+
+# /v1/chat/completions bodies are decoded in one pass: orjson parses the bytes, the
+# scalar fields go through ChatCompletionRequest, and the messages are checked in
+# the same walk that measures them. Pydantic never sees the message array.
+
+
+class RequestDecodeError(ValueError):
+    pass
+
+
+class RequestTooLarge(RequestDecodeError):
+    pass
+
+
+async def read_body(http_request, limit: int) -> bytes:
+    """Read the request body, refusing it as soon as it passes ``limit`` bytes.
+
+    A declared Content-Length over the limit is refused before any of the body is
+    read; otherwise chunks are accumulated only while under the limit.
+    """
+    content_length = http_request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise RequestTooLarge(f"Request body of {content_length} bytes exceeds the {limit} byte limit")
+    body = bytearray()
+    async for chunk in http_request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise RequestTooLarge(f"Request body exceeds the {limit} byte limit")
+    return bytes(body)
+
+
+class ContentPart(TypedDict, total=False):
+    type: Literal["text", "image_url", "input_audio"]
+    text: str
+    image_url: dict
+
+
+class ChatMessage(TypedDict, total=False):
+    role: str
+    content: Union[str, List[ContentPart], None]
+    name: str
+    function_call: dict
+    tool_calls: list
+
+
+@dataclass(slots=True)
+class MessageStats:
+    # Characters of text content across all messages, as billed.
+    input_length: int = 0
+    messages: int = 0
+    text_parts: int = 0
+    image_parts: int = 0
+    other_parts: int = 0
+    last_user_message: str = ""
+
+
+def message_text(content: Union[str, List[ContentPart], None]) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def scan_messages(messages: Any) -> MessageStats:
+    """Check that ``messages`` are chat messages and measure them in one walk."""
+    if not isinstance(messages, list) or not messages:
+        raise RequestDecodeError("messages must be a non-empty array")
+
+    stats = MessageStats(messages=len(messages))
+    input_length = 0
+    last_user = None
+    for index, message in enumerate(messages):
+        if not isinstance(message, dict) or not isinstance(message.get("role"), str):
+            raise RequestDecodeError(f"messages[{index}] must be an object with a string role")
+        content = message.get("content")
+        if isinstance(content, str):
+            input_length += len(content)
+            stats.text_parts += 1
+        elif isinstance(content, list):
+            for part in content:
+                if not isinstance(part, dict):
+                    raise RequestDecodeError(f"messages[{index}].content parts must be objects")
+                part_type = part.get("type")
+                if part_type == "text":
+                    text = part.get("text")
+                    if not isinstance(text, str):
+                        raise RequestDecodeError(f"messages[{index}].content text parts must have a string text")
+                    input_length += len(text)
+                    stats.text_parts += 1
+                elif part_type == "image_url":
+                    stats.image_parts += 1
+                else:
+                    stats.other_parts += 1
+        elif content is not None:
+            raise RequestDecodeError(f"messages[{index}].content must be a string, an array of parts or null")
+        if message["role"] == "user":
+            last_user = content
+    stats.input_length = input_length
+    stats.last_user_message = message_text(last_user)
+    return stats
+
+
+def decode_chat_request(body: bytes) -> Tuple[ChatCompletionRequest, MessageStats]:
+    try:
+        data = _loads(body)
+    except _DecodeErrors as e:
+        raise RequestDecodeError(f"Invalid JSON: {e}")
+    if not isinstance(data, dict):
+        raise RequestDecodeError("Request body must be a JSON object")
+
+    messages = data.get("messages")
+    stats = scan_messages(messages)
+    data["messages"] = []
+    try:
+        request = ChatCompletionRequest.model_validate(data)
+    except ValidationError as e:
+        raise RequestDecodeError(str(e))
+    request.messages = messages
+    return request, stats
@@ -0,0 +1,32 @@
+import asyncio
+import time
+from typing import Optional
+
+from config import RESET_PERIOD, RESET_CHECK_INTERVAL
+from key_management import reset_period_tokens
+from utils.logger import user_logger
+
+_reset_task: Optional[asyncio.Task] = None
+
+
+async def run_reset_scheduler(period: str = RESET_PERIOD, check_interval: float = RESET_CHECK_INTERVAL):
+    while True:
+        started = time.monotonic()
+        try:
+            refilled = await asyncio.to_thread(reset_period_tokens, period)
+            user_logger.info("Token reset (%s) refilled %s users in %.2fs", period, refilled, time.monotonic() - started)
+        except Exception as e:
+            user_logger.error("Scheduled token reset failed: %s", e, exc_info=True)
+        await asyncio.sleep(check_interval)
+
+
+def start_reset_scheduler() -> asyncio.Task:
+    global _reset_task
+    if _reset_task is None or _reset_task.done():
+        _reset_task = asyncio.ensure_future(run_reset_scheduler())
+    return _reset_task
+
+
+def stop_reset_scheduler() -> None:
+    if _reset_task is not None:
+        _reset_task.cancel()
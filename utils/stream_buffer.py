@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+from contextlib import suppress
+from typing import AsyncGenerator, Union
+
+from config import (
+    STREAM_BUFFER_HIGH_WATERMARK,
+    STREAM_BUFFER_LOW_WATERMARK,
+    STREAM_BUFFER_GLOBAL_LIMIT,
+    STREAM_BUFFER_POLICY,
+)
+from utils.logger import chat_logger
+
+_buffer_stats = {"buffered_bytes": 0, "active_streams": 0, "paused": 0, "aborted": 0}
+
+
+def buffered_bytes() -> int:
+    return _buffer_stats["buffered_bytes"]
+
+
+def buffer_stats() -> dict:
+    return dict(_buffer_stats)
+
+
+class StreamBufferOverflow(Exception):
+    pass
+
+
+class StreamBuffer:
+    """Bounded queue between a provider stream and the client socket.
+
+    A producer task pulls from ``source`` while the consumer drains to the client.
+    Once this stream holds ``high_watermark`` bytes the producer stops pulling until
+    the client brings it back to ``low_watermark``. When all streams together exceed
+    ``global_limit`` the stream is either paused until its own buffer is empty
+    (``"pause"``) or aborted with ``StreamBufferOverflow`` (``"abort"``).
+    """
+
+    def __init__(
+        self,
+        source: AsyncGenerator[Union[str, bytes], None],
+        high_watermark: int = STREAM_BUFFER_HIGH_WATERMARK,
+        low_watermark: int = STREAM_BUFFER_LOW_WATERMARK,
+        global_limit: int = STREAM_BUFFER_GLOBAL_LIMIT,
+        policy: str = STREAM_BUFFER_POLICY,
+    ):
+        self.source = source
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.global_limit = global_limit
+        self.policy = policy
+        self.size = 0
+        self._queue = deque()
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._finished = False
+        self._error = None
+
+    async def _wait_writable(self):
+        _buffer_stats["paused"] += 1
+        self._writable.clear()
+        await self._writable.wait()
+
+    async def _reserve(self, size: int):
+        if self.size >= self.high_watermark:
+            await self._wait_writable()
+
+        if _buffer_stats["buffered_bytes"] + size > self.global_limit and self.size > 0:
+            if self.policy == "abort":
+                _buffer_stats["aborted"] += 1
+                raise StreamBufferOverflow(
+                    f"Stream buffers exceed {self.global_limit} bytes"
+                )
+            while self.size > 0:
+                await self._wait_writable()
+
+    def _release(self, size: int):
+        self.size -= size
+        _buffer_stats["buffered_bytes"] -= size
+        if self.size <= self.low_watermark:
+            self._writable.set()
+
+    async def _produce(self):
+        try:
+            async for item in self.source:
+                data = item.encode() if isinstance(item, str) else item
+                await self._reserve(len(data))
+                self._queue.append(data)
+                self.size += len(data)
+                _buffer_stats["buffered_bytes"] += len(data)
+                self._readable.set()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._finished = True
+            self._readable.set()
+
+    async def __aiter__(self):
+        _buffer_stats["active_streams"] += 1
+        producer = asyncio.ensure_future(self._produce())
+        try:
+            while True:
+                if isinstance(self._error, StreamBufferOverflow):
+                    raise self._error
+                if self._queue:
+                    data = self._queue.popleft()
+                    self._release(len(data))
+                    yield data
+                elif self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    self._readable.clear()
+                    await self._readable.wait()
+        finally:
+            _buffer_stats["active_streams"] -= 1
+            if not producer.done():
+                producer.cancel()
+                with suppress(asyncio.CancelledError):
+                    await producer
+            if self.size:
+                chat_logger.info("Dropping %s buffered bytes from closed stream", self.size)
+                self._release(self.size)
+                self._queue.clear()
+            await self.source.aclose()
@@ -1,20 +1,61 @@
+import asyncio
 import ujson
+from contextlib import aclosing
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from utils.token_utils import calculate_tokens
 from utils.discord_logger import log_chat_completion
+from utils.disconnect_utils import cancel_on_disconnect, ClientDisconnected, abandoned_requests
+from utils.logger import chat_logger
+from utils.stream_buffer import StreamBuffer, StreamBufferOverflow
+from utils.metrics import completion_duration, time_to_first_token, output_chars_per_second, provider_label
+from utils.tracing import add_span, span
 import time
 
-async def completion_streamer(provider, request, user_id, input_length, update_tokens_func, plan_name='default', client=None):
+async def completion_streamer(provider, request, user_id, input_length, update_tokens_func, plan_name='default', client=None, http_request=None, source=None, on_finish=None):
     output_length = 0
     tokens_deducted = False
     model_multiplier = provider.costs.get(request.model, 1)
     start_time = time.time()
+    trace_started = time.perf_counter()
     full_response = []
+    provider_name = provider_label(provider)
+
+    async def settle():
+        # Runs from the stream's finally and again as the response's background task,
+        # whichever comes first, so it must only take effect once.
+        nonlocal tokens_deducted
+        if tokens_deducted:
+            return
+        tokens_deducted = True
+        if on_finish is not None:
+            on_finish()
+        duration = time.time() - start_time
+        completion_duration.observe(duration, request.model, provider_name, "true")
+        if output_length and duration > 0:
+            output_chars_per_second.observe(output_length / duration, request.model, provider_name)
+        total_tokens_used = calculate_tokens(input_length, output_length, model_multiplier)
+        with span("billing"):
+            update_tokens_func(user_id, -total_tokens_used)
+
+        execution_time = time.time() - start_time
+        with span("log"):
+            await log_chat_completion(
+                user_id=user_id,
+                input_tokens=input_length,
+                output_tokens=output_length,
+                execution_time=execution_time,
+                model=request.model,
+                is_streaming=True
+            )
 
     async def stream_generator():
-        nonlocal output_length, tokens_deducted, full_response
+        nonlocal output_length, full_response
+        # Set once the client has been sent a terminating chunk ([DONE] or an error).
+        finished = False
+        upstream = cancel_on_disconnect(source or provider.create_chat_completions(request), http_request, "stream")
         try:
-            async for chunk in provider.create_chat_completions(request):
+            async for chunk in upstream:
                 if not isinstance(chunk, dict):
                     try:
                         chunk = ujson.loads(chunk)
@@ -23,15 +64,17 @@ async def completion_streamer(provider, request, user_id, input_length, update_t
                         continue
 
                 if "error" in chunk:
+                    finished = True
                     yield f"data: {ujson.dumps(chunk)}\n\n"
                     return
 
-                yield f"data: {ujson.dumps(chunk)}\n\n"
-
                 delta = chunk.get('choices', [{}])[0].get('delta', {})
                 
                 content = delta.get('content', '')
                 if content:
+                    if not output_length:
+                        time_to_first_token.observe(time.time() - start_time, request.model, provider_name)
+                        add_span("first_token", trace_started)
                     output_length += len(content)
                     full_response.append(content)
                     
@@ -43,28 +86,50 @@ async def completion_streamer(provider, request, user_id, input_length, update_t
                     if 'arguments' in function_call:
                         output_length += len(function_call['arguments'])
                         full_response.append(function_call['arguments'])
+
+                yield f"data: {ujson.dumps(chunk)}\n\n"
                 
+            finished = True
             yield "data: [DONE]\n\n"
+
+        except ClientDisconnected:
+            return
+
+        except (asyncio.CancelledError, GeneratorExit):
+            # Starlette cancels the response, and StreamBuffer its producer, as soon as the
+            # client goes away, usually before cancel_on_disconnect's watcher notices.
+            if not finished:
+                abandoned_requests["stream"] += 1
+                chat_logger.info("Client disconnected, cancelling upstream stream generation")
+            raise
             
         except Exception as e:
             print(f"Streaming error: {e}")
+            finished = True
             yield f"data: {ujson.dumps({'error': str(e)})}\n\n"
         
         finally:
-            if not tokens_deducted:
-                total_tokens_used = calculate_tokens(input_length, output_length, model_multiplier)
-                update_tokens_func(user_id, -total_tokens_used)
-                tokens_deducted = True
-                
-                if True:
-                    execution_time = time.time() - start_time
-                    await log_chat_completion(
-                        user_id=user_id,
-                        input_tokens=input_length,
-                        output_tokens=output_length,
-                        execution_time=execution_time,
-                        model=request.model,
-                        is_streaming=True
-                    )
+            await upstream.aclose()
+            add_span("upstream", trace_started)
+            await settle()
+
+    async def buffered_stream():
+        try:
+            async with aclosing(StreamBuffer(stream_generator()).__aiter__()) as chunks:
+                async for data in chunks:
+                    yield data
+        except StreamBufferOverflow as e:
+            chat_logger.warning("Streaming aborted: %s", e)
+            yield f"data: {ujson.dumps({'error': 'Server stream buffer limit exceeded'})}\n\n"
+
+    body = buffered_stream()
+
+    async def cleanup():
+        # A client that disconnects while the response is starting cancels it before
+        # the body is iterated, and a generator that never started runs no finally.
+        await body.aclose()
+        if not tokens_deducted:
+            abandoned_requests["stream"] += 1
+        await settle()
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    return StreamingResponse(body, media_type="text/event-stream", background=BackgroundTask(cleanup))
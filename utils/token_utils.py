@@ -12,3 +12,16 @@ def calculate_tokens(input_length, output_length, model_multiplier):
     
     return total_tokens
 
+def get_output_length(response: dict) -> int:
+    if 'choices' in response and response['choices']:
+        output_length = 0
+        for choice in response['choices']:
+            output_length += len(choice['message'].get('content', ''))
+            if 'function_call' in choice['message']:
+                function_call = choice['message']['function_call']
+                output_length += len(function_call.get('name', ''))
+                output_length += len(function_call.get('arguments', ''))
+        return output_length
+    elif 'content' in response:
+        return len(response.get('content', ''))
+    return 0
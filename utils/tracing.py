@@ -0,0 +1,119 @@
+import contextvars
+import json
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from config import TRACE_LOG_MIN_DURATION
+from utils.logger import setup_logger
+
+# One Trace per HTTP request, opened by TracingMiddleware. Spans recorded while
+# it is current are returned in the Server-Timing header (those that finished
+# before the response started) and written to logs/trace.log when the response
+# completes, keyed by the request id chat_completions assigns.
+
+trace_logger = setup_logger('trace', 'trace.log', log_format="text", console=False)
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    __slots__ = ("request_id", "path", "started", "wall_started", "spans")
+
+    def __init__(self, path: str):
+        self.request_id: Optional[str] = None
+        self.path = path
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        # (name, offset from start, duration), in seconds.
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={duration * 1000:.2f}" for name, _, duration in self.spans]
+        entries.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(entries)
+
+    def to_json(self, status: int) -> str:
+        return json.dumps({
+            "request_id": self.request_id,
+            "path": self.path,
+            "status": status,
+            "start": self.wall_started,
+            "duration_ms": round(self.elapsed() * 1000, 3),
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for name, offset, duration in self.spans
+            ],
+        })
+
+
+def set_request_id(request_id: str) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.request_id = request_id
+
+
+def add_span(name: str, started: float) -> None:
+    """Record a span from ``started`` (a ``time.perf_counter()`` value) to now."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans.append((name, started - trace.started, time.perf_counter() - started))
+
+
+@contextmanager
+def span(name: str):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        trace.spans.append((name, started - trace.started, ended - started))
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware that opens a Trace per HTTP request.
+
+    Adds ``Server-Timing`` and ``X-Request-Id`` to the response and, once the body
+    is fully sent, logs the trace and hands slow requests to the profiler.
+    """
+
+    def __init__(self, app, min_duration: float = TRACE_LOG_MIN_DURATION):
+        self.app = app
+        self.min_duration = min_duration
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["path"])
+        token = current_trace.set(trace)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                if trace.request_id:
+                    headers.append((b"x-request-id", trace.request_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_trace.reset(token)
+            if trace.elapsed() >= self.min_duration:
+                trace_logger.info("%s", trace.to_json(status))
+            from utils.profiling import slow_request_profiler
+            if slow_request_profiler.enabled:
+                await slow_request_profiler.capture(trace)